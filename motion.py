@@ -0,0 +1,127 @@
+"""
+Closed loop control of straight scan legs from pushed telemetry
+
+runs once per telemetry update (10-50 Hz), closes on distance along the leg,
+cross track error and heading, and pipelines speed corrections so the event
+loop is never blocked waiting on the robot
+
+frames follow the SDK: x forward, y right, yaw in degrees clockwise
+"""
+import asyncio
+import logging
+import math
+import time
+
+import numpy as np
+from simple_pid import PID
+
+logger = logging.getLogger(__name__)
+
+
+def wrap_degrees(angle):
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class LoopTiming(object):
+    """ loop period and jitter statistics"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.periods = []
+        self.last = None
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.periods.append(now - self.last)
+        self.last = now
+
+    def to_dict(self):
+        periods = np.array(self.periods)
+        if not len(periods):
+            return {"iterations": 0}
+        target = 1.0 / self.rate
+        return {"iterations": len(periods) + 1,
+                "mean_period": float(periods.mean()),
+                "jitter_std": float(periods.std()),
+                "max_jitter": float(np.abs(periods - target).max())}
+
+
+class LegController(object):
+    """ drives a straight leg of the given length along the robot's x or y axis"""
+
+    # m/s^2 style gain on remaining distance, slows the approach at the end
+    k_along = 1.5
+    min_speed = 0.03
+    # stop within this many meters of the end of the leg
+    tolerance = 0.01
+    max_correction = 0.1
+    max_turn = 30.0
+
+    def __init__(self, telemetry, channel, rate=20, k_cross=(2.0, 0.0, 0.1), k_yaw=(2.0, 1.0, 0.05)):
+        self.telemetry = telemetry
+        self.channel = channel
+        self.rate = rate
+        self.k_cross = k_cross
+        self.k_yaw = k_yaw
+        self.timing = LoopTiming(rate)
+        self.updated = asyncio.Event()
+        self.log = []
+
+    def _on_update(self, telemetry):
+        self.updated.set()
+
+    async def _next_update(self):
+        """ waits for fresh telemetry, or one control period if the push is late"""
+        try:
+            await asyncio.wait_for(self.updated.wait(), 1.0 / self.rate)
+        except asyncio.TimeoutError:
+            pass
+        self.updated.clear()
+
+    @staticmethod
+    def body_speed(world, yaw):
+        """ world frame (vx, vy) seen from a robot at yaw degrees"""
+        c, s = math.cos(math.radians(yaw)), math.sin(math.radians(yaw))
+        return c * world[0] + s * world[1], -s * world[0] + c * world[1]
+
+    async def run(self, distance, axis='x', speed=0.2, timeout=None):
+        """ drives distance meters along the robot's axis ('x' or 'y'), returns final errors"""
+        sign = 1.0 if distance >= 0 else -1.0
+        x0, y0, yaw0 = self.telemetry.position
+        # leg direction and its normal in the world frame, fixed at the start
+        heading = math.radians(yaw0) + (0.0 if axis == 'x' else math.pi / 2)
+        u = (math.cos(heading), math.sin(heading))
+        n = (-u[1], u[0])
+        limits = (-self.max_correction, self.max_correction)
+        pid_cross = PID(*self.k_cross, setpoint=0, output_limits=limits)
+        pid_yaw = PID(*self.k_yaw, setpoint=0, output_limits=(-self.max_turn, self.max_turn))
+        timeout = timeout or 2 * abs(distance) / abs(speed) + 2.0
+
+        self.telemetry.listeners.append(self._on_update)
+        start = time.perf_counter()
+        try:
+            while True:
+                await self._next_update()
+                self.timing.tick()
+                x, y, yaw = self.telemetry.position
+                progress = (x - x0) * u[0] + (y - y0) * u[1]
+                e_cross = (x - x0) * n[0] + (y - y0) * n[1]
+                yaw_err = wrap_degrees(yaw - yaw0)
+                remaining = abs(distance) - sign * progress
+                self.log.append((time.perf_counter() - start, progress, e_cross, yaw_err))
+                if remaining <= self.tolerance or time.perf_counter() - start > timeout:
+                    break
+                along = sign * max(min(abs(speed), self.k_along * remaining), self.min_speed)
+                correction = pid_cross(e_cross)
+                vx, vy = self.body_speed((along * u[0] + correction * n[0],
+                                          along * u[1] + correction * n[1]), yaw)
+                wz = pid_yaw(yaw_err)
+                self.channel.send_nowait("chassis speed x {:.3f} y {:.3f} z {:.2f}".format(vx, vy, wz))
+        finally:
+            self.telemetry.listeners.remove(self._on_update)
+            await self.channel.send("chassis speed x 0 y 0 z 0")
+        if remaining > self.tolerance:
+            logger.warning("leg timed out %.3f m short", remaining)
+        return {"progress": progress, "cross_track": e_cross, "yaw_error": yaw_err,
+                "timed_out": remaining > self.tolerance, "timing": self.timing.to_dict()}
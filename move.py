@@ -7,13 +7,19 @@ import asyncio
 import os
 from simple_pid import PID
 
-import Jetson.GPIO as GPIO
 import time
 
 import logging
 
-from radar.sweep import VNAGPR
-from radar.tdr import TDR
+from radar.session import VNASession
+from radar.tdr import TDR, capture_times, resample_dzt
+from radar.spatial import POSE_FILE, write_poses
+from radar.catalog import Catalog, FAILED
+from radar.processing import ProcessingChain
+from radar.migration import MIGRATED_SUFFIX, migrate_dzt, parse_migration
+from telemetry import PoseLog, Telemetry
+from sdk import CommandChannel
+from motion import LegController
 import datetime
 
 from concurrent.futures import ProcessPoolExecutor
@@ -22,15 +28,26 @@ from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# simulated pins only when asked for, a broken GPIO install on the rover
+# must not turn the sprayer into a silent no-op
+if os.environ.get("ROVER_SIM"):
+    from sim import gpio as GPIO
+else:
+    import Jetson.GPIO as GPIO
+
 # In direct connection mode, the default IP address of the robot is 192.168.42.2 and the control command port is port 40923.
 host = os.environ.get("djihost", "192.168.42.2")
 
 
 
 class RobotMove(object):
-    process_executor = ProcessPoolExecutor(max_workers=1)
+    # shared by post-run TDR jobs, leave a core for the event loop
+    process_workers = max(1, (os.cpu_count() or 2) - 1)
+    process_executor = ProcessPoolExecutor(max_workers=process_workers)
 
     robot_ip = host
+    ctrl_port = 40923
+    event_port = 40925
     x = 0
     y = 0
     z = 0
@@ -42,17 +59,42 @@ class RobotMove(object):
     #gpio config
     sprayer_output_pin = 13
 
+    # telemetry push rate in Hz (the SDK accepts 1, 5, 10, 20, 30 or 50),
+    # also the rate of the closed loop leg controller
+    push_freq = 20
+    push_port = 40924
+    # close x / y legs on pushed pose when it's fresh, open loop timing otherwise
+    closed_loop = True
+    # DZT traces are resampled to this spacing along the driven path
+    scans_per_meter = 50.0
+    # run TDR on sweeps as they are captured instead of over the folder afterwards
+    incremental_tdr = True
+
 
-    def __init__(self):
+    def __init__(self, vna_session=None):
         """ Each robot move class can only have one running start task"""
         self.start_lock = asyncio.Lock()
         self.start_coro = None
+        self.vna_session = vna_session or VNASession()
+        # pose pushed by the robot, read without control channel round trips
+        self.telemetry = Telemetry(push_port=self.push_port)
+        self.last_leg = None
+        # processing stages and migration for the current run's traces, see
+        # radar/processing.py and radar/migration.py
+        self.processing = None
+        self.migration = None
         self.setup_gpio()
 
 
     def to_dict(self):
         data = {"x": self.x_rel, "y": self.y_rel, "z": self.z_rel,
-                "is_running": self.start_lock.locked()}
+                "is_running": self.start_lock.locked(),
+                "pose": self.telemetry.to_dict()}
+        if hasattr(self, 'channel'):
+            data["commands"] = self.channel.stats.to_dict()
+            data["command_resyncs"] = self.channel.resyncs
+        if self.last_leg is not None:
+            data["last_leg"] = self.last_leg
 
         return data
 
@@ -74,35 +116,33 @@ class RobotMove(object):
 
     async def connect(self):
 
-        self.ctrl_reader, self.ctrl_writer = await asyncio.open_connection(self.robot_ip, 40923)
-        self.event_reader, self.event_writer =  await asyncio.open_connection(self.robot_ip, 40925)
-        self.ctrl_reader1, self.ctrl_writer1 = await asyncio.open_connection(self.robot_ip, 40923)
+        self.ctrl_reader, self.ctrl_writer = await asyncio.open_connection(self.robot_ip, self.ctrl_port)
+        self.event_reader, self.event_writer =  await asyncio.open_connection(self.robot_ip, self.event_port)
+        self.ctrl_reader1, self.ctrl_writer1 = await asyncio.open_connection(self.robot_ip, self.ctrl_port)
+        # all commands on a socket go through its channel so replies can't get mixed up
+        self.channel = CommandChannel(self.ctrl_reader, self.ctrl_writer).start()
+        self.channel1 = CommandChannel(self.ctrl_reader1, self.ctrl_writer1).start()
+        await self.telemetry.start(self.event_reader)
 
         self.pid_z = PID(1, 0.1, 0.05, setpoint=1)
         self.start_z = None
 
     async def send_command(self, command, read_socket=None, write_socket=None):
-        read_socket = read_socket or self.ctrl_reader
-        write_socket = write_socket or self.ctrl_writer
+        channel = self.channel1 if read_socket is self.ctrl_reader1 else self.channel
         print("send command ", command)
-        write_socket.write((command + ';').encode("utf8"))
-        try:
-            result = await asyncio.wait_for(read_socket.read(1024), timeout=3.0)
-        except asyncio.TimeoutError:
+        result = await channel.send(command)
+        if result is None:
             print('timeout!')
             return None
         print(result)
-        return result.decode().strip()
-
-    async def read_events(self):
-        print("read events coro")
-        while True:
-            data = await self.event_reader.read(4096)
-            print(f'Received: {data.decode()!r}')
-        print("exited read events coro")
-
+        return result
 
     async def _get_position(self, read_socket, write_socket):
+        if self.telemetry.fresh():
+            self.x, self.y, self.z = self.telemetry.position
+            if self.start_z is None:
+                self.start_z = self.z
+            return
         position = await self.send_command("chassis position ?", read_socket=read_socket, write_socket=write_socket)
         print(position)
         try:
@@ -133,32 +173,79 @@ class RobotMove(object):
             print("position loop", position)
             await asyncio.sleep(5)
 
-    @staticmethod
-    def write_tdr(name):
+    @classmethod
+    def migrate(cls, name, dzt, migration, signed):
+        """ writes the migrated profile next to the DZT"""
+        try:
+            start = time.perf_counter()
+            migrate_dzt(dzt, dzt + MIGRATED_SUFFIX, parse_migration(migration), signed=signed)
+            Catalog().update(name, migrated_bytes=os.path.getsize(dzt + MIGRATED_SUFFIX),
+                             migration={"method": migration, "seconds": time.perf_counter() - start})
+        except:
+            logger.exception("Failed to migrate {}".format(dzt))
+
+    @classmethod
+    def write_tdr(cls, name, processing=None, migration=None):
         try:
             tdr = TDR(use_csv=True)
             d = "data/{}".format(name)
-            tdr.listFolder(d + '/', d+'o')
+            chain = ProcessingChain.parse(processing)
+            tdr.listFolder(d + '/', d+'o', workers=cls.process_workers, executor=cls.process_executor,
+                           spm=cls.scans_per_meter, chain=chain)
+            if chain is not None:
+                Catalog().processed(name, d + 'o', processing=chain.report())
+            else:
+                Catalog().processed(name, d + 'o')
         except:
             logger.exception("Failed post proccessing job ")
+            Catalog().update(name, state=FAILED)
+            return
+        if migration:
+            cls.migrate(name, d + 'o', migration, signed=chain is not None)
 
-    async def write_gpr_data(self, gpr, name, seconds):
-        # TODO re-write GPR device opening to be peristent
-        """ starts recording existing GPR session and converts TDR when complete in a thread"""
-        await gpr.writedata(name, seconds)
+    @classmethod
+    def place_dzt(cls, name, directory, dzt, poses, processing=None, migration=None):
+        """ resamples an incrementally written DZT along the driven path"""
+        try:
+            resample_dzt(dzt, capture_times(directory), poses, cls.scans_per_meter)
+            Catalog().processed(name, dzt)
+        except:
+            logger.exception("Failed to resample {}".format(dzt))
+            Catalog().update(name, state=FAILED)
+            return
+        if migration:
+            cls.migrate(name, dzt, migration, signed=ProcessingChain.parse(processing) is not None)
+
+    async def write_gpr_data(self, name, seconds):
+        """ records on the persistent GPR session, the DZT is written as sweeps arrive
+
+        without incremental TDR the folder is converted in a thread when the capture is done
+        """
+        start = time.time()
+        dzt = "data/{}o".format(name) if self.incremental_tdr else None
+        # pose log for the capture, traces are placed along the path from it
+        pose_log = PoseLog(self.telemetry, since=start - 1.0).start()
+        try:
+            directory = await self.vna_session.capture(name, seconds, dzt=dzt, processing=self.processing)
+        finally:
+            pose_log.stop()
+        poses = pose_log.array()
+        if len(poses):
+            write_poses(os.path.join(directory, POSE_FILE), poses)
         loop = asyncio.get_event_loop()
-        return loop.run_in_executor(None, self.write_tdr, name)
+        if dzt is None:
+            return loop.run_in_executor(None, self.write_tdr, name, self.processing, self.migration)
+        if len(poses) and self.scans_per_meter:
+            return loop.run_in_executor(None, self.place_dzt, name, directory, dzt, poses,
+                                        self.processing, self.migration)
+        # the catalog is a file rewrite, kept off the event loop
+        return loop.run_in_executor(None, Catalog().processed, name, dzt)
 
     async def record_gpr(self, seconds):
-        # TODO keep persistent session open to GPR device
         """ starts processing GPR for specified number of seconds in another coro, which spawns a thread for TDR, returns before complete"""
-
-
-        gpr = VNAGPR(use_raw=False)
-        await gpr.run()
         name = datetime.datetime.utcnow().isoformat()
 
-        task = asyncio.ensure_future(self.write_gpr_data(gpr, name, seconds))
+        task = asyncio.ensure_future(self.write_gpr_data(name, seconds))
         return task
 
 
@@ -169,7 +256,20 @@ class RobotMove(object):
         if x and y:
             logger.warning("unable to move with both X and Y")
 
-        if x:
+        if (x or y) and self.closed_loop and self.telemetry.fresh():
+            if record_gpr:
+                gpr_task = await self.record_gpr(abs(x or y) / abs(speed))
+            controller = LegController(self.telemetry, self.channel, rate=self.push_freq)
+            self.last_leg = await controller.run(x or y, axis='x' if x else 'y', speed=speed)
+            print("leg", self.last_leg)
+            if record_gpr:
+                await gpr_task
+            if x:
+                self.x_rel += x
+            else:
+                self.y_rel += y
+
+        elif x:
             t = abs(x) / abs(speed)
             if x < 0:
                 speed = -abs(speed)
@@ -205,8 +305,7 @@ class RobotMove(object):
 
     async def scan_square(self, distance):
         for i in range(6):
-            await self.send_command("chassis attitude ?")
-            await self.send_command("chassis position ?")
+            print("pose", self.telemetry.to_dict())
 
 
 
@@ -218,8 +317,7 @@ class RobotMove(object):
             await self.move(y=0.1 * distance, speed=0.1)
 
 
-            await self.send_command("chassis attitude ?")
-            await self.send_command("chassis position ?")
+            print("pose", self.telemetry.to_dict())
             #await self._run_correction(read_socket=self.ctrl_reader, write_socket=self.ctrl_writer)
 
     async def _start(self, distance, pattern, record_gpr):
@@ -229,7 +327,12 @@ class RobotMove(object):
 
 
                 await self.send_command("command")
-                await self.send_command("chassis push freq 10")
+                await self.send_command("chassis push position on pfreq {0} attitude on afreq {0}".format(self.push_freq))
+                # give the first pushes a chance to arrive so legs can run closed loop
+                for _ in range(10):
+                    if self.telemetry.fresh():
+                        break
+                    await asyncio.sleep(1.0 / self.push_freq)
                 #await self.send_command("stream on")
                 await self._get_position(read_socket=self.ctrl_reader, write_socket=self.ctrl_writer)
 
@@ -247,8 +350,10 @@ class RobotMove(object):
         finally:
             await self.send_command("quit")
 
-    async def start(self, distance=1, pattern="square", record_gpr=False):
+    async def start(self, distance=1, pattern="square", record_gpr=False, processing=None, migration=None):
         print("called start with distance = {}".format(distance))
+        self.processing = processing
+        self.migration = migration
         if self.start_coro is not None:
             try:
                 self.start_coro.cancel()
@@ -0,0 +1,214 @@
+"""
+Append-only binary container for VNA sweeps
+
+layout (little endian):
+    magic     6s   b'RVBCAP'
+    version   H
+    header    I    total header size in bytes, records start here
+    points    I    frequency points per sweep
+    settings  I    length of the JSON sweep settings that follow
+    settings  JSON
+    freq      float64[points]
+then fixed size records of
+    time      float64        POSIX seconds (UTC)
+    s21       complex64[points]
+
+a record cut short by a crash is ignored by the reader
+
+convert a legacy one-CSV-per-sweep scan directory with
+python3 capture.py data/<name>
+"""
+import argparse
+import csv
+import datetime
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'RVBCAP'
+VERSION = 1
+CAPTURE_FILE = 'sweeps.rvc'
+_PREFIX = struct.Struct('<6sHIII')
+
+
+def record_dtype(points):
+    return np.dtype([('time', '<f8'), ('s21', '<c8', (points,))])
+
+
+def read_header(fh):
+    """ returns (header_size, freq, settings) from an open capture file"""
+    prefix = fh.read(_PREFIX.size)
+    if len(prefix) != _PREFIX.size:
+        raise ValueError("truncated capture header")
+    magic, version, header_size, points, settings_len = _PREFIX.unpack(prefix)
+    if magic != MAGIC:
+        raise ValueError("not a capture file")
+    if version != VERSION:
+        raise ValueError("unsupported capture version {}".format(version))
+    settings = json.loads(fh.read(settings_len).decode())
+    freq = np.frombuffer(fh.read(8 * points), dtype='<f8')
+    return header_size, freq, settings
+
+
+class CaptureWriter(object):
+    """ appends sweeps to a capture file, creating it with freq/settings on first use"""
+
+    def __init__(self, path, freq, settings=None):
+        self.path = path
+        self.freq = np.asarray(freq, dtype='<f8')
+        self.settings = settings or {}
+        self.dtype = record_dtype(len(self.freq))
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as fh:
+                self.header_size, freq, _ = read_header(fh)
+            if len(freq) != len(self.freq) or not np.array_equal(freq, self.freq):
+                raise ValueError("frequency axis does not match {}".format(path))
+            # drop any partial record left by an interrupted write
+            size = os.path.getsize(path)
+            whole = self.header_size + (size - self.header_size) // self.dtype.itemsize * self.dtype.itemsize
+            self.fh = open(path, 'r+b')
+            self.fh.truncate(whole)
+            self.fh.seek(whole)
+        else:
+            self.fh = open(path, 'wb')
+            self.fh.write(self._header())
+        self.count = (self.fh.tell() - self.header_size) // self.dtype.itemsize
+
+    def _header(self):
+        settings = json.dumps(self.settings).encode()
+        self.header_size = _PREFIX.size + len(settings) + self.freq.nbytes
+        prefix = _PREFIX.pack(MAGIC, VERSION, self.header_size, len(self.freq), len(settings))
+        return prefix + settings + self.freq.tobytes()
+
+    def write(self, timestamp, s21):
+        self.write_many([timestamp], np.atleast_2d(s21))
+
+    def write_many(self, timestamps, s21):
+        """ appends len(timestamps) sweeps with a single write"""
+        records = np.empty(len(timestamps), dtype=self.dtype)
+        records['time'] = timestamps
+        records['s21'] = s21
+        self.fh.write(records.tobytes())
+        self.count += len(records)
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CaptureReader(object):
+    """ memory maps the records of a capture file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fh:
+            self.header_size, self.freq, self.settings = read_header(fh)
+        self.dtype = record_dtype(len(self.freq))
+        count = (os.path.getsize(path) - self.header_size) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r',
+                                     offset=self.header_size, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def times(self):
+        return self.records['time']
+
+    @property
+    def s21(self):
+        return self.records['s21']
+
+
+class CSVWriter(object):
+    """ legacy layout, one CSV file of freq,real,imag rows per sweep named by its UTC ISO timestamp"""
+
+    def __init__(self, directory, freq):
+        self.directory = directory
+        self.freq = np.asarray(freq).tolist()
+
+    def write_many(self, timestamps, s21):
+        for timestamp, trace in zip(timestamps, s21):
+            name = datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+            with open(os.path.join(self.directory, name), 'w') as e:
+                writer = csv.writer(e)
+                writer.writerows(zip(self.freq, trace.real.tolist(), trace.imag.tolist()))
+
+    def close(self):
+        pass
+
+
+def count_records(path):
+    """ number of whole sweeps in a capture file, read from its header only"""
+    with open(path, 'rb') as fh:
+        header_size, freq, _ = read_header(fh)
+    return (os.path.getsize(path) - header_size) // record_dtype(len(freq)).itemsize
+
+
+def csv_timestamp(path):
+    """ POSIX time of a legacy CSV sweep from its UTC ISO file name, None if it isn't one"""
+    try:
+        ts = datetime.datetime.fromisoformat(os.path.basename(path))
+    except ValueError:
+        return None
+    return ts.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def convert_csv_dir(directory, output=None, remove=False):
+    """ packs a legacy directory of per-sweep CSV files into a capture file
+
+    file names are the UTC ISO timestamps written by VNAGPR.writedata
+    """
+    output = output or os.path.join(directory, CAPTURE_FILE)
+    # skips the output and anything else that isn't a timestamped sweep (pose logs)
+    files = [f for f in sorted(glob.glob(os.path.join(directory, '*')))
+             if os.path.abspath(f) != os.path.abspath(output) and csv_timestamp(f) is not None]
+    writer = None
+    try:
+        for f in files:
+            data = np.loadtxt(f, delimiter=',', ndmin=2)
+            ts = csv_timestamp(f)
+            if writer is None:
+                writer = CaptureWriter(output, data[:, 0], {'converted_from': 'csv'})
+            writer.write(ts, data[:, 1] + 1j * data[:, 2])
+    finally:
+        if writer is not None:
+            writer.close()
+    if remove and writer is not None:
+        for f in files:
+            os.remove(f)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(
+    description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", type=str,
+                    help="scan directory of CSV sweeps")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                    help="capture file, defaults to <directory>/" + CAPTURE_FILE)
+    parser.add_argument("--remove", action="store_true",
+                    help="delete the CSV files after converting")
+    args = parser.parse_args()
+    output = convert_csv_dir(args.directory, args.output, remove=args.remove)
+    print("wrote {} sweeps to {}".format(count_records(output), output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Catalog of the scans in the data directory
+
+the capture and TDR stages record what they did to each scan in
+<data>/catalog.json as they go (state, sweep count, duration, sizes), so
+listing scans doesn't need to walk every scan directory. the file is
+replaced atomically on every update, readers never see a partial write
+
+    {"scans": {"<name>": {"date": ..., "state": ..., "samples": ..., ...}}}
+
+states: capturing, captured, processed, failed
+
+rebuild the catalog of an existing data directory with
+python3 catalog.py data
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+
+try:
+    from .capture import CAPTURE_FILE, count_records
+except ImportError:
+    from capture import CAPTURE_FILE, count_records
+
+CATALOG_FILE = 'catalog.json'
+
+CAPTURING = 'capturing'
+CAPTURED = 'captured'
+PROCESSED = 'processed'
+FAILED = 'failed'
+
+
+def scan_date(name):
+    """ ISO start time from a scan named by its UTC ISO timestamp, None otherwise"""
+    try:
+        return datetime.datetime.fromisoformat(name).isoformat()
+    except ValueError:
+        return None
+
+
+def scan_stats(directory):
+    """ sweep count and bytes on disk of a scan directory, from one directory listing"""
+    capture, sweep_files, size = None, 0, 0
+    for entry in os.scandir(directory):
+        if not entry.is_file():
+            continue
+        size += entry.stat().st_size
+        if entry.name == CAPTURE_FILE:
+            capture = entry.path
+        elif scan_date(entry.name):
+            # legacy layout, one file per sweep
+            sweep_files += 1
+    samples = count_records(capture) if capture else sweep_files
+    return {"samples": samples, "capture_bytes": size}
+
+
+class Catalog(object):
+    """ read-modify-write access to a data directory's catalog, for the one process writing scans"""
+
+    lock = threading.Lock()
+
+    def __init__(self, root='data'):
+        self.root = root
+        self.path = os.path.join(root, CATALOG_FILE)
+
+    def scans(self):
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)["scans"]
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, scans):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({"scans": scans}, fh, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def update(self, name, **fields):
+        """ merges fields into a scan's entry, creating it if needed"""
+        with self.lock:
+            scans = self.scans()
+            entry = scans.setdefault(name, {"date": scan_date(name)})
+            entry.update(fields, updated=time.time())
+            self._write(scans)
+            return entry
+
+    def captured(self, name, directory, duration):
+        return self.update(name, state=CAPTURED, duration=duration, **scan_stats(directory))
+
+    def processed(self, name, dzt, **fields):
+        return self.update(name, state=PROCESSED, dzt_bytes=os.path.getsize(dzt), **fields)
+
+    def rebuild(self):
+        """ catalogs every scan directory under root, for data captured before the catalog"""
+        with self.lock:
+            scans = self.scans()
+            for entry in os.scandir(self.root):
+                if not entry.is_dir() or entry.name == 'None':
+                    continue
+                scan = scans.setdefault(entry.name, {"date": scan_date(entry.name)})
+                scan.update(scan_stats(entry.path), updated=time.time())
+                dzt = entry.path + 'o'
+                if os.path.exists(dzt):
+                    scan.update(state=PROCESSED, dzt_bytes=os.path.getsize(dzt))
+                else:
+                    scan.setdefault("state", CAPTURED)
+            self._write(scans)
+            return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="data directory holding the scans")
+    args = parser.parse_args()
+    scans = Catalog(args.root).rebuild()
+    print("cataloged {} scans in {}".format(len(scans), os.path.join(args.root, CATALOG_FILE)))
+
+
+if __name__ == "__main__":
+    main()
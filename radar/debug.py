@@ -0,0 +1,177 @@
+"""
+Sampled TDR trace dump for diagnostics, off unless TDR_DEBUG_FILE is set
+
+every TDR_DEBUG_EVERY-th trace (0 for none) and any trace asked for with
+TraceDump.request() is appended to the dump. once it would pass
+TDR_DEBUG_MAX_BYTES it is rotated to .1, .2, ... keeping TDR_DEBUG_BACKUPS
+old files, so the dump never grows without bound
+
+layout (little endian):
+    magic     6s   b'RVTDBG'
+    version   H
+then records of
+    time      float64           POSIX seconds of the sweep (0 if unknown)
+    start     float32           ns, time of the first sample
+    step      float32           ns between samples
+    samples   uint32
+    td        float32[samples]  TDR magnitude
+
+inspect a dump with
+python3 debug.py tdr.dbg [-r record -o trace.csv]
+"""
+import argparse
+import datetime
+import os
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b'RVTDBG'
+VERSION = 1
+_PREFIX = struct.Struct('<6sH')
+_RECORD = struct.Struct('<dffI')
+
+
+class TraceDump(object):
+    """ appends sampled traces to a size capped, rotated binary dump"""
+
+    def __init__(self, path, every=100, max_bytes=16 * 2**20, backups=3):
+        self.path = path
+        self.every = every
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.seen = 0
+        self.written = 0
+        self.requested = 0
+        self.lock = threading.Lock()
+        self.fh = None
+
+    def request(self, count=1):
+        """ dumps the next count traces whatever the sampling"""
+        with self.lock:
+            self.requested += count
+
+    def _wanted(self):
+        self.seen += 1
+        if self.requested:
+            self.requested -= 1
+            return True
+        return self.every > 0 and self.seen % self.every == 0
+
+    def _open(self):
+        if self.fh is None:
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self.fh = open(self.path, 'ab')
+            if new:
+                self.fh.write(_PREFIX.pack(MAGIC, VERSION))
+        return self.fh
+
+    def _rotate(self):
+        self.fh.close()
+        self.fh = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self.path, i)):
+                os.replace('{}.{}'.format(self.path, i), '{}.{}'.format(self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def write(self, timestamp, time_ns, td):
+        """ dumps one trace if it's sampled, time_ns is its time axis"""
+        with self.lock:
+            if not self._wanted():
+                return False
+            td = np.asarray(td, dtype='<f4')
+            step = float(time_ns[1] - time_ns[0]) if len(time_ns) > 1 else 0.0
+            record = _RECORD.pack(timestamp or 0.0, time_ns[0], step, len(td)) + td.tobytes()
+            fh = self._open()
+            if fh.tell() > _PREFIX.size and fh.tell() + len(record) > self.max_bytes:
+                self._rotate()
+                fh = self._open()
+            fh.write(record)
+            fh.flush()
+            self.written += 1
+            return True
+
+    def write_many(self, timestamps, time_ns, td):
+        for timestamp, trace in zip(timestamps, td):
+            self.write(timestamp, time_ns, trace)
+
+    def close(self):
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+    def to_dict(self):
+        return {"path": self.path, "every": self.every, "seen": self.seen,
+                "written": self.written, "requested": self.requested}
+
+
+_dump = None
+_dump_lock = threading.Lock()
+
+
+def trace_dump():
+    """ the process wide dump configured from the environment, None when disabled"""
+    global _dump
+    path = os.environ.get('TDR_DEBUG_FILE')
+    if not path:
+        return None
+    with _dump_lock:
+        if _dump is None:
+            _dump = TraceDump(path, every=int(os.environ.get('TDR_DEBUG_EVERY', 100)),
+                              max_bytes=int(os.environ.get('TDR_DEBUG_MAX_BYTES', 16 * 2**20)),
+                              backups=int(os.environ.get('TDR_DEBUG_BACKUPS', 3)))
+    return _dump
+
+
+def read_dump(path):
+    """ yields (timestamp, time_ns, td) for every whole record in a dump"""
+    with open(path, 'rb') as fh:
+        prefix = fh.read(_PREFIX.size)
+        if len(prefix) != _PREFIX.size:
+            return
+        magic, version = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError("not a trace dump")
+        if version != VERSION:
+            raise ValueError("unsupported trace dump version {}".format(version))
+        while True:
+            header = fh.read(_RECORD.size)
+            if len(header) != _RECORD.size:
+                return
+            timestamp, start, step, samples = _RECORD.unpack(header)
+            data = fh.read(4 * samples)
+            if len(data) != 4 * samples:
+                # cut short by a crash
+                return
+            yield timestamp, start + step * np.arange(samples), np.frombuffer(data, dtype='<f4')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="trace dump")
+    parser.add_argument("-r", "--record", type=int, default=None,
+                    help="record to export, negative counts from the end")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                    help="CSV file for the exported record's time / magnitude")
+    args = parser.parse_args()
+
+    records = list(read_dump(args.path))
+    for i, (timestamp, time_ns, td) in enumerate(records):
+        when = datetime.datetime.utcfromtimestamp(timestamp).isoformat() if timestamp else "-"
+        print("{:5d} {:26s} {:6d} samples {:8.2f}-{:8.2f} ns  peak {:.3e} at {:.2f} ns".format(
+            i, when, len(td), time_ns[0], time_ns[-1], td.max(), time_ns[np.argmax(td)]))
+    if args.record is not None:
+        timestamp, time_ns, td = records[args.record]
+        out = args.output or "trace.csv"
+        np.savetxt(out, np.column_stack([time_ns, td]), delimiter=',', header='time_ns,td', comments='')
+        print("wrote record {} to {}".format(args.record, out))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,60 @@
 import socket
 import logging
+import warnings
 from asyncio import IncompleteReadError  # only import the exception class
 import asyncio
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
+# brackets and sample separators become whitespace, which np.fromstring skips
+_SEPARATORS = {str: str.maketrans('[];', '  ,'), bytes: bytes.maketrans(b'[];', b'  ,')}
+
+
+def parse_trace_array(data):
+    """ parses "freq,real,imag,..." trace data (str or bytes) into numpy arrays
+
+    returns (freq, s21) as float64 and complex128 arrays
+    """
+    data = data.translate(_SEPARATORS[type(data)])
+    with warnings.catch_warnings():
+        # older numpy stops early on a malformed value with a warning, caught by
+        # the count check below, newer numpy raises
+        warnings.simplefilter("ignore", DeprecationWarning)
+        try:
+            values = np.fromstring(data, sep=',')
+        except ValueError:
+            raise Exception("Invalid input data: could not parse trace values")
+    sep = ',' if isinstance(data, str) else b','
+    if len(values) != data.count(sep) + 1 or len(values) % 3:
+        # number of values must be a multiple of three (frequency, real, imaginary)
+        raise Exception("Invalid input data: expected tuples of three values each")
+    values = values.reshape(-1, 3)
+    return values[:, 0], np.ascontiguousarray(values[:, 1:]).view(np.complex128)[:, 0]
+
+
+def parse_trace_values(data, freq):
+    """ parses only the S-parameter values of trace data whose frequency axis is known
+
+    freq is the cached axis, the frequency fields are skipped except the first
+    which is checked against it. raises if the trace doesn't match the cache
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    tokens = data.translate(None, b'[]').split(b',')
+    if len(tokens) != 3 * len(freq):
+        raise Exception("Invalid input data: expected {} points".format(len(freq)))
+    try:
+        if float(tokens[0]) != freq[0]:
+            raise Exception("Invalid input data: frequency axis changed")
+        s21 = np.empty(len(freq), dtype=np.complex128)
+        s21.real = np.array(tokens[1::3], dtype=np.float64)
+        s21.imag = np.array(tokens[2::3], dtype=np.float64)
+    except ValueError:
+        raise Exception("Invalid input data: could not parse trace values")
+    return s21
+
 
 class AsyncTCP(object):
     def __init__(self, host='localhost', port=19542):
@@ -19,7 +69,8 @@ class AsyncTCP(object):
             raise Exception("Unable to connect to LibreVNA-GUI. Make sure it is running and the TCP server is enabled.")
 
     async def close(self):
-        await self.writer.drain()
+        if not self.writer.is_closing():
+            await self.writer.drain()
         self.writer.close()
         try:
             await self.writer.wait_closed()
@@ -32,12 +83,21 @@ class AsyncTCP(object):
         data = await self.reader.readline()
         return data.decode().rstrip()
 
+    async def read_response_raw(self):
+        """ response line as bytes, for trace data handed straight to parse_trace_array"""
+        data = await self.reader.readline()
+        return data.rstrip()
+
 class RAWVNA(AsyncTCP):
 
     async def read_trace(self):
         data = await self.read_response()
         return data
 
+    @staticmethod
+    def parse_trace_array(data):
+        return parse_trace_array(data.rstrip().rstrip(';'))
+
     @staticmethod
     def parse_trace_data(data):
         ret = []
@@ -52,30 +112,70 @@ class RAWVNA(AsyncTCP):
         return ret
 
 class libreVNA(AsyncTCP):
+    """ SCPI client, every line sent gets one response line back
 
+    commands can be pipelined with batch(): they are written in one go and
+    the responses matched to them in order, one round trip for the lot
+    """
 
-    async def cmd(self, cmd):
-        self.writer.write(cmd.encode() + b"\n")
-        await self.writer.drain()
-        return await self.read_response()
+    # seconds to wait for each response, calibration loads can be slow
+    timeout = 10.0
 
-    async def query(self, query):
-        self.writer.write(query.encode() + b"\n")
-        await self.writer.drain()
-        return await self.read_response()
+    async def connect(self):
+        await super().connect()
+        self.lock = asyncio.Lock()
+        self.round_trips = 0
+        # set once responses may be out of step with commands
+        self.broken = False
+
+    async def batch(self, cmds, timeout=None, raw=False):
+        """ sends all of cmds with a single write, returns their responses in order
+
+        a response that doesn't arrive within timeout (per command), or a
+        batch cancelled or failing part way, closes the connection, since
+        later responses could no longer be matched up
+        """
+        timeout = self.timeout if timeout is None else timeout
+        read = self.read_response_raw if raw else self.read_response
+        async with self.lock:
+            if self.broken:
+                raise ConnectionError("SCPI connection out of step, reconnect")
+            try:
+                self.writer.write(b"".join(c.encode() + b"\n" for c in cmds))
+                await self.writer.drain()
+                self.round_trips += 1
+                responses = []
+                for c in cmds:
+                    try:
+                        responses.append(await asyncio.wait_for(read(), timeout))
+                    except asyncio.TimeoutError:
+                        raise asyncio.TimeoutError("no response to {!r} after {} s".format(c, timeout))
+                return responses
+            except BaseException:
+                # includes CancelledError, e.g. /cancel during a trace read
+                self.broken = True
+                self.writer.close()
+                raise
+
+    async def cmd(self, cmd, timeout=None):
+        return (await self.batch([cmd], timeout))[0]
+
+    async def query(self, query, timeout=None):
+        return (await self.batch([query], timeout))[0]
+
+    async def query_raw(self, query, timeout=None):
+        return (await self.batch([query], timeout, raw=True))[0]
+
+    @staticmethod
+    def parse_trace_array(data):
+        return parse_trace_array(data)
+
+    @staticmethod
+    def parse_trace_values(data, freq):
+        return parse_trace_values(data, freq)
 
     @staticmethod
     def parse_trace_data(data):
-        ret = []
-        # Remove brackets (order of data implicitly known)
-        data = data.replace(']','').replace('[','')
-        values = data.split(',')
-        if int(len(values) / 3) * 3 != len(values):
-            # number of values must be a multiple of three (frequency, real, imaginary)
-            raise Exception("Invalid input data: expected tuples of three values each")
-        for i in range(0, len(values), 3):
-            freq = float(values[i])
-            real = float(values[i+1])
-            imag = float(values[i+2])
-            ret.append((freq, complex(real, imag)))
-        return ret
+        """ list of (freq, complex) tuples, see parse_trace_array for the array form"""
+        freq, s21 = parse_trace_array(data)
+        return list(zip(freq.tolist(), s21.tolist()))
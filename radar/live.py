@@ -0,0 +1,179 @@
+"""
+Live radargram for clients watching a run
+
+the capture pipeline hands every sweep to LiveRadargram.feed, which only
+queues it. a compute task turns whatever sweeps are pending into TDR traces
+on a worker thread and fans the traces out to clients. each client has its
+own small queue that drops its oldest frame when full, so a slow browser
+loses frames instead of holding up acquisition or other clients
+
+clients get a JSON text message describing the time axis whenever it
+changes, then binary frames of
+    first     uint32    index of the first trace in the run
+    traces    uint16    number of traces in the frame
+    samples   uint16    samples per trace
+    time      float64   POSIX timestamp of the first trace
+followed by traces x samples little endian uint16 (DZT scaling) or float16
+"""
+import asyncio
+import collections
+import logging
+import struct
+import time
+
+import numpy as np
+
+try:
+    from .tdr import BatchTDR
+    from .traces import dzt_samples
+except ImportError:
+    from tdr import BatchTDR
+    from traces import dzt_samples
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('<IHHd')
+DTYPES = {'uint16': '<u2', 'float16': '<f2'}
+
+
+class LiveClient(object):
+    """ one websocket, sends every `every`th trace, the first `samples` samples of each"""
+
+    def __init__(self, ws, every=1, samples=1024, dtype='uint16', queue=8):
+        if dtype not in DTYPES:
+            raise ValueError("dtype must be one of {}".format(', '.join(DTYPES)))
+        if every < 1 or not 1 <= samples <= 0xFFFF:
+            raise ValueError("every must be >= 1 and samples in 1..65535")
+        self.ws = ws
+        self.every = every
+        self.samples = samples
+        self.dtype = dtype
+        # (axis, frame) pairs, the axis goes out first whenever it changes
+        self.queue = asyncio.Queue(maxsize=queue)
+        self.axis = None
+        self.sent = 0
+        self.dropped = 0
+
+    def to_dict(self):
+        return {"every": self.every, "samples": self.samples, "dtype": self.dtype,
+                "sent": self.sent, "dropped": self.dropped, "queued": self.queue.qsize()}
+
+    def offer(self, axis, frame):
+        """ queues a frame, dropping the oldest one when the client is behind"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait((axis, frame))
+
+    def frame(self, first, times, traces):
+        """ binary frame of this client's share of traces, None if it wants none of them"""
+        index = np.arange(first, first + len(traces))
+        keep = index % self.every == 0
+        if not keep.any():
+            return None
+        rows = traces[keep, :self.samples]
+        body = dzt_samples(rows) if self.dtype == 'uint16' else rows
+        header = FRAME_HEADER.pack(int(index[keep][0]), len(rows), rows.shape[1], float(times[keep][0]))
+        return header + body.astype(DTYPES[self.dtype]).tobytes()
+
+    async def run(self):
+        while True:
+            axis, frame = await self.queue.get()
+            if axis is not self.axis:
+                self.axis = axis
+                await self.ws.send_json(dict(axis, samples=min(self.samples, axis["samples"]),
+                                             every=self.every, dtype=self.dtype))
+            await self.ws.send_bytes(frame)
+            self.sent += 1
+
+
+class LiveRadargram(object):
+    """ incremental TDR of captured sweeps, streamed to any number of clients"""
+
+    # sweeps waiting for the compute task, the oldest are dropped beyond this
+    pending_size = 256
+
+    def __init__(self):
+        self.pending = collections.deque(maxlen=self.pending_size)
+        self.ready = asyncio.Event()
+        self.clients = set()
+        self.task = None
+        self.engine = None
+        self.axis = None
+        self.traces = 0
+        self.dropped = 0
+        self.compute_time = 0.0
+
+    def to_dict(self):
+        return {"clients": [c.to_dict() for c in self.clients],
+                "traces": self.traces,
+                "dropped": self.dropped,
+                "pending": len(self.pending),
+                "compute_time": self.compute_time}
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._compute_loop())
+        return self
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def feed(self, timestamp, freq, s21):
+        """ capture pipeline subscriber, never waits"""
+        if not self.clients:
+            return
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append((timestamp, freq, s21))
+        self.ready.set()
+
+    def _engine(self, freq):
+        if self.engine is None or len(self.engine.freq) != len(freq) or \
+                self.engine.freq[0] != freq[0] or self.engine.freq[-1] != freq[-1]:
+            self.engine = BatchTDR(freq)
+            step = float(self.engine.time[1] - self.engine.time[0])
+            self.axis = {"type": "axis", "time_step_ns": step, "start_ns": self.engine.position_ns,
+                         "range_ns": float(self.engine.time[-1]), "samples": len(self.engine.time)}
+            # trace numbering restarts with the sweep configuration
+            self.traces = 0
+        return self.engine
+
+    def _compute(self, sweeps):
+        freq = sweeps[0][1]
+        engine = self._engine(np.asarray(freq))
+        times = np.array([s[0] for s in sweeps])
+        return times, engine.calc(np.array([s[2] for s in sweeps]))
+
+    async def _compute_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            sweeps = list(self.pending)
+            self.pending.clear()
+            if not sweeps or not self.clients:
+                continue
+            t = time.perf_counter()
+            try:
+                times, traces = await loop.run_in_executor(None, self._compute, sweeps)
+            except Exception:
+                logger.exception("live TDR failed")
+                continue
+            self.compute_time += time.perf_counter() - t
+            first, self.traces = self.traces, self.traces + len(traces)
+            for client in list(self.clients):
+                frame = client.frame(first, times, traces)
+                if frame is not None:
+                    client.offer(self.axis, frame)
+
+    async def serve(self, client):
+        """ streams to client until its connection fails or the caller is cancelled"""
+        self.clients.add(client)
+        try:
+            await client.run()
+        finally:
+            self.clients.discard(client)
@@ -0,0 +1,224 @@
+"""
+Migration of radargrams, collapses the hyperbola of a point target back to its apex
+
+works on evenly spaced traces (a DZT resampled to scans per meter) with the
+traces' time axis, as an exploding reflector at half the wave velocity
+
+    stolt:V:A          F-K (Stolt) migration, constant velocity V in m/ns,
+                       chunks overlap enough to keep dips up to A degrees
+                       (70) at the bottom of the window across chunk joins
+    kirchhoff:V:A:V2   diffraction summation over an aperture of A m, the
+                       velocity going linearly from V at the top of the
+                       window to V2 (V if not given) at the bottom
+
+long profiles are migrated in chunks of traces that overlap their
+neighbours, only each chunk's middle is kept, so memory follows the chunk
+size instead of the profile length. Kirchhoff with an overlap of half the
+aperture matches the whole profile migrated at once, Stolt with an overlap
+of the deepest reflector's aperture (depth x tan(A)) comes close
+
+on the rover /start?migration=... writes <dzt>.mig after the run
+
+migrate a processed DZT with
+python3 migration.py data/<name>o out.DZT -m stolt:0.1
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.fft
+
+try:
+    from .traces import DZT_SCALE, signed_dzt_samples
+except ImportError:
+    from traces import DZT_SCALE, signed_dzt_samples
+
+# the migrated profile is written next to the DZT with this suffix
+MIGRATED_SUFFIX = '.mig'
+
+class Stolt(object):
+    """ F-K migration for a constant velocity, on scipy.fft in single precision"""
+    name = 'stolt'
+
+    def __init__(self, velocity=0.1, angle=70.0, pad=0.5):
+        self.velocity = float(velocity)
+        if self.velocity <= 0:
+            raise ValueError("velocity must be > 0 m/ns")
+        self.angle = float(angle)
+        if not 0 < self.angle < 90:
+            raise ValueError("angle must be between 0 and 90 degrees")
+        # extra time samples against wrap around, as a fraction of the trace
+        self.pad = float(pad)
+
+    def overlap(self, dx, time_ns):
+        """ traces each chunk borrows from its neighbours, the aperture at the bottom of the window"""
+        depth = self.velocity / 2 * float(time_ns[-1])
+        return max(1, int(np.ceil(depth * np.tan(np.radians(self.angle)) / dx)))
+
+    def __call__(self, traces, time_ns, dx):
+        n_traces, n_samples = traces.shape
+        dt = float(time_ns[1] - time_ns[0])
+        # the transform assumes time zero at the first sample
+        front = int(round(time_ns[0] / dt))
+        nt = scipy.fft.next_fast_len(front + int(n_samples * (1 + self.pad)), real=True)
+        nx = scipy.fft.next_fast_len(2 * n_traces)
+        data = np.zeros((n_traces, front + n_samples), dtype=np.float32)
+        data[:, front:] = traces
+        spectrum = scipy.fft.fft(scipy.fft.rfft(data, n=nt, axis=1), n=nx, axis=0)
+        del data
+
+        f = scipy.fft.rfftfreq(nt, dt).astype(np.float32)
+        kx = scipy.fft.fftfreq(nx, dx).astype(np.float32)
+        ve = self.velocity / 2
+        # frequency each output (kx, f) maps from, and the Stolt Jacobian
+        f_in = np.sqrt(f[None, :] ** 2 + (ve * kx[:, None]) ** 2)
+        scale = np.divide(f[None, :], f_in, out=np.zeros_like(f_in), where=f_in > 0)
+        index = f_in / f[1]
+        valid = index <= len(f) - 1
+        i0 = np.minimum(index.astype(np.int32), len(f) - 2)
+        w = (index - i0).astype(np.float32)
+        migrated = np.take_along_axis(spectrum, i0, axis=1) * (1 - w)
+        migrated += np.take_along_axis(spectrum, i0 + 1, axis=1) * w
+        del spectrum, i0, w, index
+        migrated *= np.where(valid, scale, 0)
+        image = scipy.fft.irfft(scipy.fft.ifft(migrated, axis=0)[:n_traces], n=nt, axis=1)
+        return image[:, front:front + n_samples].astype(np.float32)
+
+
+class Kirchhoff(object):
+    """ diffraction summation, allows the velocity to change with time"""
+    name = 'kirchhoff'
+
+    def __init__(self, velocity=0.1, aperture=1.0, velocity_end=None):
+        self.velocity = float(velocity)
+        self.aperture = float(aperture)
+        self.velocity_end = float(velocity_end) if velocity_end is not None else self.velocity
+        if self.velocity <= 0 or self.velocity_end <= 0:
+            raise ValueError("velocity must be > 0 m/ns")
+
+    def half_width(self, dx):
+        return max(1, int(round(self.aperture / 2 / dx)))
+
+    def overlap(self, dx, time_ns=None):
+        return self.half_width(dx)
+
+    def __call__(self, traces, time_ns, dx):
+        n_traces, n_samples = traces.shape
+        time_ns = np.asarray(time_ns, dtype=float)
+        dt = time_ns[1] - time_ns[0]
+        v = np.linspace(self.velocity, self.velocity_end, n_samples)
+        t0 = np.maximum(time_ns, dt)
+        image = np.zeros((n_traces, n_samples), dtype=np.float32)
+        weights = np.zeros(n_traces, dtype=np.float32)
+        half = self.half_width(dx)
+        for h in range(-half, half + 1):
+            if abs(h) >= n_traces:
+                continue
+            # two way time at this offset for every output time, and the obliquity
+            t = np.sqrt(t0 ** 2 + (2 * h * dx / v) ** 2)
+            index = (t - time_ns[0]) / dt
+            valid = index < n_samples - 1
+            if not valid.any():
+                continue
+            columns = np.flatnonzero(valid)
+            i0 = index[columns].astype(np.int64)
+            w = (index[columns] - i0).astype(np.float32)
+            obliquity = (t0[columns] / t[columns]).astype(np.float32)
+            src = traces[max(h, 0):n_traces + min(h, 0)]
+            dst = slice(max(-h, 0), n_traces - max(h, 0))
+            # linear interpolation between the samples either side, in place
+            below = src[:, i0]
+            sample = src[:, i0 + 1]
+            sample -= below
+            sample *= w
+            sample += below
+            sample *= obliquity
+            if columns[-1] - columns[0] + 1 == len(columns):
+                # the usual case, travel time grows with time so the valid samples are a run
+                image[dst, columns[0]:columns[-1] + 1] += sample
+            else:
+                image[dst, columns] += sample
+            weights[dst] += 1
+        return image / np.maximum(weights, 1)[:, None]
+
+
+METHODS = {method.name: method for method in (Stolt, Kirchhoff)}
+
+
+def parse_migration(spec):
+    """ migration for "method:arg:arg", None for an empty spec, ValueError if malformed"""
+    if not spec:
+        return None
+    name, *args = spec.strip().split(':')
+    if name not in METHODS:
+        raise ValueError("unknown migration {!r}, expected one of {}".format(name, ", ".join(METHODS)))
+    try:
+        return METHODS[name](*[float(a) for a in args])
+    except TypeError:
+        raise ValueError("too many arguments for {}".format(name))
+
+
+def migrate(traces, time_ns, dx, method, chunk=256, overlap=None):
+    """ yields the migrated profile in chunk trace blocks, traces can be a memmap"""
+    n_traces = len(traces)
+    if overlap is None:
+        overlap = method.overlap(dx, time_ns)
+    for start in range(0, n_traces, chunk):
+        lo, hi = max(start - overlap, 0), min(start + chunk + overlap, n_traces)
+        image = method(np.asarray(traces[lo:hi], dtype=np.float32), time_ns, dx)
+        yield image[start - lo:start - lo + min(chunk, n_traces - start)]
+
+
+def migrate_dzt(source, output, method, signed=True, chunk=256):
+    """ migrates a DZT resampled to scans per meter, signed if it holds processed traces"""
+    try:
+        from .tdr import DZTWriter, read_dzt
+    except ImportError:
+        from tdr import DZTWriter, read_dzt
+    (sps, spm, range_ns, position_ns), gpr = read_dzt(source)
+    if not spm:
+        raise ValueError("{} has no trace spacing, resample it to scans per meter first".format(source))
+    time_ns = position_ns + np.linspace(0, range_ns, gpr.shape[1])
+    writer = DZTWriter(output, gpr.shape[1])
+    # chunks are read lazily, a memmap slice at a time
+    profile = _Lazy(gpr, 0x8000 if signed else 0)
+    for image in migrate(profile, time_ns, 1.0 / spm, method, chunk=chunk):
+        writer.append(signed_dzt_samples(image))
+    writer.close(sps, spm, range_ns, position_ns)
+    return writer.count
+
+
+class _Lazy(object):
+    """ DZT samples as zero centred TDR magnitudes, converted a slice at a time"""
+
+    def __init__(self, gpr, zero):
+        self.gpr = gpr
+        self.zero = zero
+
+    def __len__(self):
+        return len(self.gpr)
+
+    def __getitem__(self, index):
+        return (np.asarray(self.gpr[index], dtype=np.float32) - self.zero) / DZT_SCALE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="DZT resampled to scans per meter")
+    parser.add_argument("output", help="migrated DZT")
+    parser.add_argument("-m", "--method", default="stolt:0.1", help="migration, see above")
+    parser.add_argument("-c", "--chunk", type=int, default=256, help="traces per chunk")
+    parser.add_argument("-r", "--raw", action="store_true",
+                    help="input holds unprocessed magnitudes (zero at 0, not rh_zero)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = migrate_dzt(args.input, args.output, parse_migration(args.method),
+                        signed=not args.raw, chunk=args.chunk)
+    elapsed = time.perf_counter() - start
+    print("{} traces in {:.2f} s ({:.1f} traces/s)".format(count, elapsed, count / max(elapsed, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+
+
+class SinkGroup(object):
+    """ writes every batch to each of several sinks, in order"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def write_many(self, timestamps, s21):
+        for sink in self.sinks:
+            sink.write_many(timestamps, s21)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class CapturePipeline(object):
+    """ bounded producer / consumer queue between acquisition and disk
+
+    put() hands a sweep to the queue, a writer task drains whatever is queued
+    (up to batch sweeps) and writes it with one sink.write_many call on a
+    dedicated thread. when the queue is full, policy decides whether
+    acquisition waits (block) or a sweep is dropped (drop_newest / drop_oldest)
+
+    sink_factory(freq) is called on the writer thread for the first sweep and
+    returns an object with write_many(timestamps, s21) and close()
+
+    subscribers are called with (timestamp, freq, s21) for every sweep put,
+    on the event loop, and must return without waiting (live displays)
+    """
+
+    def __init__(self, sink_factory, maxsize=64, policy=BLOCK, batch=16):
+        if policy not in (BLOCK, DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("unknown overflow policy {}".format(policy))
+        self.sink_factory = sink_factory
+        self.policy = policy
+        self.batch = batch
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.sink = None
+        self.writer = None
+        self.subscribers = []
+        # counters
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.batches = 0
+        self.write_time = 0.0
+        self.max_write_latency = 0.0
+
+    def to_dict(self):
+        return {"queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_depth,
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "mean_write_latency": self.write_time / self.batches if self.batches else 0.0,
+                "max_write_latency": self.max_write_latency}
+
+    def start(self):
+        if self.writer is None:
+            self.writer = asyncio.ensure_future(self._write_loop())
+        return self
+
+    async def put(self, timestamp, freq, s21):
+        """ queues a sweep, returns False if it was dropped"""
+        item = (timestamp, freq, s21)
+        for subscriber in self.subscribers:
+            try:
+                subscriber(timestamp, freq, s21)
+            except Exception:
+                logger.exception("capture subscriber failed")
+        if self.writer.done():
+            # surface writer failures to the acquisition loop
+            self.writer.result()
+        if self.queue.full():
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.policy == DROP_OLDEST:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+        await self._put(item)
+        self.queued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def _put(self, item):
+        """ queue.put that gives up, raising the writer's error, if the writer ends while it waits"""
+        if not self.queue.full():
+            return self.queue.put_nowait(item)
+        put = asyncio.ensure_future(self.queue.put(item))
+        await asyncio.wait({put, self.writer}, return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return put.result()
+        put.cancel()
+        self.writer.result()
+        raise RuntimeError("capture writer stopped")
+
+    async def _write_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            item = await self.queue.get()
+            items = [item]
+            while item is not None and len(items) < self.batch and not self.queue.empty():
+                item = self.queue.get_nowait()
+                items.append(item)
+            done = items[-1] is None
+            if done:
+                items.pop()
+            try:
+                if items:
+                    t = time.perf_counter()
+                    await loop.run_in_executor(self.executor, self._write, items)
+                    latency = time.perf_counter() - t
+                    self.batches += 1
+                    self.write_time += latency
+                    self.max_write_latency = max(self.max_write_latency, latency)
+                    self.written += len(items)
+            finally:
+                for _ in range(len(items) + done):
+                    self.queue.task_done()
+            if done:
+                return
+
+    def _write(self, items):
+        if self.sink is None:
+            self.sink = self.sink_factory(items[0][1])
+        self.sink.write_many([i[0] for i in items], np.array([i[2] for i in items]))
+
+    async def close(self):
+        """ flushes everything queued, then closes the sink
+
+        safe to await from a cancelled task's cleanup, the flush is shielded
+        """
+        await asyncio.shield(self._close())
+
+    async def _close(self):
+        if self.writer is not None and not self.writer.done():
+            try:
+                await self._put(None)
+                await self.writer
+            except Exception:
+                logger.exception("capture writer failed")
+        sink, self.sink = self.sink, None
+        if sink is not None:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.executor, sink.close)
+        self.executor.shutdown(wait=False)
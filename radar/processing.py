@@ -0,0 +1,279 @@
+"""
+Radargram processing stages, run on TDR traces before they go to the DZT
+
+a chain is given as comma separated stages with colon separated arguments,
+applied in order, e.g. for /start?processing=...
+
+    dewow:5,background:200,sec:0.05:1,bandpass:100:1500
+
+    dewow:W            subtract the W ns running mean of each trace
+    background:N       subtract the mean of the last N traces (0: all so far)
+    sec:A:P            gain t^P * exp(A t), t in ns
+    agc:W:T            scale each sample to RMS T over a W ns window (T 1e-3)
+    bandpass:L:H:O     zero phase Butterworth band-pass, L-H MHz, order O (4)
+
+every stage works on an (n_traces x n_samples) block along the time axis, so
+a whole radargram or consecutive blocks of a capture give the same result.
+background is causal: each trace has the mean of itself and the traces
+before it removed, never of later ones, so with background:0 the first
+traces of a run are mostly subtracted from themselves.
+processed traces are signed, the DZT stores them around rh_zero
+
+process an existing DZT with
+python3 processing.py data/<name>o out.DZT -c dewow:5,background:0 -b 256
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.ndimage
+import scipy.signal
+
+try:
+    from .traces import DZT_SCALE, signed_dzt_samples
+except ImportError:
+    from traces import DZT_SCALE, signed_dzt_samples
+
+
+class Stage(object):
+    name = None
+    # constructor arguments, in spec order
+    params = ()
+
+    def setup(self, time_ns):
+        """ called with the traces' time axis before the first block"""
+        self.time_ns = np.asarray(time_ns, dtype=float)
+        self.dt_ns = float(self.time_ns[1] - self.time_ns[0])
+
+    def samples(self, width_ns):
+        return max(1, int(round(width_ns / self.dt_ns)))
+
+    def __call__(self, block):
+        raise NotImplementedError
+
+    def __repr__(self):
+        """ the stage as it's written in a chain spec"""
+        return ":".join([self.name] + ["{:g}".format(getattr(self, p)) for p in self.params])
+
+
+class Dewow(Stage):
+    name = 'dewow'
+    params = ('width_ns',)
+
+    def __init__(self, width_ns=5.0):
+        self.width_ns = float(width_ns)
+
+    def __call__(self, block):
+        return block - scipy.ndimage.uniform_filter1d(block, self.samples(self.width_ns), axis=1, mode='nearest')
+
+
+class BackgroundRemoval(Stage):
+    """ subtracts the mean of each trace and the ones before it, over a sliding window or everything seen"""
+    name = 'background'
+    params = ('traces',)
+
+    def __init__(self, traces=0):
+        self.traces = int(traces)
+        if self.traces < 0:
+            raise ValueError("background window must be >= 0 traces")
+
+    def setup(self, time_ns):
+        super().setup(time_ns)
+        self.sum = None
+        self.count = 0
+        # ring of the last traces - 1 traces (oldest at head) and their sum, for
+        # windows reaching back into earlier blocks without revisiting them
+        self.ring = None
+        self.head = 0
+        self.filled = 0
+
+    def __call__(self, block):
+        if self.traces == 0:
+            if self.sum is None:
+                self.sum = np.zeros(block.shape[1])
+            running = np.cumsum(block, axis=0, dtype=float)
+            running += self.sum
+            self.sum = running[-1].copy()
+            running /= (self.count + np.arange(1, len(block) + 1))[:, None]
+            self.count += len(block)
+            return block - running.astype(block.dtype)
+        cap = self.traces - 1
+        if cap == 0:
+            return np.zeros_like(block)
+        if self.ring is None:
+            self.ring = np.zeros((cap, block.shape[1]), dtype=block.dtype)
+            self.sum = np.zeros(block.shape[1])
+        n, filled = len(block), self.filled
+        block_sums = np.zeros((n + 1, block.shape[1]))
+        np.cumsum(block, axis=0, out=block_sums[1:])
+        j = np.arange(n)
+        # window of trace j: block[lo:j + 1] and the history from index first on
+        lo = np.maximum(j - cap, 0)
+        first = np.clip(j - (cap - filled), 0, filled)
+        dropped = max(0, filled + n - cap)
+        oldest = min(max(int(first.max()), dropped), filled)
+        history_sums = np.zeros((oldest + 1, block.shape[1]))
+        if oldest:
+            np.cumsum(self.ring[(self.head + np.arange(oldest)) % cap], axis=0, out=history_sums[1:])
+        mean = block_sums[j + 1] - block_sums[lo]
+        mean += self.sum - history_sums[first]
+        mean /= ((j + 1 - lo) + (filled - first))[:, None]
+
+        if n >= cap:
+            self.ring[:] = block[n - cap:]
+            self.sum = block_sums[n] - block_sums[n - cap]
+            self.head, self.filled = 0, cap
+        else:
+            self.sum += block_sums[n] - history_sums[dropped]
+            self.ring[(self.head + filled + j) % cap] = block
+            self.head = (self.head + dropped) % cap
+            self.filled = filled + n - dropped
+        return block - mean.astype(block.dtype)
+
+
+class SECGain(Stage):
+    """ spreading and exponential compensation, t^power * exp(alpha t)"""
+    name = 'sec'
+    params = ('alpha', 'power')
+
+    def __init__(self, alpha=0.05, power=1.0):
+        self.alpha = float(alpha)
+        self.power = float(power)
+
+    def setup(self, time_ns):
+        super().setup(time_ns)
+        t = np.maximum(self.time_ns, self.dt_ns)
+        self.gain = (t ** self.power * np.exp(self.alpha * t)).astype(np.float32)
+
+    def __call__(self, block):
+        return block * self.gain
+
+
+class AGC(Stage):
+    """ automatic gain control, each sample scaled by the RMS around it"""
+    name = 'agc'
+    params = ('width_ns', 'target')
+
+    def __init__(self, width_ns=10.0, target=1e-3):
+        self.width_ns = float(width_ns)
+        self.target = float(target)
+
+    def __call__(self, block):
+        power = scipy.ndimage.uniform_filter1d(block * block, self.samples(self.width_ns), axis=1, mode='nearest')
+        rms = np.sqrt(np.maximum(power, 0))
+        floor = np.finfo(block.dtype).tiny
+        return block * (self.target / np.maximum(rms, floor))
+
+
+class BandPass(Stage):
+    name = 'bandpass'
+    params = ('low_mhz', 'high_mhz', 'order')
+
+    def __init__(self, low_mhz=100.0, high_mhz=1500.0, order=4):
+        self.low_mhz = float(low_mhz)
+        self.high_mhz = float(high_mhz)
+        self.order = int(order)
+        if not 0 < self.low_mhz < self.high_mhz:
+            raise ValueError("band-pass needs 0 < low < high")
+
+    def setup(self, time_ns):
+        super().setup(time_ns)
+        fs_mhz = 1e3 / self.dt_ns
+        if self.high_mhz >= fs_mhz / 2:
+            raise ValueError("band-pass {} MHz above the {:.0f} MHz Nyquist rate".format(self.high_mhz, fs_mhz / 2))
+        self.sos = scipy.signal.butter(self.order, [self.low_mhz, self.high_mhz], btype='band',
+                                       fs=fs_mhz, output='sos')
+
+    def __call__(self, block):
+        return scipy.signal.sosfiltfilt(self.sos, block, axis=1).astype(block.dtype, copy=False)
+
+
+STAGES = {stage.name: stage for stage in (Dewow, BackgroundRemoval, SECGain, AGC, BandPass)}
+
+
+class ProcessingChain(object):
+    """ runs stages in order over blocks of traces, timing each"""
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.time_ns = None
+        self.seconds = [0.0] * len(self.stages)
+        self.traces = 0
+
+    @classmethod
+    def parse(cls, spec):
+        """ chain for "stage:arg:arg,stage,...", None for an empty spec, ValueError if malformed"""
+        if not spec:
+            return None
+        stages = []
+        for item in spec.split(','):
+            name, *args = item.strip().split(':')
+            if name not in STAGES:
+                raise ValueError("unknown processing stage {!r}, expected one of {}".format(
+                    name, ", ".join(STAGES)))
+            try:
+                stages.append(STAGES[name](*[float(a) for a in args]))
+            except TypeError:
+                raise ValueError("too many arguments for {}".format(name))
+        return cls(stages)
+
+    def setup(self, time_ns):
+        self.time_ns = np.asarray(time_ns, dtype=float)
+        for stage in self.stages:
+            stage.setup(self.time_ns)
+
+    def process(self, block, time_ns):
+        """ the processed float32 (n_traces x n_samples) block, time_ns is its time axis"""
+        if self.time_ns is None or len(time_ns) != len(self.time_ns):
+            self.setup(time_ns)
+        block = np.asarray(block, dtype=np.float32)
+        for i, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            block = stage(block)
+            self.seconds[i] += time.perf_counter() - start
+        self.traces += len(block)
+        return block
+
+    def report(self):
+        """ per stage time, for the run's catalog entry"""
+        return [{"stage": repr(stage), "seconds": round(seconds, 6),
+                 "us_per_trace": round(1e6 * seconds / self.traces, 3) if self.traces else None}
+                for stage, seconds in zip(self.stages, self.seconds)]
+
+
+def process_dzt(source, output, chain, block=256):
+    """ runs chain over a raw DZT block by block, writing a processed DZT"""
+    try:
+        from .tdr import DZTWriter, read_dzt
+    except ImportError:
+        from tdr import DZTWriter, read_dzt
+    (sps, spm, range_ns, position_ns), gpr = read_dzt(source)
+    time_ns = position_ns + np.linspace(0, range_ns, gpr.shape[1])
+    writer = DZTWriter(output, gpr.shape[1])
+    for i in range(0, len(gpr), block):
+        td = np.asarray(gpr[i:i + block], dtype=np.float32) / DZT_SCALE
+        writer.append(signed_dzt_samples(chain.process(td, time_ns)))
+    writer.close(sps, spm, range_ns, position_ns)
+    return writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="DZT written by tdr.py")
+    parser.add_argument("output", help="processed DZT")
+    parser.add_argument("-c", "--chain", required=True, help="processing stages, see above")
+    parser.add_argument("-b", "--block", type=int, default=256, help="traces per block")
+    args = parser.parse_args()
+
+    chain = ProcessingChain.parse(args.chain)
+    start = time.perf_counter()
+    count = process_dzt(args.input, args.output, chain, args.block)
+    elapsed = time.perf_counter() - start
+    print("{} traces in {:.2f} s ({:.1f} traces/s)".format(count, elapsed, count / max(elapsed, 1e-9)))
+    for stage in chain.report():
+        print("{stage:50s} {seconds:8.3f} s  {us_per_trace:10.1f} us/trace".format(**stage))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+
+import numpy as np
+
+try:
+    from .sweep import VNAGPR
+except ImportError:
+    from sweep import VNAGPR
+
+logger = logging.getLogger(__name__)
+
+
+class VNASession(object):
+    """ long lived connection to LibreVNA-GUI shared across runs
+
+    connects once, keeps the sweep configured between runs (VNAGPR.scan only
+    re-sends settings that changed) and reconnects in the background when the
+    connection drops, so a run can start capturing straight away
+    """
+
+    # seconds between connection checks while idle
+    keepalive_interval = 5.0
+    # seconds between reconnect attempts, doubling up to reconnect_max
+    reconnect_delay = 0.5
+    reconnect_max = 10.0
+    # start of the *IDN? reply, anything else means the SCPI stream is out of step
+    identity = 'LibreVNA'
+
+    def __init__(self, use_raw=False, **sweep):
+        self.use_raw = use_raw
+        self.sweep = sweep
+        self.gpr = None
+        self.lock = asyncio.Lock()
+        self.connected = asyncio.Event()
+        self.supervisor = None
+        # live consumers of captured sweeps, kept across reconnects
+        self.subscribers = []
+
+    def to_dict(self):
+        data = {"connected": self.connected.is_set(), "busy": self.lock.locked()}
+        if self.gpr is not None:
+            data["acquisition"] = self.gpr.scheduler.to_dict()
+            if self.gpr.pipeline is not None:
+                data["pipeline"] = self.gpr.pipeline.to_dict()
+        return data
+
+    async def start(self):
+        """ starts the background connect / keepalive task, doesn't wait for the VNA"""
+        if self.supervisor is None:
+            self.supervisor = asyncio.ensure_future(self._supervise())
+
+    async def stop(self):
+        if self.supervisor is not None:
+            self.supervisor.cancel()
+            try:
+                await self.supervisor
+            except asyncio.CancelledError:
+                pass
+            self.supervisor = None
+        async with self.lock:
+            await self._disconnect()
+
+    async def _connect(self):
+        gpr = VNAGPR(use_raw=self.use_raw)
+        gpr.subscribers = self.subscribers
+        await gpr.connect()
+        await gpr.scan(**self.sweep)
+        self.gpr = gpr
+        self.connected.set()
+        logger.info("VNA session connected")
+
+    async def _disconnect(self):
+        self.connected.clear()
+        gpr, self.gpr = self.gpr, None
+        if gpr is not None:
+            try:
+                await gpr.close()
+            except Exception:
+                logger.exception("failed to close VNA connection")
+
+    async def _alive(self):
+        if self.gpr is None or self.gpr.vna.reader.at_eof():
+            return False
+        if self.use_raw:
+            return True
+        if self.gpr.vna.broken:
+            return False
+        try:
+            # an empty reply means the socket hit EOF
+            reply = await asyncio.wait_for(self.gpr.vna.query("*IDN?"), timeout=2.0)
+        except Exception:
+            return False
+        if not reply.startswith(self.identity):
+            logger.warning("unexpected *IDN? reply %r, reconnecting", reply[:80])
+            return False
+        return True
+
+    async def _supervise(self):
+        delay = self.reconnect_delay
+        while True:
+            async with self.lock:
+                if not await self._alive():
+                    await self._disconnect()
+                    try:
+                        await self._connect()
+                        delay = self.reconnect_delay
+                    except Exception as e:
+                        logger.warning("VNA connect failed: %s, retrying in %.1f s", e, delay)
+            if self.connected.is_set():
+                await asyncio.sleep(self.keepalive_interval)
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_max)
+
+    def frequencies(self):
+        """ frequency axis of the configured sweep, the captured one once there is one"""
+        if self.gpr is not None and self.gpr.freq is not None:
+            return self.gpr.freq
+        sweep = dict(VNAGPR.sweep, **self.sweep)
+        return np.linspace(sweep['start'], sweep['stop'], sweep['points'])
+
+    async def capture(self, output, run_seconds=None, timeout=10.0, dzt=None, processing=None):
+        """ records a run with the shared connection, see VNAGPR.writedata"""
+        await self.start()
+        await asyncio.wait_for(self.connected.wait(), timeout)
+        async with self.lock:
+            if self.gpr is None:
+                # a reconnect failed while waiting for the lock
+                raise ConnectionError("VNA disconnected")
+            try:
+                await self.gpr.scan(**self.sweep)
+                await self.gpr.writedata(output, run_seconds, dzt=dzt, processing=processing)
+            except BaseException:
+                # a cancelled or failed run can leave replies unread, let the
+                # supervisor reconnect before the next one
+                await asyncio.shield(self._disconnect())
+                raise
+            return self.gpr.directory
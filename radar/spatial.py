@@ -0,0 +1,105 @@
+"""
+Pose tagging and distance resampling of GPR traces
+
+sweeps are captured at whatever rate the VNA manages while the rover moves at
+whatever speed it manages, so traces are joined with the rover pose (from the
+telemetry log saved next to the capture) and put on a uniform distance grid
+before they are written, giving the DZT a real scans per meter
+
+pose log, POSE_FILE in the scan directory, one row per telemetry update:
+    t,x,y,yaw       POSIX seconds, meters, meters, degrees
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+POSE_FILE = 'poses.csv'
+
+# seconds a trace may be outside the pose log before it's reported, pushes
+# come every 50 ms
+POSE_GAP = 1.0
+
+# grid rows resampled at a time, bounds the float64 working set
+BLOCK = 256
+
+
+def write_poses(path, rows):
+    np.savetxt(path, np.asarray(rows).reshape(-1, 4), delimiter=',', fmt='%.6f',
+               header='t,x,y,yaw', comments='')
+
+
+def read_poses(path):
+    return np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+
+
+def trace_poses(times, poses):
+    """ (x, y, yaw) of the rover at each trace time, interpolated from the pose log"""
+    times = np.asarray(times, dtype=float)
+    # np.interp holds the end poses, traces well outside the log would all
+    # land on one spot and collapse the profile
+    outside = np.count_nonzero((times < poses[0, 0] - POSE_GAP) | (times > poses[-1, 0] + POSE_GAP))
+    if outside:
+        logger.warning("%d of %d traces are more than %g s outside the pose log (%.1f s from "
+                       "the first trace to the first pose, %.1f s from the last pose to the "
+                       "last trace), they are placed at its ends", outside, len(times), POSE_GAP,
+                       poses[0, 0] - times.min(), times.max() - poses[-1, 0])
+    yaw = np.degrees(np.unwrap(np.radians(poses[:, 3])))
+    return np.stack([np.interp(times, poses[:, 0], poses[:, 1]),
+                     np.interp(times, poses[:, 0], poses[:, 2]),
+                     np.interp(times, poses[:, 0], yaw)], axis=-1)
+
+
+def path_distance(xy):
+    """ distance travelled along the path at each point, starting at 0"""
+    steps = np.hypot(*np.diff(xy[:, :2], axis=0).T)
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+
+def resample(traces, distance, spm, block=BLOCK):
+    """ puts traces taken at distance (non decreasing) onto a grid of spm scans per meter
+
+    traces falling in the same grid cell are averaged, empty cells are
+    linearly interpolated from their occupied neighbours. returns the
+    resampled traces (same dtype) and the grid distances
+    """
+    distance = np.maximum.accumulate(np.asarray(distance, dtype=float))
+    cell = np.rint((distance - distance[0]) * spm).astype(np.intp)
+    # first trace of every occupied cell, and how many traces it holds
+    starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+    cells = cell[starts]
+    counts = np.diff(np.r_[starts, len(cell)])
+    bounds = np.r_[starts, len(cell)]
+
+    grid = np.arange(cells[-1] + 1)
+    left = np.searchsorted(cells, grid, side='right') - 1
+    right = np.minimum(left + 1, len(cells) - 1)
+    span = cells[right] - cells[left]
+    weight = np.where(span > 0, (grid - cells[left]) / np.maximum(span, 1), 0.0)[:, None]
+
+    out = np.empty((len(grid), traces.shape[1]), dtype=traces.dtype)
+    integer = np.issubdtype(traces.dtype, np.integer)
+    for g in range(0, len(grid), block):
+        lo, hi = left[g], right[min(g + block, len(grid)) - 1] + 1
+        rows = traces[bounds[lo]:bounds[hi]]
+        means = np.add.reduceat(rows, starts[lo:hi] - bounds[lo], axis=0, dtype=np.float64)
+        means /= counts[lo:hi, None]
+        l, r, w = left[g:g + block] - lo, right[g:g + block] - lo, weight[g:g + block]
+        block_out = means[l] * (1 - w) + means[r] * w
+        out[g:g + block] = np.rint(block_out) if integer else block_out
+    return out, distance[0] + grid / spm
+
+
+def survey(traces, times, poses, spm):
+    """ resamples traces captured at times onto spm scans per meter along the logged path
+
+    returns the resampled traces and the (x, y, yaw) pose of each of them
+    """
+    tagged = trace_poses(times, poses)
+    distance = path_distance(tagged)
+    gridded, grid = resample(traces, distance, spm)
+    # pose of each grid trace, interpolated along the path
+    distance = np.maximum.accumulate(distance)
+    grid_poses = np.stack([np.interp(grid, distance, tagged[:, i]) for i in range(3)], axis=-1)
+    return gridded, grid_poses
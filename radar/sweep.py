@@ -1,41 +1,183 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-import concurrent.futures
 import time
-import csv
 try:
     from .libreVNA import libreVNA, RAWVNA
-    from .tdr import TDR
+    from .tdr import TDR, IncrementalTDR
+    from .processing import ProcessingChain
+    from .capture import CaptureWriter, CSVWriter, CAPTURE_FILE
+    from .pipeline import CapturePipeline, SinkGroup
+    from .catalog import Catalog, CAPTURING
 except:
     from libreVNA import libreVNA, RAWVNA
-    from tdr import TDR
+    from tdr import TDR, IncrementalTDR
+    from processing import ProcessingChain
+    from capture import CaptureWriter, CSVWriter, CAPTURE_FILE
+    from pipeline import CapturePipeline, SinkGroup
+    from catalog import Catalog, CAPTURING
 
 import datetime
+import logging
 import os
 
+logger = logging.getLogger(__name__)
 
 # run with
 # LibreVNA-GUI --no-gui --port 19542
 
 
+class SweepScheduler(object):
+    """ paces trace reads to the measured sweep time
+
+    instead of polling on a fixed interval, sleeps until shortly before the
+    next sweep should finish, then polls at a fraction of the sweep time
+    until new data shows up. with an event driven source (RAWVNA pushes
+    each trace) it only keeps the statistics
+    """
+
+    # wake up this fraction of a sweep after the last one, then poll
+    early = 0.8
+    # weight of the newest sweep interval in the running estimate
+    smoothing = 0.2
+    min_interval = 0.002
+    # a source repeating the same sweep for this many sweep times (at least
+    # min_stall seconds) has stalled
+    stall_periods = 50
+    min_stall = 2.0
+
+    def __init__(self, estimate, event_driven=False):
+        self.period = estimate
+        self.event_driven = event_driven
+        self.last_data = None
+        self.last_sweep = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.started = time.monotonic()
+        self.sweeps = 0
+        self.duplicates = 0
+        self.waited = 0.0
+
+    @property
+    def poll_interval(self):
+        return max(self.period / 8, self.min_interval)
+
+    async def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        t = time.monotonic()
+        await asyncio.sleep(seconds)
+        self.waited += time.monotonic() - t
+
+    async def wait_finished(self, query):
+        """ waits for :VNA:ACQ:FIN? to report the sweep done"""
+        await self.sleep(self.early * self.period)
+        while await query(":VNA:ACQ:FIN?") == "FALSE":
+            await self.sleep(self.poll_interval)
+
+    async def next_trace(self, fetch, deadline=None):
+        """ calls fetch() until it returns data from a sweep not seen yet
+
+        returns None once time.monotonic() passes deadline without new data,
+        raises TimeoutError if the source keeps returning the same sweep
+        """
+        if self.last_sweep is not None and not self.event_driven:
+            wake = self.last_sweep + self.early * self.period
+            if deadline is not None:
+                wake = min(wake, deadline)
+            await self.sleep(wake - time.monotonic())
+        stall = time.monotonic() + max(self.stall_periods * self.period, self.min_stall)
+        while True:
+            data = await fetch()
+            now = time.monotonic()
+            if self.event_driven or data != self.last_data:
+                break
+            # same sweep as last time
+            self.duplicates += 1
+            if deadline is not None and now >= deadline:
+                return None
+            if now >= stall:
+                raise TimeoutError("no new sweep for {:.1f} s, {} duplicate reads".format(
+                    now - (self.last_sweep or self.started), self.duplicates))
+            await self.sleep(self.poll_interval)
+        if self.last_sweep is not None:
+            self.period += self.smoothing * (now - self.last_sweep - self.period)
+        self.last_sweep = now
+        self.last_data = data
+        self.sweeps += 1
+        return data
+
+    def to_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {"sweeps": self.sweeps,
+                "sweeps_per_second": self.sweeps / elapsed if elapsed > 0 else 0.0,
+                "sweep_time": self.period,
+                "waited": self.waited,
+                "duplicate_reads": self.duplicates}
+
+    def report(self):
+        return ("{sweeps} sweeps, {sweeps_per_second:.2f} sweeps/s, sweep time {sweep_time:.3f} s, "
+                "{waited:.2f} s waiting, {duplicate_reads} duplicate reads").format(**self.to_dict())
+
+
 class VNAGPR(object):
     calibration = os.environ.get('CALIBRATION', '/Users/ian/projects/SOLT 1.00M-3.00G 303pt.cal')
+    host = os.environ.get('VNAHOST', 'localhost')
+    port = int(os.environ.get('VNAPORT', 19542))
 
     vna = None
 
-    def __init__(self, use_raw=False):
+    # sweeps buffered between acquisition and disk, and what to do when full
+    # (block, drop_newest or drop_oldest, see CapturePipeline)
+    queue_size = int(os.environ.get('CAPTURE_QUEUE', 64))
+    overflow = os.environ.get('CAPTURE_OVERFLOW', 'block')
+
+    # sweep configuration sent by scan()
+    sweep = {'start': 10000000, 'stop': 3000000000, 'points': 200,
+             'ifbw': 2500, 'level': -10, 'avg': 1}
+
+    def __init__(self, use_raw=False, use_csv=False):
         self.use_raw = use_raw
+        # legacy one CSV file per sweep instead of a single capture file
+        self.use_csv = use_csv
+        self.sweep = dict(self.sweep)
+        # frequency axis of the current sweep configuration, from the first trace
+        self.freq = None
+        # SCPI settings last sent on this connection, scan() only re-sends changes
+        self.applied = {}
+        self.scheduler = self._scheduler()
+        self.pipeline = None
+        # called with every captured sweep, see CapturePipeline
+        self.subscribers = []
+
+    def _scheduler(self):
+        # a sweep takes roughly one IF bandwidth period per point
+        return SweepScheduler(self.sweep['points'] / self.sweep['ifbw'], event_driven=self.use_raw)
+
+    def parse_trace(self, data):
+        """ returns (freq, s21) for a trace, parsing the frequency axis only once per sweep config"""
+        if self.freq is not None:
+            try:
+                return self.freq, self.vna.parse_trace_values(data, self.freq)
+            except Exception:
+                logger.warning("trace does not match the cached frequency axis, reparsing")
+                self.freq = None
+        freq, s21 = self.vna.parse_trace_array(data)
+        if not self.use_raw:
+            self.freq = freq
+        return freq, s21
 
     async def connect(self):
         if self.use_raw:
-            self.vna = RAWVNA('localhost', 6969)
+            self.vna = RAWVNA(self.host, 6969)
             await self.vna.connect()
         else:
             # Create the control instance
 
-            self.vna = libreVNA('localhost', 19542)
+            self.vna = libreVNA(self.host, self.port)
             await self.vna.connect()
+            self.applied = {}
 
             # Quick connection check (should print "LibreVNA-GUI")
             print(await self.vna.query("*IDN?"))
@@ -45,51 +187,74 @@ class VNAGPR(object):
             dev = await self.vna.query(":DEV:CONN?")
             if dev == "Not connected":
                 print("Not connected to any device, aborting")
-                exit(-1)
+                raise Exception("LibreVNA-GUI is not connected to a device")
             else:
                 print("Connected to "+dev)
 
 
-    async def scan(self):
+    async def scan(self, **sweep):
+        """ sets up the sweep, keyword arguments override keys of VNAGPR.sweep"""
         if self.use_raw:
             """ todo impliment scan / setup on RAW"""
             return
-        # Simple trace data extraction
-
-        # switch to VNA mode, setup the sweep parameters
-        print("Setting up the sweep...")
-        await self.vna.cmd(":DEV:MODE VNA")
-        #await self.vna.cmd(":VNA:CAL:LOAD {}".format(self.calibration))
-        await self.vna.cmd(":VNA:CALibration:LOAD /SOLT.CAL")
-        await self.vna.cmd(":VNA:CAL:TYPE SOLT")
-        await self.vna.cmd(":VNA:SWEEP FREQUENCY")
-        await self.vna.cmd(":VNA:STIM:LVL -10")
-        await self.vna.cmd(":VNA:ACQ:IFBW 2500")
-        await self.vna.cmd(":VNA:ACQ:AVG 1")
-        await self.vna.cmd(":VNA:ACQ:POINTS 200")
-        await self.vna.cmd(":VNA:AQC 1")
-        #vna.cmd(":VNA:AQQuisition:AVG 1")
-        #vna.cmd(":VNA:FREQuency:SPAN 1")
-        await self.vna.cmd(":VNA:FREQuency:START 10000000")
-        await self.vna.cmd(":VNA:FREQuency:STOP 3000000000")
+        unknown = set(sweep) - set(self.sweep)
+        if unknown:
+            raise ValueError("unknown sweep settings {}".format(', '.join(sorted(unknown))))
+        axis = ('start', 'stop', 'points')
+        if any(sweep.get(k, self.sweep[k]) != self.sweep[k] for k in axis):
+            self.freq = None
+        retime = any(sweep.get(k, self.sweep[k]) != self.sweep[k] for k in ('points', 'ifbw'))
+        self.sweep.update(sweep)
+        sweep = self.sweep
+        if retime:
+            self.scheduler = self._scheduler()
+
+        # switch to VNA mode, setup the sweep parameters, skipping anything
+        # already set on this connection
+        settings = [
+            (":DEV:MODE", "VNA"),
+            #(":VNA:CAL:LOAD", self.calibration),
+            (":VNA:CALibration:LOAD", "/SOLT.CAL"),
+            (":VNA:CAL:TYPE", "SOLT"),
+            (":VNA:SWEEP", "FREQUENCY"),
+            (":VNA:STIM:LVL", sweep['level']),
+            (":VNA:ACQ:IFBW", sweep['ifbw']),
+            (":VNA:ACQ:AVG", sweep['avg']),
+            (":VNA:ACQ:POINTS", sweep['points']),
+            (":VNA:AQC", 1),
+            #vna.cmd(":VNA:AQQuisition:AVG 1")
+            #vna.cmd(":VNA:FREQuency:SPAN 1")
+            (":VNA:FREQuency:START", sweep['start']),
+            (":VNA:FREQuency:STOP", sweep['stop']),
+        ]
+        changed = [(cmd, value) for cmd, value in settings if self.applied.get(cmd) != value]
+        if not changed:
+            return
+        print("Setting up the sweep ({} changes)...".format(len(changed)))
+        await self.vna.batch(["{} {}".format(cmd, value) for cmd, value in changed])
+        self.applied.update(changed)
 
         # wait for the sweep to finish
         print("Waiting for the sweep to finish...")
-        while await self.vna.query(":VNA:ACQ:FIN?") == "FALSE":
-            await asyncio.sleep(0.1)
+        await self.scheduler.wait_finished(self.vna.query)
 
     async def close(self):
         if self.vna:
             return await self.vna.close()
 
-    async def writedata(self, output, run_seconds=None):
+    async def writedata(self, output, run_seconds=None, dzt=None, processing=None):
+        """ captures to data/<output> for run_seconds (until cancelled if None)
+
+        with dzt, sweeps are also transformed as they are written and the
+        DZT at that path is complete when the capture ends. processing is
+        a chain of stages for those traces, see processing.py
+        """
+        chain = ProcessingChain.parse(processing) if dzt else None
 
         if self.vna is None:
             await self.connect()
             await self.scan()
 
-        loop = asyncio.get_event_loop()
-
         # grab the data of trace S11
         print("Reading trace data...")
         self.directory = 'data/{}'.format(output)
@@ -98,47 +263,59 @@ class VNAGPR(object):
 
         os.makedirs(self.directory)
         start_time = datetime.datetime.utcnow()
+        # catalog writes and the directory listing run on a thread, the
+        # event loop keeps serving the rover and live clients meanwhile
+        loop = asyncio.get_event_loop()
+        catalog = Catalog(os.path.dirname(self.directory))
+        await loop.run_in_executor(None, lambda: catalog.update(output, state=CAPTURING))
 
-        tasks = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-
+        if self.use_raw:
+            fetch = self.vna.read_trace
+        else:
+            fetch = lambda: self.vna.query_raw(":VNA:TRACE:DATA? S21")
+        self.scheduler.reset_stats()
 
+        directory, sweep = self.directory, dict(self.sweep)
+        if self.use_csv:
+            store = lambda freq: CSVWriter(directory, freq)
+        else:
+            store = lambda freq: CaptureWriter(os.path.join(directory, CAPTURE_FILE), freq, sweep)
+        if dzt:
+            sink = lambda freq: SinkGroup([store(freq), IncrementalTDR(dzt, freq, chain)])
+        else:
+            sink = store
+        self.pipeline = CapturePipeline(sink, maxsize=self.queue_size, policy=self.overflow).start()
+        self.pipeline.subscribers.extend(self.subscribers)
+        deadline = time.monotonic() + run_seconds if run_seconds else None
+        try:
             while True:
+                data = await self.scheduler.next_trace(fetch, deadline)
+                if data is None:
+                    print("running for {} seconds, stopping capture".format(run_seconds))
+                    break
                 start = datetime.datetime.utcnow()
-                if self.use_raw:
-                    data = await self.vna.read_trace()
-                else:
-                    data = await self.vna.query(":VNA:TRACE:DATA? S21")
-
-                end = datetime.datetime.utcnow()
-                total_seconds = (end - start).total_seconds()
-                print("took {} seconds".format(total_seconds))
-                if self.use_raw:
-                    S21 = await self.vna.read_trace()
-                else:
-                    S21 = self.vna.parse_trace_data(data)
-                print(output)
-
-                def write_file():
-                    #todo use more efficient async file writes
-                    with open('{}/{}'.format(self.directory, start.isoformat()),'w') as e:
-                        writer = csv.writer(e)
-
-                        for row in S21:
-                            freq, real, imag = row[0], row[1].real, row[1].imag
-                            writer.writerow((freq,real,imag))
-
-                tasks.append(loop.run_in_executor(executor, write_file))
+                freq, S21 = self.parse_trace(data)
 
-                time_ran = datetime.datetime.utcnow() - start_time
-                if total_seconds < 0.01:
-                    await asyncio.sleep(0.01)
+                timestamp = start.replace(tzinfo=datetime.timezone.utc).timestamp()
+                await self.pipeline.put(timestamp, freq, S21)
 
+                time_ran = datetime.datetime.utcnow() - start_time
                 if run_seconds and time_ran.total_seconds() > run_seconds:
                     print("running for {} seconds, stopping capture".format(run_seconds))
                     break
-            await asyncio.gather(*tasks)
-
+        finally:
+            # flushes queued sweeps even when the capture is cancelled
+            await self.pipeline.close()
+            duration = (datetime.datetime.utcnow() - start_time).total_seconds()
+            directory = self.directory
+
+            def record():
+                catalog.captured(output, directory, duration)
+                if chain is not None:
+                    catalog.update(output, processing=chain.report())
+            await asyncio.shield(loop.run_in_executor(None, record))
+            print(self.scheduler.report())
+            print("capture pipeline: {}".format(self.pipeline.to_dict()))
 
     async def run(self):
         await self.connect()
@@ -160,13 +337,17 @@ def main():
                     help="run tdr  pipeline ( only works with time set)")
     parser.add_argument("-r", "--raw",  action="store_true",
                     help="Use RAWVNA protocol")
+    parser.add_argument("-c", "--csv",  action="store_true",
+                    help="write one CSV file per sweep instead of a capture file")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                    help="worker processes for the tdr pipeline")
 
 
     args = parser.parse_args()
     output = args.output
 
     try:
-        GPR = VNAGPR(use_raw=args.raw)
+        GPR = VNAGPR(use_raw=args.raw, use_csv=args.csv)
         asyncio.set_event_loop(asyncio.new_event_loop())
         loop = asyncio.get_event_loop()
         loop.run_until_complete(GPR.writedata(args.output, args.time))
@@ -174,7 +355,7 @@ def main():
         if args.time and args.pipeline:
             print("stopping data collection, running pipeline")
             tdr = TDR(use_csv=True)
-            tdr.listFolder(GPR.directory + '/', GPR.directory +'o')
+            tdr.listFolder(GPR.directory + '/', GPR.directory +'o', workers=args.workers)
     finally:
 
         loop.run_until_complete(GPR.close())
@@ -1,49 +1,554 @@
 import argparse
 
+import functools
 import logging
 import math
 
 import numpy as np
 import pandas as pd
-import scipy.signal as signal
+import scipy.fft
 
 import skrf as rf
 
 import glob
+import io
 import sys
 import struct
 import os
+import time
+import concurrent.futures
+
+try:
+    from .traces import DZT_SCALE, TraceAccumulator, dzt_samples, signed_dzt_samples
+    from .capture import CaptureReader, CAPTURE_FILE, csv_timestamp
+    from .spatial import POSE_FILE, read_poses, survey
+    from .debug import trace_dump
+    from .processing import ProcessingChain
+except ImportError:
+    from traces import DZT_SCALE, TraceAccumulator, dzt_samples, signed_dzt_samples
+    from capture import CaptureReader, CAPTURE_FILE, csv_timestamp
+    from spatial import POSE_FILE, read_poses, survey
+    from debug import trace_dump
+    from processing import ProcessingChain
+
+C = 299792458
+FFT_POINTS = 2**14
+# depth range (ns) and samples per trace to plan the FFT for, the whole
+# unambiguous range at FFT_POINTS samples if unset
+RANGE_NS = float(os.environ.get('TDR_RANGE_NS', 0)) or None
+SAMPLES = int(os.environ.get('TDR_SAMPLES', 1024))
+
+
+def parse_zoom(value):
+    """ "start,stop" in ns to a (start_ns, stop_ns) window, None if empty"""
+    if not value:
+        return None
+    start_ns, stop_ns = (float(v) for v in value.split(','))
+    if not 0 <= start_ns < stop_ns:
+        raise ValueError("zoom window needs 0 <= start < stop, got {}".format(value))
+    return start_ns, stop_ns
+
+
+# time window (ns) to evaluate with the chirp-z transform instead of an FFT
+ZOOM_NS = parse_zoom(os.environ.get('TDR_ZOOM_NS'))
+
+
+def plan_fft_points(n_points, span_ns, range_ns=None, samples=SAMPLES):
+    """ (fft length, samples kept) to resolve range_ns with at least samples samples
+
+    the IFFT always spans the unambiguous range 1/df, so a trace that only
+    needs the first range_ns gets a shorter transform, cut to the range
+    """
+    if range_ns is None or range_ns >= span_ns:
+        return FFT_POINTS, FFT_POINTS
+    fft_points = scipy.fft.next_fast_len(max(int(math.ceil((samples - 1) * span_ns / range_ns)) + 1, n_points))
+    dt = span_ns / (fft_points - 1)
+    return fft_points, min(fft_points, int(math.ceil(range_ns / dt)) + 1)
+
+
+def freeze(*arrays):
+    for a in arrays:
+        a.flags.writeable = False
+
+
+class TDRKernel(object):
+    """ window and axes shared by every trace of a sweep configuration, see kernel()"""
+
+    def __init__(self, n_points, start, stop, fft_points, n_samples):
+        step_size = (stop - start) / (n_points - 1)
+        if step_size == 0:
+            raise ValueError("Cannot compute cable length at 0 span")
+        self.fft_points = fft_points
+        self.n_samples = n_samples
+        self.window = np.blackman(n_points)
+        self.time_axis = np.linspace(0, 1/step_size, fft_points)[:n_samples]
+        self.time = self.time_axis * 10**9 # s to ns
+        self.distance_axis = self.time_axis * C
+        freeze(self.window, self.time_axis, self.time, self.distance_axis)
+
+    def transform(self, s21):
+        td = np.fft.ifft(s21 * self.window, self.fft_points, axis=1)
+        if self.n_samples < self.fft_points:
+            td = td[:, :self.n_samples]
+        if self.fft_points != FFT_POINTS:
+            # ifft divides by its length, keep magnitudes (and DZT samples) on the 2**14 scale
+            td *= self.fft_points / FFT_POINTS
+        return td
+
+
+class ZoomKernel(object):
+    """ chirp-z (Bluestein) transform evaluating the TDR at n_samples times from start_ns to stop_ns
+
+    the windowed sweep is chirped, convolved with the conjugate chirp by FFTs
+    of length n_points + n_samples - 1 (rounded up to a fast size) and
+    chirped again, so the cost follows the window instead of the 1/df span.
+    magnitudes are on the same scale as the 2**14 point IFFT
+    """
+
+    def __init__(self, n_points, start, stop, start_ns, stop_ns, n_samples):
+        df = (stop - start) / (n_points - 1)
+        if df == 0:
+            raise ValueError("Cannot compute cable length at 0 span")
+        if n_samples < 2:
+            raise ValueError("need at least two samples in the zoom window")
+        t0, dt = start_ns * 1e-9, (stop_ns - start_ns) * 1e-9 / (n_samples - 1)
+        self.n_samples = n_samples
+        self.fft_points = scipy.fft.next_fast_len(n_points + n_samples - 1)
+        self.window = np.blackman(n_points)
+        self.time = np.linspace(start_ns, stop_ns, n_samples)
+        self.time_axis = self.time * 1e-9
+        self.distance_axis = self.time_axis * C
+
+        # exp(i pi df dt j^2), the exponent reduced mod 2 before it loses precision
+        def chirp(j):
+            return np.exp(1j * np.pi * np.mod(df * dt * j.astype(float)**2, 2.0))
+
+        n, k = np.arange(n_points), np.arange(n_samples)
+        self.pre = self.window * np.exp(2j * np.pi * np.mod(df * t0 * n, 1.0)) * chirp(n)
+        b = np.zeros(self.fft_points, dtype=complex)
+        b[:n_samples] = np.conj(chirp(k))
+        b[self.fft_points - n_points + 1:] = np.conj(chirp(np.arange(n_points - 1, 0, -1)))
+        self.filter = np.fft.fft(b)
+        self.post = chirp(k) / FFT_POINTS
+        freeze(self.window, self.time, self.time_axis, self.distance_axis, self.pre, self.filter, self.post)
+
+    def transform(self, s21):
+        spectrum = np.fft.fft(s21 * self.pre, self.fft_points, axis=1)
+        spectrum *= self.filter
+        return np.fft.ifft(spectrum, axis=1)[:, :self.n_samples] * self.post
+
+
+@functools.lru_cache(maxsize=32)
+def kernel(n_points, start, stop, fft_points, n_samples):
+    return TDRKernel(n_points, start, stop, fft_points, n_samples)
+
+
+@functools.lru_cache(maxsize=32)
+def zoom_kernel(n_points, start, stop, start_ns, stop_ns, n_samples):
+    return ZoomKernel(n_points, start, stop, start_ns, stop_ns, n_samples)
+
+
+def step_response(td):
+    """ full convolution of each trace with a unit step of the same length, in linear time
+
+    the first n outputs are the running sum, the last n - 1 the sum of what's left
+    """
+    total = np.cumsum(td, axis=-1)
+    return np.concatenate([total, total[..., -1:] - total[..., :-1]], axis=-1)
+
+
+class BatchTDR(object):
+    """ vectorized TDR over a stack of sweeps
+
+    takes an (n_traces x n_freq) complex S21 array and runs the window,
+    IFFT, step response and impedance steps for every trace in one pass.
+    fft_points defaults to a length planned from range_ns, the traces are
+    cut to the samples covering it. with zoom_ns = (start, stop) only that
+    time window is evaluated, at samples points, by the chirp-z transform
+    """
+
+    def __init__(self, freq, fft_points=None, range_ns=RANGE_NS, samples=SAMPLES, zoom_ns=ZOOM_NS):
+        self.freq = np.asarray(freq, dtype=float)
+
+        if len(self.freq) < 2:
+            raise ValueError("need at least two frequency points")
+        start, stop = float(self.freq[0]), float(self.freq[-1])
+        if stop == start:
+            raise ValueError("Cannot compute cable length at 0 span")
+        if zoom_ns is not None and fft_points is None:
+            self.kernel = zoom_kernel(len(self.freq), start, stop, float(zoom_ns[0]), float(zoom_ns[1]), samples)
+        else:
+            if fft_points is None:
+                span_ns = (len(self.freq) - 1) / (stop - start) * 10**9
+                fft_points, n_samples = plan_fft_points(len(self.freq), span_ns, range_ns, samples)
+            else:
+                n_samples = fft_points
+            self.kernel = kernel(len(self.freq), start, stop, fft_points, n_samples)
+        self.fft_points = self.kernel.fft_points
+        self.n_samples = self.kernel.n_samples
+        self.window = self.kernel.window
+        self.time_axis = self.kernel.time_axis
+        self.time = self.kernel.time
+        self.distance_axis = self.kernel.distance_axis
+
+    @property
+    def position_ns(self):
+        """ time of the first sample, the DZT rhf_position"""
+        return float(self.time[0])
+
+    @property
+    def range_ns(self):
+        """ time covered by a trace, the DZT rhf_range"""
+        return float(self.time[-1] - self.time[0])
+
+    def calc(self, s21, impedance=False):
+        """ returns the (n_traces x n_samples) TDR magnitude for s21"""
+        s21 = np.atleast_2d(s21)
+        self.td = np.abs(self.kernel.transform(s21))
+        if impedance:
+            self.step_response = step_response(self.td)
+            self.step_response_Z = 50 * (1 + self.step_response) / (1 - self.step_response)
+        return self.td
+
+
+def dzt_body(gpr):
+    """ serializes traces into the 16 bit little endian DZT sample body"""
+    if gpr.dtype != np.uint16:
+        gpr = dzt_samples(gpr)
+    return gpr.astype('<u2', copy=False).tobytes()
+
+
+def dzt_header(n_samples, sps=1.0, spm=4.0, range_ns=0.0, position_ns=0.0):
+    """ the 1024 byte DZT header, sps / spm are the scans per second / meter (0 if unknown)
+
+    range_ns is the time a trace covers, position_ns the time of its first sample
+    """
+    #header
+    #
+    # struct.pack
+    # > big endian
+    # B unsigned char (1 byte)
+    # f float (4 bytes)
+    # H unsigned short (2 bytes)
+    # I unsigned int (4 bytes)
+    # Q long lon (8 bytes)
+    # s [] string
+    fh = io.BytesIO()
+    rh_tag = 0x0700 #static?
+    fh.write(struct.pack('<H', rh_tag))
+    rh_data = 1024 #constant
+    fh.write(struct.pack('<H', rh_data))
+    rh_nsamp = n_samples #samples  per scan
+    fh.write(struct.pack('<H', rh_nsamp))
+    rh_bits = 16 # bits per data word
+    fh.write(struct.pack('<H', rh_bits))
+    rh_zero = 0x8000 #constant
+    fh.write(struct.pack('<H', rh_zero))
+    rhf_sps = sps #scans per second
+    fh.write(struct.pack('<f', rhf_sps))
+    rhf_spm = spm #scans per meter
+    fh.write(struct.pack('<f', rhf_spm))
+    rhf_mpm = 0.0 # meters per mark
+    fh.write(struct.pack('<f', rhf_mpm))
+    rhf_position = position_ns # position
+    fh.write(struct.pack('<f', rhf_position))
+    rhf_range = range_ns # range in ns
+    fh.write(struct.pack('<f', rhf_range))
+    ###ok until here
+    rh_npass = 0 # passes
+    fh.write(struct.pack('<H', rh_npass))
+    rhb_cft = 0 #creation date & time
+    fh.write(struct.pack('<I', rhb_cft))
+    rhb_mdt = 0 #last modification date & time
+    fh.write(struct.pack('<I', rhb_mdt))
+    rh_rgain = 1 #offset ti range gain function
+    fh.write(struct.pack('<H', rh_rgain))
+    rh_nrgain = 1 #size of range gain function
+    fh.write(struct.pack('<H', rh_nrgain))
+    rh_text = 0x0200 #offset to text
+    fh.write(struct.pack('<H', rh_text))
+    rh_ntext = 0 #size of text
+    fh.write(struct.pack('<H', rh_ntext))
+    rh_proc = 0 #0x0080 #offset to processing history
+    fh.write(struct.pack('<H', rh_proc))
+    rh_nproc = 0x0000 #size of processing history
+    fh.write(struct.pack('<H', rh_nproc))
+    rh_nchan = 1 #number of channels
+    fh.write(struct.pack('<H', rh_nchan))
+    rhf_epsr = 1.0 #average dielectric constant
+    fh.write(struct.pack('<f', rhf_epsr))
+    rhf_top = 0.1 #position in meters
+    fh.write(struct.pack('<f', rhf_top))
+    rhf_depth = 5.0 #range in meters
+    fh.write(struct.pack('<f', rhf_depth))
+    rhc_coordX = 0 #X coordinates
+    fh.write(struct.pack('<Q', rhc_coordX))
+    rhf_servo_level = 0.0 # gain servo level
+    fh.write(struct.pack('<f', rhf_servo_level))
+    reserved = bytes(3) #3 bytes reserved
+    fh.write(reserved)
+    rh_accomp = 0 #ant conf component
+    fh.write(struct.pack('<B', rh_accomp))
+    rh_sconfig = 1 #setup configuration number
+    fh.write(struct.pack('<H', rh_sconfig))
+    sh_spp = 0 #scans per pass
+    fh.write(struct.pack('<H', rh_accomp))
+    rh_linenum = 1 #line number
+    fh.write(struct.pack('<H', rh_linenum))
+    rhc_coordY = 0
+    fh.write(struct.pack('<Q', rhc_coordY))
+    rh_lineorder = 0 # slice type
+    fh.write(struct.pack('<B', rh_lineorder))
+    rh_dtype = 0 #
+    fh.write(struct.pack('<B', rh_dtype))
+    rh_antname = "Testfile      "  # 14 char
+    fh.write(rh_antname.encode())
+    rh_pass = 1 #active TX mask
+    fh.write(struct.pack('<B', rh_pass))
+    rh_version = 0b0100000 # first 3 bits = 1 for NO GPS, 2 for GPS
+    fh.write(struct.pack('<B', rh_version))
+    rh_name = "default1.dzt" # orginial file name 12 chars
+    fh.write(rh_name.encode())
+    rh_chksum = 0
+    #fh.write(len(self.gpr[0]))
+    #fillup = bytearray(896) # empty data to fill header to 1024 byte
+    fillup = bytearray(898) # empty data to fill header to 1024 byte
+    fh.write(fillup)
+    return fh.getvalue()
+
+
+class DZTWriter(object):
+    """ appends traces to a DZT as they are computed, the header is written on close"""
+
+    def __init__(self, path, n_samples):
+        self.path = path
+        self.n_samples = n_samples
+        self.count = 0
+        self.fh = open(path, 'wb')
+        # placeholder until the scan rate and range are known
+        self.fh.write(bytes(1024))
+
+    def append(self, gpr):
+        self.fh.write(dzt_body(gpr))
+        self.count += len(gpr)
+
+    def close(self, sps=0.0, spm=0.0, range_ns=0.0, position_ns=0.0):
+        self.fh.seek(0)
+        self.fh.write(dzt_header(self.n_samples, sps, spm, range_ns, position_ns))
+        self.fh.close()
+
+
+class IncrementalTDR(object):
+    """ capture pipeline sink, transforms each batch of sweeps and appends it to a DZT
+
+    runs on the pipeline's writer thread, so the DZT is complete as soon as
+    the capture is flushed
+    """
+
+    def __init__(self, path, freq, chain=None):
+        self.engine = BatchTDR(freq)
+        self.dzt = DZTWriter(path, self.engine.n_samples)
+        # processing.ProcessingChain run over each batch before it's written
+        self.chain = chain
+        self.first = self.last = None
+
+    def write_many(self, timestamps, s21):
+        td = self.engine.calc(s21)
+        dump = trace_dump()
+        if dump is not None:
+            dump.write_many(timestamps, self.engine.time, td)
+        if self.chain is not None:
+            self.dzt.append(signed_dzt_samples(self.chain.process(td, self.engine.time)))
+        else:
+            self.dzt.append(td)
+        if self.first is None:
+            self.first = timestamps[0]
+        self.last = timestamps[-1]
+
+    @property
+    def sps(self):
+        if self.dzt.count < 2 or not self.last > self.first:
+            return 0.0
+        return (self.dzt.count - 1) / (self.last - self.first)
+
+    def close(self):
+        self.dzt.close(sps=self.sps, range_ns=self.engine.range_ns, position_ns=self.engine.position_ns)
+
+
+def read_dzt(path):
+    """ (header fields sps, spm, range_ns, position_ns) and a read only memmap of the traces"""
+    with open(path, 'rb') as fh:
+        header = fh.read(1024)
+    n_samples, = struct.unpack_from('<H', header, 4)
+    sps, spm, _, position_ns, range_ns = struct.unpack_from('<fffff', header, 10)
+    count = (os.path.getsize(path) - 1024) // (2 * n_samples)
+    gpr = np.memmap(path, dtype='<u2', mode='r', offset=1024, shape=(count, n_samples))
+    return (sps, spm, range_ns, position_ns), gpr
+
+
+def capture_times(folder):
+    """ POSIX time of every sweep in a scan directory, in capture order"""
+    capture = os.path.join(folder, CAPTURE_FILE)
+    if os.path.exists(capture):
+        return np.array(CaptureReader(capture).times)
+    files = [f for f in sorted(glob.glob(os.path.join(folder, '*'))) if os.path.basename(f) != POSE_FILE]
+    return np.array([csv_timestamp(f) for f in files], dtype=float)
+
+
+def resample_dzt(path, times, poses, spm):
+    """ rewrites a time ordered DZT at spm scans per meter along the logged path
+
+    times are the capture times of the DZT's traces, the traces' poses are
+    written next to it as for TDR.listFolder
+    """
+    (sps, _, range_ns, position_ns), gpr = read_dzt(path)
+    gridded, grid_poses = survey(gpr, times[:len(gpr)], poses, spm)
+    del gpr
+    writer = DZTWriter(path + '.tmp', gridded.shape[1])
+    writer.append(gridded)
+    writer.close(sps, spm, range_ns, position_ns)
+    os.replace(path + '.tmp', path)
+    np.savetxt(path + '.poses.csv', grid_poses, delimiter=',', fmt='%.6f',
+               header='x,y,yaw', comments='')
+    return grid_poses
+
+
+# sweep files / capture records handed to a worker per task
+CHUNK_FILES = 32
+CHUNK_SWEEPS = 256
+
+
+def process_files(files, use_csv=True, raw=False):
+    """ parses a run of sweep files and returns their TDR traces as DZT samples
+
+    module level so it can be sent to a process pool. raw returns float32
+    magnitudes instead, for processing before the DZT
+    """
+    tdr = TDR(use_csv=use_csv)
+    s21 = []
+    for f in files:
+        tdr.readFile(f, calc=False)
+        s21.append(np.asarray(tdr.re) + 1j * np.asarray(tdr.im))
+    engine = BatchTDR(tdr.freq)
+    td = engine.calc(np.array(s21))
+    return td.astype(np.float32) if raw else dzt_samples(td)
+
+
+def process_capture(path, start, stop, raw=False):
+    """ TDR traces (as DZT samples, or float32 if raw) for records start:stop of a capture file"""
+    capture = CaptureReader(path)
+    engine = BatchTDR(capture.freq)
+    td = engine.calc(capture.s21[start:stop])
+    return td.astype(np.float32) if raw else dzt_samples(td)
+
 
 class TDR():
+    # traces beyond this many bytes are spilled to a memory mapped file next to the output
+    max_memory = int(os.environ.get('TDR_MAX_MEMORY', 256 * 2**20))
+
     def __init__(self,use_csv=True):
         self.freq = []
         self.im = []
         self.re = []
         self.use_csv = use_csv
 
-    def listFolder(self,folder,output):
-        files = glob.glob(folder + '*')
-        files.sort()
-        self.gpr = [None] * 2**14
-        for d in files:
-            if self.use_csv:
-                self.readCSV(d)
+    def listFolder(self,folder,output,workers=1,executor=None,spm=None,chain=None):
+        """ runs TDR over every sweep in folder and writes the DZT
+
+        folder holds either a capture file or one file per sweep. with
+        workers > 1 (or an executor, made with workers processes) sweeps are
+        parsed and transformed in a process pool, traces come back in
+        timestamp order. with spm and a pose log in folder traces are
+        resampled to spm scans per meter.
+        a processing.ProcessingChain is run over the traces block by block
+        as they come back
+        """
+        capture = os.path.join(folder, CAPTURE_FILE)
+        pose_file = os.path.join(folder, POSE_FILE)
+        if os.path.exists(capture):
+            reader = CaptureReader(capture)
+            count = len(reader)
+            jobs = [(capture, i, i + CHUNK_SWEEPS, chain is not None) for i in range(0, count, CHUNK_SWEEPS)]
+            job = process_capture
+            self.freq = reader.freq
+            times = np.array(reader.times)
+            del reader
+        else:
+            files = [f for f in sorted(glob.glob(folder + '*')) if os.path.basename(f) != POSE_FILE]
+            count = len(files)
+            times = np.array([csv_timestamp(f) for f in files], dtype=float)
+            jobs = [(files[i:i + CHUNK_FILES], self.use_csv, chain is not None) for i in range(0, count, CHUNK_FILES)]
+            job = process_files
+            if files:
+                # time axis for the header comes from the (shared) frequency axis
+                self.readFile(files[0], calc=False)
+
+        # trace length follows the planned FFT, the workers plan the same one
+        engine = BatchTDR(self.freq) if count else None
+        n_samples = engine.n_samples if count else FFT_POINTS
+        traces = TraceAccumulator(n_samples, capacity=count,
+                                  max_bytes=self.max_memory, spill_path=output + '.traces')
+        own_executor = None
+        if executor is None and workers > 1:
+            executor = own_executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        start = time.perf_counter()
+        try:
+            if executor is None or not jobs:
+                results = (job(*args) for args in jobs)
+            else:
+                results = executor.map(job, *zip(*jobs))
+            # sampled binary dump when TDR_DEBUG_FILE is set, written here so
+            # workers never share the file
+            dump = trace_dump()
+            for samples in results:
+                if dump is not None:
+                    td = samples if chain is not None else samples / DZT_SCALE
+                    stamps = times[len(traces):len(traces) + len(samples)]
+                    dump.write_many(np.where(np.isfinite(stamps), stamps, 0.0), engine.time, td)
+                if chain is not None:
+                    samples = signed_dzt_samples(chain.process(samples, engine.time))
+                traces.extend(samples)
+            elapsed = time.perf_counter() - start
+            print("done, {} traces in {:.2f} s ({:.1f} traces/s, {} workers)".format(
+                len(traces), elapsed, len(traces) / max(elapsed, 1e-9), workers))
+            if count:
+                self.time = engine.time
+            self.gpr = traces.array
+            # scan rate from the sweep timestamps, unknown for untimestamped files
+            sps = 0.0
+            if count > 1 and np.isfinite(times).all() and times[-1] > times[0]:
+                sps = (count - 1) / (times[-1] - times[0])
+            if spm and sps and os.path.exists(pose_file):
+                self.gpr, poses = survey(self.gpr, times, read_poses(pose_file), spm)
+                np.savetxt(output + '.poses.csv', poses, delimiter=',', fmt='%.6f',
+                           header='x,y,yaw', comments='')
+                print("resampled {} traces to {} at {} scans/m".format(count, len(self.gpr), spm))
             else:
-                self.readP2S(d)
-            self.gpr = np.vstack([self.gpr, self.td])
-        print("done")
-        self.writeDZT(output)
+                spm = 0.0
+            self.writeDZT(output, sps=sps, spm=spm)
+        finally:
+            if own_executor is not None:
+                own_executor.shutdown()
+            self.gpr = None
+            traces.close()
 
-    def readP2S(self,file):
+    def readFile(self,file,calc=True):
+        if self.use_csv:
+            self.readCSV(file, calc=calc)
+        else:
+            self.readP2S(file, calc=calc)
+
+    def readP2S(self,file,calc=True):
         """ for real s2p files"""
         ts=  rf.Network(file)
 
         self.re= ts.s21.s_re[:,0,0]
         self.im= ts.s21.s_im[:,0,0]
         self.freq=ts.f
-        self.calcTDR()
+        if calc:
+            self.calcTDR()
 
-    def readCSV(self,file):
+    def readCSV(self,file,calc=True):
         """ for CSV files"""
 
         df = pd.read_csv(file,header=None,names=['freq','real','imag'])
@@ -56,160 +561,49 @@ class TDR():
             self.im= np.array(df['imag'])
             self.freq= np.array(df['freq'])
 
-
-        self.calcTDR()
+        if calc:
+            self.calcTDR()
 
 
     def calcTDR(self):
         print("calc TDR!!")
-        c = 299792458
-        FFT_POINTS = 2**14
-        #FFT_POINTS = 2**10
 
         if len(self.freq) < 2:
             return
 
-        step_size = self.freq[1] - self.freq[0]
-        if step_size == 0:
-            self.tdr_result_label.setText("")
-            print("Cannot compute cable length at 0 span")
+        try:
+            engine = BatchTDR(self.freq)
+        except ValueError as e:
+            print(e)
             return
 
-        s21 = []
-        l = len(self.freq)
-        for d in range(0,l):
-            s21.append(np.complex(self.re[d], self.im[d]))
-
-        window = np.blackman(len(self.freq))
-
-        windowed_s21 = window * s21
-        self.td = np.abs(np.fft.ifft(windowed_s21, FFT_POINTS))
-        step = np.ones(FFT_POINTS)
-        self.step_response = signal.convolve(self.td, step)
-
-        self.step_response_Z = 50 * (1 + self.step_response) / (1 - self.step_response)
+        s21 = np.asarray(self.re) + 1j * np.asarray(self.im)
+        self.td = engine.calc(s21, impedance=True)[0]
+        self.step_response = engine.step_response[0]
+        self.step_response_Z = engine.step_response_Z[0]
 
-        time_axis = np.linspace(0, 1/step_size, FFT_POINTS)
-        self.time = time_axis * 10**9 # s to ns
-        self.distance_axis = time_axis * c
+        self.time = engine.time
+        self.distance_axis = engine.distance_axis
 
         index_peak = np.argmax(self.td)
         print (self.distance_axis)
-        l = len(time_axis)
-        f = open("tdr.csv", "a")
-        for i in range(0,l):
-            f.write(str(time_axis[i]) + "   " + str(self.td[i]) + "\n")
-        f.close()
+        # sampled binary dump when TDR_DEBUG_FILE is set, see debug.py
+        dump = trace_dump()
+        if dump is not None:
+            dump.write(None, self.time, self.td)
 
-    def writeDZT(self,output):
+    def writeDZT(self,output,sps=1.0,spm=4.0):
+        """ writes self.gpr as a DZT, sps / spm are the scans per second / meter (0 if unknown)"""
         #filename = "test1.DZT"
         filename = output
-        #header
-        #
-        # struct.pack
-        # > big endian
-        # B unsigned char (1 byte)
-        # f float (4 bytes)
-        # H unsigned short (2 bytes)
-        # I unsigned int (4 bytes)
-        # Q long lon (8 bytes)
-        # s [] string
         if os.path.exists(filename):
             os.remove(filename) #this deletes the file
-        fh = open(filename, "wb")
-        rh_tag = 0x0700 #static?
-        fh.write(struct.pack('<H', rh_tag))
-        rh_data = 1024 #constant
-        fh.write(struct.pack('<H', rh_data))
-        rh_nsamp = len(self.gpr[0]) #samples  per scan
-        print ("samples per scan", str(rh_nsamp))
-        fh.write(struct.pack('<H', rh_nsamp))
-        rh_bits = 16 # bits per data word
-        fh.write(struct.pack('<H', rh_bits))
-        rh_zero = 0x8000 #constant
-        fh.write(struct.pack('<H', rh_zero))
-        rhf_sps = 1.0 #scans per second
-        fh.write(struct.pack('<f', rhf_sps))
-        rhf_spm = 4.0 #scans per meter
-        fh.write(struct.pack('<f', rhf_spm))
-        rhf_mpm = 0.0 # meters per mark
-        fh.write(struct.pack('<f', rhf_mpm))
-        rhf_position = 0.0 # position
-        fh.write(struct.pack('<f', rhf_position))
-        rhf_range = self.time[len(self.time)-1] # range in ns
-        print (str(rhf_range))
-        fh.write(struct.pack('<f', rhf_range))
-        ###ok until here
-        rh_npass = 0 # passes
-        fh.write(struct.pack('<H', rh_npass))
-        rhb_cft = 0 #creation date & time
-        fh.write(struct.pack('<I', rhb_cft))
-        rhb_mdt = 0 #last modification date & time
-        fh.write(struct.pack('<I', rhb_mdt))
-        rh_rgain = 1 #offset ti range gain function
-        fh.write(struct.pack('<H', rh_rgain))
-        rh_nrgain = 1 #size of range gain function
-        fh.write(struct.pack('<H', rh_nrgain))
-        rh_text = 0x0200 #offset to text
-        fh.write(struct.pack('<H', rh_text))
-        rh_ntext = 0 #size of text
-        fh.write(struct.pack('<H', rh_ntext))
-        rh_proc = 0 #0x0080 #offset to processing history
-        fh.write(struct.pack('<H', rh_proc))
-        rh_nproc = 0x0000 #size of processing history
-        fh.write(struct.pack('<H', rh_nproc))
-        rh_nchan = 1 #number of channels
-        fh.write(struct.pack('<H', rh_nchan))
-        rhf_epsr = 1.0 #average dielectric constant
-        fh.write(struct.pack('<f', rhf_epsr))
-        rhf_top = 0.1 #position in meters
-        fh.write(struct.pack('<f', rhf_top))
-        rhf_depth = 5.0 #range in meters
-        fh.write(struct.pack('<f', rhf_depth))
-        rhc_coordX = 0 #X coordinates
-        fh.write(struct.pack('<Q', rhc_coordX))
-        rhf_servo_level = 0.0 # gain servo level
-        fh.write(struct.pack('<f', rhf_servo_level))
-        reserved = myArray=np.chararray(3) #3 bytes reserved
-        fh.write(reserved)
-        rh_accomp = 0 #ant conf component
-        fh.write(struct.pack('<B', rh_accomp))
-        rh_sconfig = 1 #setup configuration number
-        fh.write(struct.pack('<H', rh_sconfig))
-        sh_spp = 0 #scans per pass
-        fh.write(struct.pack('<H', rh_accomp))
-        rh_linenum = 1 #line number
-        fh.write(struct.pack('<H', rh_linenum))
-        rhc_coordY = 0
-        fh.write(struct.pack('<Q', rhc_coordY))
-        rh_lineorder = 0 # slice type
-        fh.write(struct.pack('<B', rh_lineorder))
-        rh_dtype = 0 #
-        fh.write(struct.pack('<B', rh_dtype))
-        rh_antname = "Testfile      "  # 14 char
-        fh.write(rh_antname.encode())
-        rh_pass = 1 #active TX mask
-        fh.write(struct.pack('<B', rh_pass))
-        rh_version = 0b0100000 # first 3 bits = 1 for NO GPS, 2 for GPS
-        fh.write(struct.pack('<B', rh_version))
-        rh_name = "default1.dzt" # orginial file name 12 chars
-        fh.write(rh_name.encode())
-        rh_chksum = 0
-        #fh.write(len(self.gpr[0]))
-        #fillup = bytearray(896) # empty data to fill header to 1024 byte
-        fillup = bytearray(898) # empty data to fill header to 1024 byte
-        fh.write(fillup)
-
-        #content
-        l = self.gpr.shape
-        for c in range(1,l[0]):
-            col= self.gpr[c]
-            for m in col:
-                val= m*10**7
-                val= int(val)
-                #fh.write(struct.pack('>H', val))
-                fh.write(val.to_bytes(2, byteorder="little"))
-        fh.close()
+        print ("samples per scan", str(self.gpr.shape[1]))
+        print (str(self.time[-1]))
+        with open(filename, "wb") as fh:
+            fh.write(dzt_header(self.gpr.shape[1], sps, spm, self.time[-1] - self.time[0], self.time[0]))
+            #content
+            fh.write(dzt_body(self.gpr))
 
 def main():
     parser = argparse.ArgumentParser(
@@ -221,6 +615,12 @@ def main():
                     help="ouput file name for DZT, .DZT will be added")
     parser.add_argument("-c", "--csv",  action="store_true",
                     help="use CSV format")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                    help="worker processes")
+    parser.add_argument("-s", "--spm", type=float, default=None,
+                    help="resample to this many scans per meter using the scan's pose log")
+    parser.add_argument("-p", "--processing", type=str, default=None,
+                    help="processing stages for the traces, see processing.py")
 
     args = parser.parse_args()
     input = args.input
@@ -233,8 +633,8 @@ def main():
 
     print('start')
     a = TDR(use_csv=args.csv)
-    a.listFolder(input, output)
-    a.calcTDR()
+    a.listFolder(input, output, workers=args.workers, spm=args.spm,
+                 chain=ProcessingChain.parse(args.processing))
 
 if __name__ == "__main__":
     main()
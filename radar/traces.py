@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+
+DZT_SCALE = 10**7
+
+
+def dzt_samples(rows):
+    """ scales TDR magnitudes to 16 bit DZT sample values (truncating like int())"""
+    samples = np.trunc(np.asarray(rows, dtype=float) * DZT_SCALE)
+    return np.clip(samples, 0, 0xFFFF).astype(np.uint16)
+
+
+def signed_dzt_samples(rows):
+    """ scales processed (signed) traces to 16 bit DZT samples around the header's rh_zero"""
+    samples = np.trunc(np.asarray(rows, dtype=float) * DZT_SCALE) + 0x8000
+    return np.clip(samples, 0, 0xFFFF).astype(np.uint16)
+
+
+class TraceAccumulator(object):
+    """ preallocated, growable (n_traces x n_samples) trace store
+
+    rows are kept as float32 or as uint16 DZT samples. storage grows
+    geometrically, and once it would pass max_bytes it moves into a
+    memory mapped file at spill_path so long surveys don't need to fit in RAM
+    """
+
+    def __init__(self, n_samples, dtype=np.uint16, capacity=64,
+                 max_bytes=None, spill_path=None):
+        self.n_samples = n_samples
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.dtype(np.uint16), np.dtype(np.float32)):
+            raise ValueError("dtype must be uint16 or float32")
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.spilled = False
+        self.count = 0
+        self._data = None
+        self._allocate(max(int(capacity), 1))
+
+    @property
+    def row_bytes(self):
+        return self.n_samples * self.dtype.itemsize
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    @property
+    def array(self):
+        """ view of the rows written so far"""
+        return self._data[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def _allocate(self, capacity):
+        nbytes = capacity * self.row_bytes
+        if not self.spilled and self.max_bytes is not None and nbytes > self.max_bytes:
+            if self.spill_path is None:
+                raise MemoryError("trace store would exceed {} bytes and no spill path is set".format(self.max_bytes))
+            self.spilled = True
+
+        if self.spilled:
+            old = self._data
+            if isinstance(old, np.memmap):
+                old.flush()
+                del old
+                self._data = None
+                mode = 'r+'
+            else:
+                mode = 'w+'
+            data = np.memmap(self.spill_path, dtype=self.dtype, mode=mode,
+                             shape=(capacity, self.n_samples))
+            if mode == 'w+' and self.count:
+                data[:self.count] = self._data[:self.count]
+            self._data = data
+        else:
+            data = np.empty((capacity, self.n_samples), dtype=self.dtype)
+            if self.count:
+                data[:self.count] = self._data[:self.count]
+            self._data = data
+
+    def _reserve(self, n):
+        need = self.count + n
+        if need <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < need:
+            capacity *= 2
+        self._allocate(capacity)
+
+    def _convert(self, rows):
+        if self.dtype == np.uint16:
+            return dzt_samples(rows)
+        return rows
+
+    def append(self, row):
+        self.extend(np.asarray(row)[np.newaxis, :])
+
+    def extend(self, rows):
+        """ appends rows, rows already in the store dtype are copied as is"""
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.n_samples:
+            raise ValueError("expected rows of {} samples".format(self.n_samples))
+        if rows.dtype != self.dtype:
+            rows = self._convert(rows)
+        self._reserve(len(rows))
+        self._data[self.count:self.count + len(rows)] = rows
+        self.count += len(rows)
+
+    def close(self):
+        """ releases the backing store and removes any spill file"""
+        data = self._data
+        self._data = None
+        if isinstance(data, np.memmap):
+            del data
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Scan
+
+
+@admin.register(Scan)
+class ScanAdmin(admin.ModelAdmin):
+    list_display = ('name', 'date', 'state', 'samples', 'duration', 'capture_bytes', 'dzt_bytes')
+    list_filter = ('state',)
@@ -0,0 +1,85 @@
+"""
+Keeps the Scan table in step with the catalog.json the rover writes into
+SCAN_DATA_DIR (see radar/catalog.py), so listing scans is one query
+instead of a walk of every scan directory
+"""
+import datetime
+import json
+import os
+import struct
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Scan
+
+CATALOG_FILE = 'catalog.json'
+
+# see radar/capture.py for the capture file layout
+CAPTURE_FILE = 'sweeps.rvc'
+CAPTURE_PREFIX = struct.Struct('<6sHIII')
+
+FIELDS = ['date', 'state', 'samples', 'duration', 'capture_bytes', 'dzt_bytes', 'updated']
+
+# mtime of the catalog last loaded by this process
+_synced = None
+
+
+def count_samples(scan_path):
+    """ sweeps in a scan directory, from the capture header or one file per sweep"""
+    capture = os.path.join(scan_path, CAPTURE_FILE)
+    if not os.path.exists(capture):
+        return len(os.listdir(scan_path))
+    with open(capture, 'rb') as fh:
+        prefix = fh.read(CAPTURE_PREFIX.size)
+    if len(prefix) < CAPTURE_PREFIX.size:
+        return 0
+    _, _, header_size, points, _ = CAPTURE_PREFIX.unpack(prefix)
+    return max(os.path.getsize(capture) - header_size, 0) // (8 + 8 * points)
+
+
+def parse_date(value):
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+
+def scan_fields(entry):
+    return {'date': parse_date(entry.get('date')),
+            'state': entry.get('state', Scan.CAPTURED),
+            'samples': entry.get('samples', 0),
+            'duration': entry.get('duration'),
+            'capture_bytes': entry.get('capture_bytes', 0),
+            'dzt_bytes': entry.get('dzt_bytes'),
+            'updated': entry.get('updated', 0)}
+
+
+def sync_catalog(force=False):
+    """ loads catalog entries that changed since the last sync, returns the number written
+
+    costs one stat when the catalog hasn't changed
+    """
+    global _synced
+    path = os.path.join(settings.SCAN_DATA_DIR, CATALOG_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+    if mtime == _synced and not force:
+        return 0
+    with open(path) as fh:
+        scans = json.load(fh)['scans']
+
+    known = {name: (pk, updated) for name, pk, updated in
+             Scan.objects.values_list('name', 'id', 'updated')}
+    new, changed = [], []
+    for name, entry in scans.items():
+        if name not in known:
+            new.append(Scan(name=name, **scan_fields(entry)))
+        elif known[name][1] != entry.get('updated', 0):
+            changed.append(Scan(id=known[name][0], name=name, **scan_fields(entry)))
+    with transaction.atomic():
+        Scan.objects.bulk_create(new, batch_size=500)
+        Scan.objects.bulk_update(changed, FIELDS, batch_size=500)
+    _synced = mtime
+    return len(new) + len(changed)
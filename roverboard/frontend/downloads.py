@@ -0,0 +1,126 @@
+"""
+Streaming file responses with HTTP Range, conditional requests and
+optional on the fly gzip, for multi hundred MB radargrams
+
+full downloads go out through FileResponse, so a WSGI server with a file
+wrapper can sendfile() them, ranges and gzip are streamed in CHUNK_SIZE
+pieces, nothing is read into memory whole
+"""
+import os
+import re
+import zlib
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+CHUNK_SIZE = 256 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(stat):
+    return '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def parse_range(header, size):
+    """ (start, stop) of a single byte range, None to send the whole file, ValueError if unsatisfiable"""
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        # malformed or multiple ranges, ignored as RFC 7233 allows
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # suffix range, the last n bytes
+        start, stop = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    if start >= size or start >= stop:
+        raise ValueError("range not satisfiable")
+    return start, stop
+
+
+def read_chunks(path, start=0, stop=None, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = (stop if stop is not None else os.path.getsize(path)) - start
+        while remaining > 0:
+            chunk = fh.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def gzip_chunks(chunks, level=1):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def serve_file(request, path, download_name, compress=False):
+    """ response for path, honouring Range, If-Range and the conditional headers
+
+    compress gzips the body when the client accepts it and didn't ask for a
+    range (ranges always refer to the uncompressed file)
+    """
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    byte_range, unsatisfiable = None, False
+    header = request.META.get('HTTP_RANGE')
+    if header:
+        # If-Range only allows the partial response while the file is unchanged
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+            try:
+                byte_range = parse_range(header, stat.st_size)
+            except ValueError:
+                unsatisfiable = True
+    gzipped = byte_range is None and not unsatisfiable and compress and accepts_gzip(request)
+    if gzipped:
+        # a different representation, so a different validator, and the
+        # conditional headers are checked against the one being sent
+        etag = etag[:-1] + '-gzip"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+    if unsatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+        return response
+
+    if byte_range is not None:
+        start, stop = byte_range
+        response = StreamingHttpResponse(read_chunks(path, start, stop), status=206,
+                                         content_type='application/octet-stream')
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1, stat.st_size)
+        response['Content-Length'] = str(stop - start)
+    elif gzipped:
+        response = StreamingHttpResponse(gzip_chunks(read_chunks(path)),
+                                         content_type='application/octet-stream')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/octet-stream')
+        response.block_size = CHUNK_SIZE
+        response['Content-Length'] = str(stat.st_size)
+
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(download_name)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if compress:
+        response['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from frontend.views import download_file
+
+
+def legacy_download(request, filename):
+    """ the original view, the whole file goes through HttpResponse"""
+    path = os.path.join(settings.SCAN_DATA_DIR, filename+'o')
+    fl = open(path, 'rb')
+    response = HttpResponse(fl, content_type='application/force-download')
+    response['Content-Disposition'] = "attachment; filename=%s.DZT" % filename
+    return response
+
+
+def consume(response):
+    if response.streaming:
+        total = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        total = len(response.content)
+    response.close()
+    return total
+
+
+class Command(BaseCommand):
+    help = "download throughput and peak Python memory, old view against the streaming one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=256, help="DZT size in MB")
+
+    def measure(self, view, request, name):
+        t = time.perf_counter()
+        sent = consume(view(request, name))
+        elapsed = time.perf_counter() - t
+        tracemalloc.start()
+        consume(view(request, name))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return sent, elapsed, peak
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp()
+        settings.SCAN_DATA_DIR = root
+        name = '2022-01-01T00:00:00.000001'
+        # radargram-like body, smooth traces with noise in the low bits
+        traces = options['size'] * 2**20 // (2 * 16384)
+        rng = np.random.default_rng(0)
+        with open(os.path.join(root, name + 'o'), 'wb') as fh:
+            fh.write(bytes(1024))
+            row = (np.exp(-np.linspace(0, 8, 16384)) * 60000).astype('<u2')
+            for i in range(traces):
+                fh.write((row + rng.integers(0, 64, 16384, dtype='<u2')).tobytes())
+        size = os.path.getsize(os.path.join(root, name + 'o'))
+
+        factory = RequestFactory()
+        cases = [
+            ("legacy HttpResponse", legacy_download, factory.get('/')),
+            ("streaming, full", download_file, factory.get('/')),
+            ("streaming, 2nd half", download_file, factory.get('/', HTTP_RANGE='bytes={}-'.format(size // 2))),
+            ("streaming, gzip", download_file, factory.get('/', {'compress': '1'}, HTTP_ACCEPT_ENCODING='gzip')),
+        ]
+        try:
+            self.stdout.write("{:.0f} MB DZT".format(size / 2**20))
+            for label, view, request in cases:
+                sent, elapsed, peak = self.measure(view, request, name)
+                # throughput of file data served, before compression
+                served = size if 'gzip' in label else sent
+                self.stdout.write("{:22s} {:8.1f} MB sent  {:7.1f} MB/s  peak {:8.2f} MB".format(
+                    label, sent / 2**20, served / 2**20 / elapsed, peak / 2**20))
+        finally:
+            shutil.rmtree(root)
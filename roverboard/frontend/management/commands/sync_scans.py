@@ -0,0 +1,38 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from frontend.catalog import count_samples, sync_catalog
+from frontend.models import Scan
+
+
+class Command(BaseCommand):
+    help = "loads the rover's scan catalog, with --walk also adds scan directories missing from it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--walk', action='store_true',
+                            help="list SCAN_DATA_DIR for scans captured before the catalog existed")
+
+    def handle(self, *args, **options):
+        written = sync_catalog(force=True)
+        self.stdout.write("{} scans loaded from the catalog".format(written))
+        if not options['walk']:
+            return
+        known = set(Scan.objects.values_list('name', flat=True))
+        added = []
+        for d in next(os.walk(settings.SCAN_DATA_DIR))[1]:
+            if d == 'None' or d in known:
+                continue
+            scan_path = os.path.join(settings.SCAN_DATA_DIR, d)
+            try:
+                date = datetime.datetime.strptime(d, "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=datetime.timezone.utc)
+            except ValueError:
+                date = None
+            processed = os.path.exists(scan_path + 'o')
+            added.append(Scan(name=d, date=date, samples=count_samples(scan_path),
+                              state=Scan.PROCESSED if processed else Scan.CAPTURED,
+                              dzt_bytes=os.path.getsize(scan_path + 'o') if processed else None))
+        Scan.objects.bulk_create(added, batch_size=500)
+        self.stdout.write("{} scans added from {}".format(len(added), settings.SCAN_DATA_DIR))
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('date', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('state', models.CharField(default='captured', max_length=16)),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('capture_bytes', models.BigIntegerField(default=0)),
+                ('dzt_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('updated', models.FloatField(default=0)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+    ]
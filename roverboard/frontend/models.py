@@ -1,3 +1,31 @@
 from django.db import models
 
-# Create your models here.
+
+class Scan(models.Model):
+    """ one scan directory, mirrored from the catalog the rover writes (see radar/catalog.py)"""
+
+    CAPTURING = 'capturing'
+    CAPTURED = 'captured'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+
+    name = models.CharField(max_length=64, unique=True)
+    date = models.DateTimeField(null=True, blank=True, db_index=True)
+    state = models.CharField(max_length=16, default=CAPTURED)
+    samples = models.PositiveIntegerField(default=0)
+    # seconds of capture
+    duration = models.FloatField(null=True, blank=True)
+    capture_bytes = models.BigIntegerField(default=0)
+    dzt_bytes = models.BigIntegerField(null=True, blank=True)
+    # catalog entry's update time, rows are only rewritten when it changes
+    updated = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def is_processed(self):
+        return self.state == self.PROCESSED
@@ -0,0 +1,240 @@
+"""
+Client for the rover's HTTP API (webserver.py on ROBOT_API_ADDRESS)
+
+requests go over a pooled keep-alive session with connect / read timeouts,
+connection failures are retried, and after a few failures in a row a
+circuit breaker fails calls straight away for a while instead of tying up
+Django workers on a wedged rover. /status is served from a snapshot that is
+refreshed in the background, so rendering a page never waits on the rover
+
+AsyncRoverClient does the same over aiohttp for async views under asgi.py,
+sharing the breaker and the /status snapshot with the sync client so both
+see the same rover state
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class RoverUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """ opens after `threshold` consecutive failures, lets one call through after `reset_timeout` s"""
+
+    def __init__(self, threshold=3, reset_timeout=10.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if time.monotonic() - self.opened >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'half-open':
+                # one trial call, the rest keep failing fast until it's back
+                self.opened = time.monotonic()
+            return state != 'open'
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.monotonic()
+
+
+class StatusCache(object):
+    """ last /status snapshot, with when it was taken"""
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.data = None
+        self.taken = None
+        self.refreshing = False
+
+    def snapshot(self):
+        return {"status": self.data, "age": None if self.taken is None else time.monotonic() - self.taken}
+
+    def stale(self):
+        return self.taken is None or time.monotonic() - self.taken > self.max_age
+
+    def store(self, data):
+        self.data = data
+        self.taken = time.monotonic()
+
+
+class RoverClient(object):
+
+    # seconds, the connect timeout is short so a powered off rover fails fast
+    connect_timeout = 1.0
+    # seconds between /status refreshes
+    status_max_age = 2.0
+
+    def __init__(self, address=None, timeout=None):
+        self.base = 'http://{}'.format(address or settings.ROBOT_API_ADDRESS)
+        self.timeout = (self.connect_timeout, timeout or settings.ROBOT_API_TIMEOUT)
+        self.session = requests.Session()
+        # only failed connections are retried, /start must never be sent twice
+        retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.1)
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=8, max_retries=retry))
+        self.breaker = CircuitBreaker()
+        self.status_cache = StatusCache(self.status_max_age)
+        self.lock = threading.Lock()
+
+    def get(self, path, **params):
+        """ GET path, returns the decoded JSON, raises RoverUnavailable"""
+        if not self.breaker.allow():
+            raise RoverUnavailable("rover API circuit open")
+        try:
+            response = self.session.get(self.base + path, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.breaker.failure()
+            raise RoverUnavailable("rover API {} failed: {}".format(path, e)) from e
+        self.breaker.success()
+        return data
+
+    def start(self, **params):
+        return self.get('/start', **params)
+
+    def cancel(self):
+        return self.get('/cancel')
+
+    def _refresh_status(self):
+        try:
+            self.status_cache.store(self.get('/status'))
+        except RoverUnavailable as e:
+            logger.info("%s", e)
+        finally:
+            self.status_cache.refreshing = False
+
+    def status(self):
+        """ latest /status snapshot, {"status": None, ...} until one arrives, never blocks"""
+        with self.lock:
+            if self.status_cache.stale() and not self.status_cache.refreshing:
+                self.status_cache.refreshing = True
+                threading.Thread(target=self._refresh_status, daemon=True).start()
+        return self.status_cache.snapshot()
+
+
+class AsyncRoverClient(object):
+    """ RoverClient over aiohttp, one per event loop (aiohttp sessions can't cross loops)"""
+
+    connect_timeout = RoverClient.connect_timeout
+    retries = 2
+
+    def __init__(self, shared, address=None, timeout=None):
+        self.base = 'http://{}'.format(address or settings.ROBOT_API_ADDRESS)
+        self.timeout = timeout or settings.ROBOT_API_TIMEOUT
+        self.session = None
+        self.breaker = shared.breaker
+        self.status_cache = shared.status_cache
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get(self, path, **params):
+        """ GET path, returns the decoded JSON, raises RoverUnavailable"""
+        import aiohttp
+        if not self.breaker.allow():
+            raise RoverUnavailable("rover API circuit open")
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=8),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, total=self.timeout))
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(self.base + path, params=params) as response:
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+                error = None
+                break
+            except aiohttp.ClientConnectorError as e:
+                # nothing was sent, safe to retry
+                error = e
+                if attempt < self.retries:
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = e
+                break
+        if error is not None:
+            self.breaker.failure()
+            # timeouts have no message
+            raise RoverUnavailable("rover API {} failed: {}".format(path, str(error) or type(error).__name__)) from error
+        self.breaker.success()
+        return data
+
+    async def start(self, **params):
+        return await self.get('/start', **params)
+
+    async def cancel(self):
+        return await self.get('/cancel')
+
+    async def _refresh_status(self):
+        try:
+            self.status_cache.store(await self.get('/status'))
+        except RoverUnavailable as e:
+            logger.info("%s", e)
+        finally:
+            self.status_cache.refreshing = False
+
+    def status(self):
+        """ latest /status snapshot, refreshed in a background task when stale, never blocks"""
+        if self.status_cache.stale() and not self.status_cache.refreshing:
+            self.status_cache.refreshing = True
+            asyncio.ensure_future(self._refresh_status())
+        return self.status_cache.snapshot()
+
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def rover_client():
+    """ the process wide client, its pool is shared by every request"""
+    global _client
+    if _client is None:
+        _client = RoverClient()
+    return _client
+
+
+def async_rover_client():
+    """ the client for the running event loop"""
+    loop = asyncio.get_event_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncRoverClient(rover_client())
+    return _async_clients[loop]
+
+
+async def close_async_rover_client():
+    """ closes the running loop's client, for ASGI lifespan shutdown"""
+    client = _async_clients.pop(asyncio.get_event_loop(), None)
+    if client is not None:
+        await client.close()
@@ -11,26 +11,34 @@ from django.conf import settings
 import datetime
 import glob
 import os
-import requests
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+
+from .catalog import sync_catalog
+from .downloads import serve_file
+from .models import Scan
+from .rover import RoverUnavailable, rover_client
+
+# see radar/migration.py
+MIGRATED_SUFFIX = '.mig'
 
 class ScanDetailView(TemplateView):
     pass
 
 def download_file(request,filename):
-    # fill these variables with real values
-
+    """ streams a processed DZT, resumable with Range, ?compress=1 gzips it on the fly
 
-    if '/' in filename or '..' in filename:
+    ?migrated=1 sends the migrated profile written on the rover (radar/migration.py)
+    """
+    if '/' in filename or '..' in filename or '\0' in filename:
         #don't allow these characters to move directories
-        return
+        raise Http404("no such scan")
 
-    path = os.path.join(settings.SCAN_DATA_DIR, filename+'o')
-    fl = open(path, 'rb')
-    response = HttpResponse(fl, content_type='application/force-download')
-    download_name = '{}.DZT'.format(filename)
-    response['Content-Disposition'] = "attachment; filename=%s" % download_name
-    return response
+    migrated = request.GET.get('migrated') == '1'
+    path = os.path.join(settings.SCAN_DATA_DIR, filename + ('o' + MIGRATED_SUFFIX if migrated else 'o'))
+    if not os.path.isfile(path):
+        raise Http404("scan {} has no {}".format(filename, "migrated profile" if migrated else "results"))
+    download_name = '{}{}.DZT'.format(filename, '-migrated' if migrated else '')
+    return serve_file(request, path, download_name, compress=request.GET.get('compress') == '1')
 
 class RoverForm(forms.Form):
     distance = forms.FloatField()
@@ -43,8 +51,7 @@ class RoverForm(forms.Form):
             if 'record_gpr' in data:
                 del data['record_gpr']
 
-        requests.get('http://{}/start'.format(settings.ROBOT_API_ADDRESS), params=data)
-        #return response.json()
+        return rover_client().start(**data)
 
 
 class ScanListView(FormView):
@@ -56,32 +63,17 @@ class ScanListView(FormView):
     def form_valid(self, form):
         # This method is called when valid form data has been POSTed.
         # It should return an HttpResponse.
-        form.send_req()
+        try:
+            form.send_req()
+        except RoverUnavailable as e:
+            form.add_error(None, "rover unavailable: {}".format(e))
+            return self.form_invalid(form)
         return super().form_valid(form)
 
     def _get_scans(self):
-        data = {}
-        try:
-            directories = next(os.walk(settings.SCAN_DATA_DIR))[1]
-        except:
-            import traceback; traceback.print_exc()
-            directories = []
-
-        for d in directories:
-            if d == 'None':
-                continue
-            scan_path = os.path.join(settings.SCAN_DATA_DIR, d)
-            result_path = os.path.join(settings.SCAN_DATA_DIR, d+'o')
-
-            try:
-                ts = datetime.datetime.strptime(d,"%Y-%m-%dT%H:%M:%S.%f")
-            except:
-                ts = ''
-
-            data[d] = {'path': scan_path, 'samples': len(os.listdir(scan_path)),
-                        'is_processed': os.path.exists(result_path),
-                        'date': ts}
-        return data
+        # picks up whatever the rover recorded since the last page load
+        sync_catalog()
+        return Scan.objects.all()
 
 
     def get_context_data(self, **kwargs):
@@ -89,6 +81,11 @@ class ScanListView(FormView):
         context['scan_data'] = self._get_scans()
         #context['latest_articles'] = Article.objects.all()[:5]
         if self.request.GET.get('cancel'):
-            requests.get('http://{}/cancel'.format(settings.ROBOT_API_ADDRESS))
+            try:
+                rover_client().cancel()
+            except RoverUnavailable as e:
+                context['rover_error'] = str(e)
+        # last known state, never waits on the rover
+        context['rover'] = rover_client().status()
         # import pdb; pdb.set_trace()
         return context
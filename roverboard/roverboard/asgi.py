@@ -3,6 +3,9 @@ ASGI config for roverboard project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Async views talk to the rover through frontend.rover.async_rover_client(),
+its aiohttp session is closed when the server's lifespan shuts down.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
@@ -13,4 +16,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'roverboard.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from frontend.rover import close_async_rover_client  # noqa: E402, needs the apps loaded
+
+
+async def application(scope, receive, send):
+    """ the Django app, plus lifespan events (which Django doesn't handle)"""
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_rover_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
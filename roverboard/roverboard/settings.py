@@ -135,3 +135,5 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SCAN_DATA_DIR= os.environ.get('SCAN_DATA_DIR','/var/data')
 
 ROBOT_API_ADDRESS = os.environ.get('ROBOT_API_ADDRESS', '127.0.0.1:9005')
+# seconds to wait for a rover API reply, see frontend/rover.py
+ROBOT_API_TIMEOUT = float(os.environ.get('ROBOT_API_TIMEOUT', 3.0))
@@ -0,0 +1,214 @@
+"""
+End to end run without hardware: the webserver drives the fake robot and
+fake LibreVNA through /start?record_gpr=1, then capture, TDR and DZT output
+run as they would on the rover. reports sweeps per second, CPU, peak memory
+and the time from /start to a finished DZT. with --watch, /radargram
+clients (one of them reading slowly) follow the run live
+
+run from the repo root with
+python3 -m scripts.bench_e2e --distance 0.5 --sweep-time 0.05
+"""
+import argparse
+import asyncio
+import glob
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+os.environ["ROVER_SIM"] = "1"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from move import RobotMove
+from radar.catalog import Catalog
+from radar.migration import MIGRATED_SUFFIX
+from radar.spatial import POSE_FILE
+from radar.sweep import VNAGPR
+from sim.robot import FakeRobot
+from sim.vna import FakeLibreVNA
+from webserver import RobotServer
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def dzt_finished(path):
+    """ header written (an incremental DZT gets it last), placed along the path if there's a pose log"""
+    with open(path, 'rb') as fh:
+        if fh.read(2) != b'\x00\x07':
+            return False
+    if os.path.exists(os.path.join(path[:-1], POSE_FILE)):
+        return os.path.exists(path + '.poses.csv')
+    return True
+
+
+async def wait_for_dzt(pattern, timeout):
+    """ path of the first finished DZT matching pattern once its size stops changing"""
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+        for path in glob.glob(pattern):
+            size = os.path.getsize(path)
+            if size > 1024 and size == last and dzt_finished(path):
+                return path
+            last = size
+        await asyncio.sleep(0.05)
+    raise TimeoutError("no DZT written within {} s".format(timeout))
+
+
+async def watch(http, url, stats, delay, **params):
+    """ reads /radargram frames until the connection closes, sleeping delay after each"""
+    async with http.ws_connect(url + "/radargram", params=params) as ws:
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                traces = int.from_bytes(msg.data[4:6], 'little')
+                stats["frames"] += 1
+                stats["traces"] += traces
+                stats["bytes"] += len(msg.data)
+                if "first" not in stats:
+                    stats["first"] = time.monotonic()
+                await asyncio.sleep(delay)
+            elif msg.type == aiohttp.WSMsgType.TEXT:
+                stats["axis"] = msg.json()
+
+
+async def run(args):
+    robot = await FakeRobot(latency=args.latency, push_port=free_port(socket.SOCK_DGRAM)).start()
+    vna = await FakeLibreVNA(latency=args.latency, sweep_time=args.sweep_time).start()
+    RobotMove.robot_ip = '127.0.0.1'
+    RobotMove.ctrl_port, RobotMove.event_port = robot.ctrl_port, robot.event_port
+    RobotMove.push_port = robot.push_port
+    VNAGPR.host, VNAGPR.port = '127.0.0.1', vna.port
+    RobotMove.incremental_tdr = not args.batch
+
+    server = RobotServer()
+    server.http_address, server.http_port = '127.0.0.1', free_port()
+    serving = asyncio.ensure_future(server.http_server())
+    url = "http://127.0.0.1:{}".format(server.http_port)
+    cpu = cpu_seconds(resource.RUSAGE_SELF)
+    try:
+        async with aiohttp.ClientSession() as http:
+            while True:
+                try:
+                    async with http.get(url + "/status") as r:
+                        status = await r.json()
+                    if status["vna"]["connected"]:
+                        break
+                except (aiohttp.ClientError, AttributeError, KeyError):
+                    pass
+                await asyncio.sleep(0.1)
+
+            watchers = []
+            if args.watch:
+                # a display showing every trace, and a slow one asking for full length traces
+                watchers = [dict(frames=0, traces=0, bytes=0, delay=0.0, every=1, samples=512),
+                            dict(frames=0, traces=0, bytes=0, delay=1.0, every=1, samples=16384)]
+                tasks = [asyncio.ensure_future(watch(http, url, w, w["delay"], every=w["every"],
+                                                     samples=w["samples"], queue=4))
+                         for w in watchers]
+                await asyncio.sleep(0.2)
+            start = time.monotonic()
+            params = {"distance": args.distance, "pattern": "line", "record_gpr": 1}
+            if args.processing:
+                params["processing"] = args.processing
+            if args.migration:
+                params["migration"] = args.migration
+            async with http.get(url + "/start", params=params) as r:
+                r.raise_for_status()
+                await r.json()
+            while True:
+                await asyncio.sleep(0.1)
+                async with http.get(url + "/status") as r:
+                    status = await r.json()
+                if not status["is_running"]:
+                    break
+            moved = time.monotonic() - start
+            dzt = await wait_for_dzt("data/*o", args.timeout)
+            to_dzt = time.monotonic() - start
+            if args.migration:
+                migrated = await wait_for_dzt("data/*o" + MIGRATED_SUFFIX, args.timeout)
+                to_migrated = time.monotonic() - start
+            if watchers:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        serving.cancel()
+        await asyncio.gather(serving, return_exceptions=True)
+        await server.vna_session.stop()
+        await vna.stop()
+        await robot.stop()
+    cpu = cpu_seconds(resource.RUSAGE_SELF) - cpu
+    RobotMove.process_executor.shutdown()
+
+    acquisition = status["vna"].get("acquisition", {})
+    print("{} m line, simulated sweep time {:.0f} ms, {} TDR".format(
+        args.distance, args.sweep_time * 1000, "post-run" if args.batch else "incremental"))
+    print("sweeps captured  {}".format(acquisition.get("sweeps")))
+    print("sweeps/s         {:.2f}".format(acquisition.get("sweeps_per_second", 0.0)))
+    print("pipeline         {}".format(status["vna"].get("pipeline")))
+    print("leg              {}".format("closed loop" if "last_leg" in status else "open loop"))
+    print("motion done      {:.2f} s".format(moved))
+    print("time to DZT      {:.2f} s ({:.2f} s after motion), {} bytes".format(
+        to_dzt, to_dzt - moved, os.path.getsize(dzt)))
+    print("CPU              {:.2f} s server, {:.2f} s TDR workers".format(
+        cpu, cpu_seconds(resource.RUSAGE_CHILDREN)))
+    print("peak RSS         {:.1f} MB server, {:.1f} MB largest worker".format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024))
+    for w in watchers:
+        print("live client {samples} samples, {delay} s per frame: {frames} frames, {traces} traces, "
+              "{bytes} bytes, first after {0:.2f} s".format(w.get("first", start) - start, **w))
+    if args.migration:
+        print("migrated         {:.2f} s after /start, {} bytes".format(to_migrated, os.path.getsize(migrated)))
+    processing = Catalog().scans().get(os.path.basename(dzt)[:-1], {}).get("processing", [])
+    for stage in processing:
+        print("processing       {stage:22s} {seconds:.3f} s, {us_per_trace} us/trace".format(**stage))
+    for client in status.get("live", {}).get("clients", []):
+        print("live server side {}".format(client))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-d", "--distance", type=float, default=0.5,
+                    help="line length in meters, the rover drives 1.05x this at 0.1 m/s")
+    parser.add_argument("-t", "--sweep-time", type=float, default=0.05,
+                    help="simulated VNA sweep time in seconds")
+    parser.add_argument("-l", "--latency", type=float, default=0.002,
+                    help="simulated reply latency in seconds")
+    parser.add_argument("-w", "--watch", action="store_true",
+                    help="follow the run with a fast and a slow /radargram client")
+    parser.add_argument("-b", "--batch", action="store_true",
+                    help="run TDR over the scan folder after the capture instead of during it")
+    parser.add_argument("-p", "--processing", type=str, default=None,
+                    help="processing stages for the run, see radar/processing.py")
+    parser.add_argument("-m", "--migration", type=str, default=None,
+                    help="migration of the finished profile, see radar/migration.py")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                    help="seconds to wait for the DZT after the run")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="roverboard-e2e-")
+    # scans land in ./data like on the rover
+    os.chdir(workdir)
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Reports TDR.listFolder throughput as the process pool grows
+
+run from the repo root with
+python3 -m scripts.bench_listfolder -n 500
+"""
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+import datetime
+
+from radar.tdr import TDR
+from scripts.bench_tdr import synthetic_sweeps
+
+
+def write_scan(directory, n_traces, n_points):
+    freq, s21 = synthetic_sweeps(n_traces, n_points)
+    start = datetime.datetime(2021, 1, 1)
+    for i, trace in enumerate(s21):
+        name = (start + datetime.timedelta(seconds=0.1 * i)).isoformat()
+        with open(os.path.join(directory, name), 'w') as e:
+            writer = csv.writer(e)
+            for f, v in zip(freq, trace):
+                writer.writerow((f, v.real, v.imag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--traces", type=int, default=300,
+                    help="number of sweep files")
+    parser.add_argument("-p", "--points", type=int, default=200,
+                    help="frequency points per sweep")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                    help="largest pool to try")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        scan = os.path.join(tmp, 'scan')
+        os.makedirs(scan)
+        write_scan(scan, args.traces, args.points)
+
+        base = None
+        print("workers  seconds  traces/s  scaling")
+        for workers in range(1, args.workers + 1):
+            t = time.perf_counter()
+            TDR(use_csv=True).listFolder(scan + '/', os.path.join(tmp, 'out.DZT'), workers=workers)
+            elapsed = time.perf_counter() - t
+            base = base or elapsed
+            print("{:7d}  {:7.2f}  {:8.1f}  {:6.2f}x".format(
+                workers, elapsed, args.traces / elapsed, base / elapsed))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
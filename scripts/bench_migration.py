@@ -0,0 +1,113 @@
+"""
+Seconds per 100 m of profile for Stolt and Kirchhoff migration, migrated in
+overlapping chunks as on the rover. the synthetic profile has a point
+target every few meters, generated a chunk at a time so memory stays
+bounded; focus is the share of each target's energy within 5 traces of its
+apex before and after migration
+
+run from the repo root with
+python3 -m scripts.bench_migration --length 100 --samples 1024
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from radar.migration import Kirchhoff, Stolt, migrate
+
+
+class Profile(object):
+    """ point targets on a line, traces computed when sliced"""
+
+    def __init__(self, length, spm, time_ns, velocity, spacing=5.0, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dx = 1.0 / spm
+        self.time_ns = time_ns
+        self.count = int(length * spm)
+        self.velocity = velocity
+        x0 = np.arange(spacing / 2, length, spacing)
+        t0 = rng.uniform(0.2, 0.8, len(x0)) * time_ns[-1]
+        self.targets = list(zip(x0, t0))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        x = np.arange(self.count)[index] * self.dx
+        traces = np.zeros((len(x), len(self.time_ns)), dtype=np.float32)
+        for x0, t0 in self.targets:
+            near = np.abs(x - x0) < 4.0
+            if not near.any():
+                continue
+            t = np.sqrt(t0 ** 2 + (2 * (x[near] - x0) / self.velocity) ** 2)
+            # Ricker wavelet, 800 MHz
+            a = (np.pi * 0.8 * (self.time_ns[None, :] - t[:, None])) ** 2
+            traces[near] += ((1 - 2 * a) * np.exp(-a)).astype(np.float32)
+        return traces
+
+
+def focus(profile, image_at):
+    """ mean share of energy within 5 traces of each target's apex, in a 2 m x 1 ns box"""
+    shares = []
+    half, rows = int(1.0 / profile.dx), 5
+    dt = profile.time_ns[1] - profile.time_ns[0]
+    for x0, t0 in profile.targets:
+        i, j = int(round(x0 / profile.dx)), int(round(t0 / dt))
+        if i - half < 0 or i + half >= len(profile):
+            continue
+        box = image_at(i - half, i + half + 1)[:, max(j - int(1 / dt), 0):j + int(1 / dt)] ** 2
+        shares.append(box[half - rows:half + rows + 1].sum() / box.sum())
+    return float(np.mean(shares))
+
+
+def run(profile, method, chunk):
+    """ migrates the profile, returns seconds, peak traced memory and the image rows around targets"""
+    keep = {}
+    tracemalloc.start()
+    start = time.perf_counter()
+    row = 0
+    for image in migrate(profile, profile.time_ns, profile.dx, method, chunk=chunk):
+        for x0, _ in profile.targets:
+            i = int(round(x0 / profile.dx))
+            # only the rows the focus measure needs are kept
+            lo, hi = max(i - 60, row), min(i + 61, row + len(image))
+            for r in range(lo, hi):
+                keep[r] = image[r - row].copy()
+        row += len(image)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, lambda a, b: np.array([keep[r] for r in range(a, b)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-l", "--length", type=float, default=100.0, help="profile length in m")
+    parser.add_argument("--spm", type=float, default=50.0, help="scans per meter")
+    parser.add_argument("-s", "--samples", type=int, default=1024, help="samples per trace")
+    parser.add_argument("-r", "--range-ns", type=float, default=30.0, help="time window of a trace")
+    parser.add_argument("-v", "--velocity", type=float, default=0.1, help="m/ns")
+    parser.add_argument("-a", "--aperture", type=float, default=2.0, help="Kirchhoff aperture in m")
+    parser.add_argument("-c", "--chunk", type=int, default=256, help="traces per chunk")
+    args = parser.parse_args()
+
+    time_ns = np.linspace(0, args.range_ns, args.samples)
+    profile = Profile(args.length, args.spm, time_ns, args.velocity)
+    raw = focus(profile, lambda a, b: profile[a:b])
+    print("{:.0f} m at {:.0f} scans/m, {} traces x {} samples, {} targets, focus before {:.2f}".format(
+        args.length, args.spm, len(profile), args.samples, len(profile.targets), raw))
+    for method in (Stolt(args.velocity), Kirchhoff(args.velocity, args.aperture),
+                   Kirchhoff(args.velocity, args.aperture, 0.8 * args.velocity)):
+        elapsed, peak, image_at = run(profile, method, args.chunk)
+        label = method.name
+        if isinstance(method, Kirchhoff):
+            label += " {:.0f} m, v {:g}-{:g}".format(method.aperture, method.velocity, method.velocity_end)
+        print("{:28s} {:7.2f} s per 100 m  {:8.0f} traces/s  peak {:7.1f} MB  focus {:.2f}".format(
+            label, elapsed * 100 / args.length, len(profile) / elapsed, peak / 2**20,
+            focus(profile, image_at)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Straight scan legs against the simulated rover: open loop timing versus the
+closed loop leg controller, with a heading drift on the chassis
+
+run from the repo root with
+python3 -m scripts.bench_motion --drift 3 --rate 20
+"""
+import argparse
+import asyncio
+import math
+
+from motion import LegController
+from sdk import CommandChannel
+from sim.robot import FakeRobot
+from telemetry import Telemetry
+
+
+def leg_errors(robot, distance):
+    """ along / cross track error and heading of the robot after an x leg from the origin"""
+    return robot.x - distance, robot.y, robot.yaw
+
+
+async def open_loop(robot, channel, distance, speed):
+    await channel.send("chassis speed x {}".format(speed))
+    await asyncio.sleep(distance / speed)
+    await channel.send("chassis speed x 0")
+
+
+async def run(distance, speed, drift, rate, latency):
+    robot = await FakeRobot(latency=latency, yaw_drift=drift).start()
+    telemetry = Telemetry(push_port=0)
+    await telemetry.start(host='127.0.0.1')
+    robot.push_port = telemetry.transport.get_extra_info('sockname')[1]
+    try:
+        reader, writer = await asyncio.open_connection(robot.host, robot.ctrl_port)
+        channel = CommandChannel(reader, writer).start()
+        await channel.send("chassis push position on pfreq {0} attitude on afreq {0}".format(rate))
+
+        await open_loop(robot, channel, distance, speed)
+        opened = leg_errors(robot, distance)
+
+        robot.x = robot.y = robot.yaw = 0.0
+        await asyncio.sleep(3.0 / rate)
+        controller = LegController(telemetry, channel, rate=rate)
+        result = await controller.run(distance, axis='x', speed=speed)
+        closed = leg_errors(robot, distance)
+        await channel.close()
+    finally:
+        await telemetry.stop()
+        await robot.stop()
+
+    print("{} m leg at {} m/s, heading drift {} deg/s, telemetry {} Hz".format(distance, speed, drift, rate))
+    for name, (along, cross, yaw) in (("open loop", opened), ("closed loop", closed)):
+        print("{:12s} along {:+7.3f} m  cross {:+7.3f} m  heading {:+6.2f} deg".format(name, along, cross, yaw))
+    timing = result["timing"]
+    print("control loop: {} iterations, mean period {:.1f} ms (target {:.1f}), jitter std {:.2f} ms, max {:.2f} ms".format(
+        timing["iterations"], timing["mean_period"] * 1000, 1000.0 / rate,
+        timing["jitter_std"] * 1000, timing["max_jitter"] * 1000))
+    print("max |cross track| during leg {:.4f} m".format(max(abs(row[2]) for row in controller.log)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-d", "--distance", type=float, default=1.0,
+                    help="leg length in meters")
+    parser.add_argument("-s", "--speed", type=float, default=0.2,
+                    help="leg speed in m/s")
+    parser.add_argument("--drift", type=float, default=3.0,
+                    help="simulated heading drift in deg/s while translating")
+    parser.add_argument("-r", "--rate", type=int, default=20,
+                    help="telemetry push / control rate in Hz")
+    parser.add_argument("-l", "--latency", type=float, default=0.005,
+                    help="simulated command latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(run(args.distance, args.speed, args.drift, args.rate, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Microbenchmarks for parsing :VNA:TRACE:DATA? responses
+
+run from the repo root with
+python3 -m scripts.bench_parse
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from radar.libreVNA import libreVNA
+
+
+def trace_response(points, seed=0):
+    """ a response line shaped like LibreVNA-GUI's, as bytes"""
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(10e6, 3e9, points)
+    values = rng.standard_normal((points, 2)) * 0.1
+    return ','.join('[{!r},{!r},{!r}]'.format(f, re, im)
+                    for f, (re, im) in zip(freq.tolist(), values.tolist())).encode()
+
+
+def legacy_parse(data):
+    """ the original str.split / float() parser"""
+    ret = []
+    data = data.replace(']','').replace('[','')
+    values = data.split(',')
+    if int(len(values) / 3) * 3 != len(values):
+        raise Exception("Invalid input data: expected tuples of three values each")
+    for i in range(0, len(values), 3):
+        ret.append((float(values[i]), complex(float(values[i+1]), float(values[i+2]))))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=200,
+                    help="parses per measurement")
+    args = parser.parse_args()
+
+    print("points  legacy ms  array ms  cached axis ms  speedup")
+    for points in (200, 1001, 2000, 4001):
+        raw = trace_response(points)
+        text = raw.decode()
+        freq, s21 = libreVNA.parse_trace_array(raw)
+        old = legacy_parse(text)
+        assert np.array_equal(freq, [f for f, _ in old])
+        assert np.array_equal(s21, [v for _, v in old])
+        assert np.array_equal(s21, libreVNA.parse_trace_values(raw, freq))
+
+        t_old = min(timeit.repeat(lambda: legacy_parse(raw.decode()), number=args.number, repeat=3))
+        t_new = min(timeit.repeat(lambda: libreVNA.parse_trace_array(raw), number=args.number, repeat=3))
+        t_cached = min(timeit.repeat(lambda: libreVNA.parse_trace_values(raw, freq), number=args.number, repeat=3))
+        print("{:6d}  {:9.3f}  {:8.3f}  {:14.3f}  {:6.1f}x".format(
+            points, 1000 * t_old / args.number, 1000 * t_new / args.number,
+            1000 * t_cached / args.number, t_old / t_cached))
+
+
+if __name__ == "__main__":
+    main()
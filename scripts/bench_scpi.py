@@ -0,0 +1,74 @@
+"""
+Sequential vs pipelined SCPI sweep setup against a local fake LibreVNA-GUI
+
+run from the repo root with
+python3 -m scripts.bench_scpi --latency 0.005
+"""
+import argparse
+import asyncio
+import time
+
+from radar.libreVNA import libreVNA
+from radar.sweep import VNAGPR
+from sim.vna import FakeLibreVNA
+
+
+async def setup_commands():
+    """ the full set of commands VNAGPR.scan sends on a fresh connection"""
+    sent = []
+
+    class Recorder(object):
+        async def batch(self, cmds, timeout=None):
+            sent.extend(cmds)
+        async def query(self, query, timeout=None):
+            return "TRUE"
+
+    gpr = VNAGPR()
+    gpr.vna = Recorder()
+    await gpr.scan()
+    return sent
+
+
+async def run(latency, repeat):
+    fake = await FakeLibreVNA(latency=latency).start()
+    vna = libreVNA(fake.host, fake.port)
+    await vna.connect()
+    cmds = await setup_commands()
+    try:
+        t = time.perf_counter()
+        for _ in range(repeat):
+            for c in cmds:
+                await vna.cmd(c)
+        sequential = (time.perf_counter() - t) / repeat
+        trips_sequential = vna.round_trips / repeat
+
+        vna.round_trips = 0
+        t = time.perf_counter()
+        for _ in range(repeat):
+            await vna.batch(cmds)
+        pipelined = (time.perf_counter() - t) / repeat
+        trips_pipelined = vna.round_trips / repeat
+    finally:
+        await vna.close()
+        await fake.stop()
+
+    print("setup commands: {}, simulated latency {:.1f} ms".format(len(cmds), latency * 1000))
+    print("sequential: {:7.2f} ms  {:4.0f} round trips".format(sequential * 1000, trips_sequential))
+    print("pipelined:  {:7.2f} ms  {:4.0f} round trips".format(pipelined * 1000, trips_pipelined))
+    print("round trips saved: {:.0f}, speedup {:.1f}x".format(
+        trips_sequential - trips_pipelined, sequential / pipelined))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-l", "--latency", type=float, default=0.002,
+                    help="simulated response latency in seconds")
+    parser.add_argument("-n", "--repeat", type=int, default=20,
+                    help="setups per measurement")
+    args = parser.parse_args()
+    asyncio.run(run(args.latency, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
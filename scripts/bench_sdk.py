@@ -0,0 +1,103 @@
+"""
+SDK command channel against a local fake robot: latency, pipelining and
+reply mix-ups under concurrent callers, compared with the old bare
+write / read(1024) path
+
+run from the repo root with
+python3 -m scripts.bench_sdk --latency 0.005
+"""
+import argparse
+import asyncio
+import time
+
+from sdk import CommandChannel
+from sim.robot import FakeRobot
+
+
+async def legacy_send(reader, writer, command):
+    """ the original RobotMove.send_command"""
+    writer.write((command + ';').encode("utf8"))
+    try:
+        result = await asyncio.wait_for(reader.read(1024), timeout=3.0)
+    except asyncio.TimeoutError:
+        return None
+    return result.decode().strip()
+
+
+async def mixups(send, n):
+    """ runs speed commands and position queries concurrently, counts wrong or failed replies"""
+    wrong = 0
+
+    async def checked(command, ok):
+        nonlocal wrong
+        try:
+            reply = await send(command)
+        except RuntimeError:
+            # two readers waiting on the same socket
+            reply = None
+        wrong += reply is None or not ok(reply.rstrip(';'))
+
+    async def speeds():
+        for i in range(n):
+            await checked("chassis speed x {}".format(i % 3 / 10), lambda r: r == 'ok')
+
+    async def positions():
+        for i in range(n):
+            await checked("chassis position ?", lambda r: len(r.split()) == 3)
+
+    await asyncio.gather(speeds(), positions())
+    return wrong
+
+
+async def run(latency, n):
+    robot = await FakeRobot(latency=latency).start()
+    try:
+        reader, writer = await asyncio.open_connection(robot.host, robot.ctrl_port)
+        t = time.perf_counter()
+        for i in range(n):
+            await legacy_send(reader, writer, "chassis speed x 0.1")
+        legacy = time.perf_counter() - t
+        legacy_wrong = await mixups(lambda c: legacy_send(reader, writer, c), n)
+        writer.close()
+
+        reader, writer = await asyncio.open_connection(robot.host, robot.ctrl_port)
+        channel = CommandChannel(reader, writer).start()
+        t = time.perf_counter()
+        for i in range(n):
+            await channel.send("chassis speed x 0.1")
+        awaited = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for i in range(n - 1):
+            channel.send_nowait("chassis speed x 0.1")
+        await channel.send("chassis speed x 0")
+        pipelined = time.perf_counter() - t
+        channel_wrong = await mixups(channel.send, n)
+        stats = channel.stats.to_dict()
+        await channel.close()
+    finally:
+        await robot.stop()
+
+    print("{} speed commands, simulated latency {:.1f} ms".format(n, latency * 1000))
+    print("legacy send_command: {:8.2f} ms".format(legacy * 1000))
+    print("channel, awaited:    {:8.2f} ms".format(awaited * 1000))
+    print("channel, pipelined:  {:8.2f} ms".format(pipelined * 1000))
+    print("wrong replies with concurrent callers: legacy {}, channel {}".format(legacy_wrong, channel_wrong))
+    for name, s in sorted(stats.items()):
+        print("  {:18s} n={count:5d} mean {mean_ms:6.2f} ms  max {max_ms:6.2f} ms".format(
+            name, count=s['count'], mean_ms=s['mean'] * 1000, max_ms=s['max'] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-l", "--latency", type=float, default=0.002,
+                    help="simulated reply latency in seconds")
+    parser.add_argument("-n", "--commands", type=int, default=100,
+                    help="commands per measurement")
+    args = parser.parse_args()
+    asyncio.run(run(args.latency, args.commands))
+
+
+if __name__ == "__main__":
+    main()
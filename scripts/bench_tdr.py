@@ -0,0 +1,105 @@
+"""
+Compares the per-sample TDR / DZT path with the vectorized BatchTDR engine,
+and with an FFT planned for a shorter depth range or a chirp-z zoom onto it
+
+run from the repo root with
+python3 -m scripts.bench_tdr -n 200 --range-ns 30
+"""
+import argparse
+import time
+
+import numpy as np
+import scipy.signal as signal
+
+from radar.tdr import BatchTDR, dzt_body, FFT_POINTS
+
+
+def synthetic_sweeps(n_traces, n_points, start=10e6, stop=3e9, seed=0):
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(start, stop, n_points)
+    delays = rng.uniform(1e-9, 20e-9, size=(n_traces, 1))
+    s21 = 0.5 * np.exp(-2j * np.pi * freq * delays)
+    s21 += 0.01 * (rng.standard_normal(s21.shape) + 1j * rng.standard_normal(s21.shape))
+    return freq, s21
+
+
+def legacy(freq, s21):
+    """ the original TDR.calcTDR + TDR.writeDZT loops, one trace at a time"""
+    body = bytearray()
+    for trace in s21:
+        s = []
+        for d in range(0, len(freq)):
+            s.append(complex(trace[d].real, trace[d].imag))
+        window = np.blackman(len(freq))
+        td = np.abs(np.fft.ifft(window * s, FFT_POINTS))
+        step_response = signal.convolve(td, np.ones(FFT_POINTS))
+        50 * (1 + step_response) / (1 - step_response)
+        for m in td:
+            val = int(m * 10**7)
+            body += val.to_bytes(2, byteorder="little")
+    return bytes(body)
+
+
+def batched(freq, s21, **kwargs):
+    engine = BatchTDR(freq, **kwargs)
+    return dzt_body(engine.calc(s21, impedance=True))
+
+
+def per_trace(freq, s21, **kwargs):
+    """ one engine and calc per trace, as TDR.calcTDR does"""
+    for trace in s21:
+        BatchTDR(freq, **kwargs).calc(trace, impedance=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--traces", type=int, default=100,
+                    help="number of traces")
+    parser.add_argument("-p", "--points", type=int, default=200,
+                    help="frequency points per sweep")
+    parser.add_argument("-r", "--range-ns", type=float, default=30.0,
+                    help="depth range to plan the FFT for")
+    args = parser.parse_args()
+
+    freq, s21 = synthetic_sweeps(args.traces, args.points)
+
+    t = time.perf_counter()
+    old = legacy(freq, s21)
+    t_old = time.perf_counter() - t
+
+    t = time.perf_counter()
+    new = batched(freq, s21)
+    t_new = time.perf_counter() - t
+
+    t = time.perf_counter()
+    per_trace(freq, s21)
+    t_single = time.perf_counter() - t
+
+    planned = BatchTDR(freq, range_ns=args.range_ns)
+    t = time.perf_counter()
+    batched(freq, s21, range_ns=args.range_ns)
+    t_planned = time.perf_counter() - t
+
+    zoom = BatchTDR(freq, zoom_ns=(0.0, args.range_ns))
+    t = time.perf_counter()
+    zoomed = batched(freq, s21, zoom_ns=(0.0, args.range_ns))
+    t_zoom = time.perf_counter() - t
+
+    print("traces: {} points: {}".format(args.traces, args.points))
+    print("legacy:  {:.3f} s ({:.2f} ms/trace)".format(t_old, 1000 * t_old / args.traces))
+    print("batched: {:.3f} s ({:.2f} ms/trace)".format(t_new, 1000 * t_new / args.traces))
+    print("speedup: {:.1f}x".format(t_old / t_new))
+    print("calcTDR: {:.3f} s ({:.2f} ms/trace)".format(t_single, 1000 * t_single / args.traces))
+    print("planned for {} ns ({}-point FFT, {} samples): {:.3f} s ({:.3f} ms/trace, {:.0f}x legacy)".format(
+        args.range_ns, planned.fft_points, planned.n_samples, t_planned,
+        1000 * t_planned / args.traces, t_old / t_planned))
+    print("chirp-z 0-{} ns ({}-point FFTs, {} samples): {:.3f} s ({:.3f} ms/trace, {:.0f}x legacy)".format(
+        args.range_ns, zoom.fft_points, zoom.n_samples, t_zoom,
+        1000 * t_zoom / args.traces, t_old / t_zoom))
+    print("DZT bytes per trace: {} full, {} zoomed".format(len(new) // args.traces, len(zoomed) // args.traces))
+    print("identical DZT body: {}".format(old == new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Concurrency safe command channel for the RoboMaster SDK control socket
+
+every command goes through one writer task, replies are framed on the SDK's
+';' terminator and matched to commands in the order they were sent, so
+concurrent HTTP handlers can't read each other's replies. commands don't wait
+for the previous reply before being written, fire-and-forget commands (speed
+updates) are pipelined and their replies discarded
+
+the plaintext SDK doesn't echo anything that ties a reply to its command, so
+once a reply is overdue the channel resyncs: writes pause until the socket
+has been quiet for resync_quiet seconds, every reply still owed is given up
+on (None) and matching starts over, instead of each later reply going to
+the command before it
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from telemetry import FrameParser
+
+logger = logging.getLogger(__name__)
+
+
+class CommandStats(object):
+    """ reply latency per command name ("chassis speed", "chassis position" ...)"""
+
+    def __init__(self):
+        self.count = collections.Counter()
+        self.total = collections.Counter()
+        self.max = {}
+        self.timeouts = collections.Counter()
+
+    @staticmethod
+    def name(command):
+        return ' '.join(command.split()[:2])
+
+    def record(self, command, latency):
+        name = self.name(command)
+        self.count[name] += 1
+        self.total[name] += latency
+        self.max[name] = max(self.max.get(name, 0.0), latency)
+
+    def to_dict(self):
+        return {name: {"count": n, "mean": self.total[name] / n, "max": self.max[name],
+                       "timeouts": self.timeouts[name]}
+                for name, n in self.count.items()}
+
+
+class CommandChannel(object):
+
+    # seconds to wait for a reply
+    timeout = 3.0
+    # seconds without data before replies in flight are given up on
+    resync_quiet = 0.5
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue()
+        # (command, future, sent time) awaiting a reply, in send order
+        self.inflight = collections.deque()
+        self.stats = CommandStats()
+        self.tasks = []
+        self.parser = FrameParser()
+        self.last_read = 0.0
+        self.synced = asyncio.Event()
+        self.synced.set()
+        self.resyncs = 0
+        self.resync_task = None
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.ensure_future(self._write_loop()),
+                          asyncio.ensure_future(self._read_loop())]
+        return self
+
+    async def close(self):
+        for task in self.tasks + [self.resync_task]:
+            if task is not None:
+                task.cancel()
+        self.tasks = []
+        self.resync_task = None
+        self._fail(ConnectionError("command channel closed"))
+        self.writer.close()
+
+    def _fail(self, exc):
+        while self.inflight:
+            _, future, _ = self.inflight.popleft()
+            if future is not None and not future.done():
+                future.set_exception(exc)
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if future is not None and not future.done():
+                future.set_exception(exc)
+
+    def _overdue(self):
+        return bool(self.inflight) and time.perf_counter() - self.inflight[0][2] > self.timeout
+
+    def _resync(self):
+        if self.synced.is_set():
+            self.synced.clear()
+            self.resync_task = asyncio.ensure_future(self._drain())
+
+    async def _drain(self):
+        """ waits for the socket to go quiet, then drops every reply still owed"""
+        while True:
+            quiet = time.perf_counter() - self.last_read
+            if quiet >= self.resync_quiet:
+                break
+            await asyncio.sleep(self.resync_quiet - quiet)
+        logger.warning("resyncing command channel, dropping %d replies in flight", len(self.inflight))
+        while self.inflight:
+            _, future, _ = self.inflight.popleft()
+            if future is not None and not future.done():
+                future.set_result(None)
+        self.parser = FrameParser()
+        self.resyncs += 1
+        self.synced.set()
+
+    async def _write_loop(self):
+        while True:
+            command, future = await self.queue.get()
+            if self._overdue():
+                # a fire-and-forget command's reply went missing
+                self._resync()
+            await self.synced.wait()
+            self.inflight.append((command, future, time.perf_counter()))
+            self.writer.write((command + ';').encode("utf8"))
+            # let queued commands join this write before draining
+            if self.queue.empty():
+                await self.writer.drain()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    raise ConnectionError("robot closed the control socket")
+                self.last_read = time.perf_counter()
+                if not self.synced.is_set():
+                    # can't tell whose these are, dropped with the commands in flight
+                    logger.debug("discarding %r while resyncing", data)
+                    continue
+                for reply in self.parser.feed(data):
+                    if not self.inflight:
+                        logger.warning("unexpected reply %r", reply)
+                        continue
+                    command, future, sent = self.inflight.popleft()
+                    self.stats.record(command, time.perf_counter() - sent)
+                    if future is not None and not future.done():
+                        future.set_result(reply)
+        except ConnectionError as e:
+            logger.error("%s", e)
+            self._fail(e)
+
+    def send_nowait(self, command):
+        """ queues a command without waiting for (or keeping) its reply"""
+        self.queue.put_nowait((command, None))
+
+    async def send(self, command, timeout=None):
+        """ sends a command and returns its reply, None on timeout
+
+        a timeout resyncs the channel, so a reply that arrives late or not at
+        all can't be handed to a later command
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((command, future))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts[CommandStats.name(command)] += 1
+            self._resync()
+            return None
@@ -0,0 +1,48 @@
+"""
+Runs the fake robot and fake LibreVNA on their usual ports, start the
+webserver against them with
+
+python3 -m sim &
+ROVER_SIM=1 djihost=127.0.0.1 VNAHOST=127.0.0.1 python3 webserver.py
+"""
+import argparse
+import asyncio
+
+from sim.robot import FakeRobot
+from sim.vna import FakeLibreVNA
+
+
+async def run(args):
+    robot = await FakeRobot(args.host, ctrl_port=40923, event_port=40925, latency=args.latency,
+                            yaw_drift=args.drift).start()
+    vna = await FakeLibreVNA(args.host, port=19542, latency=args.latency,
+                             sweep_time=args.sweep_time).start()
+    print("fake robot on {}:{} / {}, fake LibreVNA on {}:{}".format(
+        args.host, robot.ctrl_port, robot.event_port, args.host, vna.port))
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await vna.stop()
+        await robot.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("-l", "--latency", type=float, default=0.002,
+                    help="simulated reply latency in seconds")
+    parser.add_argument("-t", "--sweep-time", type=float, default=0.05,
+                    help="simulated VNA sweep time in seconds")
+    parser.add_argument("--drift", type=float, default=0.0,
+                    help="simulated heading drift in deg/s while translating")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
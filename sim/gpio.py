@@ -0,0 +1,53 @@
+"""
+Stand-in for Jetson.GPIO when running without a Jetson
+
+implements the calls RobotMove makes and keeps the pin levels, with a
+timestamped log of every output change so runs can check the sprayer fired
+"""
+import time
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+mode = None
+pins = {}
+log = []
+
+
+def setmode(m):
+    global mode
+    mode = m
+
+
+def getmode():
+    return mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, initial=LOW):
+    pins[channel] = initial if direction == OUT else LOW
+
+
+def output(channel, value):
+    if channel not in pins:
+        raise RuntimeError("channel {} is not set up".format(channel))
+    pins[channel] = value
+    log.append((time.time(), channel, value))
+
+
+def input(channel):
+    return pins.get(channel, LOW)
+
+
+def cleanup(channel=None):
+    if channel is None:
+        pins.clear()
+    else:
+        pins.pop(channel, None)
@@ -0,0 +1,182 @@
+"""
+Fake RoboMaster SDK server for running without hardware
+
+serves the plaintext control port and the event port. every ';' terminated
+command gets one ';' terminated reply, `latency` seconds after it arrived,
+so pipelined commands share a single simulated round trip
+
+the chassis integrates the last speed command, with an optional heading
+drift while moving, and pushes its pose over UDP to the controlling host
+once "chassis push ... on" has been received
+"""
+import asyncio
+import logging
+import math
+import socket
+import time
+
+from telemetry import FrameParser
+
+logger = logging.getLogger(__name__)
+
+
+class FakeRobot(object):
+
+    # chassis integration step in seconds
+    step = 0.005
+
+    def __init__(self, host='127.0.0.1', ctrl_port=0, event_port=0, latency=0.0,
+                 push_port=40924, yaw_drift=0.0):
+        self.host = host
+        self.ctrl_port = ctrl_port
+        self.event_port = event_port
+        self.latency = latency
+        self.push_port = push_port
+        # deg/s of heading error while the chassis is translating
+        self.yaw_drift = yaw_drift
+        self.received = []
+        self.speed = (0.0, 0.0, 0.0)
+        self.x = self.y = self.yaw = 0.0
+        self.push_freq = 0
+        self.push_addr = None
+        self.pushes = 0
+        self.servers = []
+        self.connections = {}
+        self.tasks = []
+
+    async def start(self):
+        ctrl = await asyncio.start_server(self.handle_ctrl, self.host, self.ctrl_port)
+        event = await asyncio.start_server(self.handle_event, self.host, self.event_port)
+        self.ctrl_port = ctrl.sockets[0].getsockname()[1]
+        self.event_port = event.sockets[0].getsockname()[1]
+        self.servers = [ctrl, event]
+        self.push_transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, family=socket.AF_INET)
+        self.tasks = [asyncio.ensure_future(self._drive_loop()),
+                      asyncio.ensure_future(self._push_loop())]
+        return self
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.push_transport.close()
+        for server in self.servers:
+            server.close()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        for server in self.servers:
+            await server.wait_closed()
+        self.servers = []
+
+    def respond(self, command):
+        """ reply for one SDK command"""
+        self.received.append(command)
+        tokens = command.split()
+        if tokens[:2] == ['chassis', 'speed'] and len(tokens) > 2:
+            speed = list(self.speed)
+            for axis, value in zip(tokens[2::2], tokens[3::2]):
+                if axis in ('x', 'y', 'z'):
+                    speed['xyz'.index(axis)] = float(value)
+            self.speed = tuple(speed)
+            return 'ok'
+        if tokens[:2] == ['chassis', 'push']:
+            if 'pfreq' in tokens:
+                self.push_freq = float(tokens[tokens.index('pfreq') + 1])
+            elif 'position' in tokens and tokens[tokens.index('position') + 1] == 'on':
+                self.push_freq = 10
+            if 'position' in tokens and tokens[tokens.index('position') + 1] == 'off':
+                self.push_freq = 0
+            return 'ok'
+        if command == 'chassis position ?':
+            return '{} {} {}'.format(self.x, self.y, self.yaw)
+        if command == 'chassis attitude ?':
+            return '0 0 {}'.format(self.yaw)
+        if command == 'chassis speed ?':
+            return '{} {} {}'.format(*self.speed)
+        return 'ok'
+
+    def advance(self, dt):
+        """ integrates the body frame speed command over dt seconds"""
+        vx, vy, wz = self.speed
+        if vx or vy:
+            wz += self.yaw_drift
+        c, s = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        self.x += (c * vx - s * vy) * dt
+        self.y += (s * vx + c * vy) * dt
+        self.yaw = (self.yaw + wz * dt + 180.0) % 360.0 - 180.0
+
+    async def _drive_loop(self):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.step)
+            now = time.monotonic()
+            self.advance(now - last)
+            last = now
+
+    async def _push_loop(self):
+        while True:
+            if not self.push_freq or self.push_addr is None:
+                await asyncio.sleep(0.05)
+                continue
+            frame = 'chassis push position {:.4f} {:.4f} attitude 0 0 {:.2f} ;'.format(
+                self.x, self.y, self.yaw)
+            self.push_transport.sendto(frame.encode(), (self.push_addr, self.push_port))
+            self.pushes += 1
+            await asyncio.sleep(1.0 / self.push_freq)
+
+    async def handle_ctrl(self, reader, writer):
+        # pushes go to whoever is driving, like the robot does
+        self.push_addr = writer.get_extra_info('peername')[0]
+        # commands are stamped as they arrive and answered in order by a
+        # separate task, so a pipelined batch waits for one latency not many
+        commands = asyncio.Queue()
+        responder = asyncio.ensure_future(self._respond_loop(commands, writer))
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        parser = FrameParser()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                arrived = time.monotonic()
+                for command in parser.feed(data):
+                    await commands.put((arrived, command))
+        except ConnectionError:
+            pass
+        finally:
+            await commands.put(None)
+            await responder
+            writer.close()
+            del self.connections[task]
+
+    async def _respond_loop(self, commands, writer):
+        while True:
+            item = await commands.get()
+            if item is None:
+                return
+            arrived, command = item
+            reply = self.respond(command)
+            wait = arrived + self.latency - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                writer.write((reply + ';').encode())
+                await writer.drain()
+            except ConnectionError:
+                return
+
+    async def handle_event(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            del self.connections[task]
@@ -0,0 +1,147 @@
+"""
+Fake LibreVNA-GUI SCPI server for running without hardware
+
+every line gets one response line, after `latency` seconds measured from when
+the line arrived, so pipelined commands share a single simulated round trip
+
+with sweep_time set the fake sweeps continuously from the last settings
+change, :VNA:ACQ:FIN? reports whether a sweep has completed and
+:VNA:TRACE:DATA? returns a synthetic S21 of the last completed sweep: antenna
+coupling, the ground bounce and a buried reflector whose delay changes from
+sweep to sweep like a hyperbola as the rover passes over it
+"""
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FakeLibreVNA(object):
+
+    # (delay ns, amplitude) of the fixed reflections
+    reflections = [(1.0, 0.5), (3.0, 0.2)]
+    noise = 1e-3
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, sweep_time=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.sweep_time = sweep_time
+        self.received = []
+        self.settings = {}
+        self.server = None
+        self.connections = {}
+        self.sweep_start = time.monotonic()
+        self.traces = 0
+        self.cache = (None, None)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in self.connections.values():
+                writer.close()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    def respond(self, line):
+        """ response for one SCPI line"""
+        self.received.append(line)
+        cmd, _, value = line.partition(' ')
+        if cmd == '*IDN?':
+            return 'LibreVNA-GUI'
+        if cmd == ':DEV:CONN?':
+            return 'FAKE0001'
+        if cmd == ':VNA:ACQ:FIN?':
+            return 'TRUE' if self.sweep_index() >= 0 else 'FALSE'
+        if cmd == ':VNA:TRACE:DATA?':
+            return self.trace_data(max(self.sweep_index(), 0))
+        if cmd.endswith('?'):
+            return self.settings.get(cmd[:-1], '')
+        if value:
+            self.settings[cmd] = value
+            # a settings change restarts the sweep
+            self.sweep_start = time.monotonic()
+            self.cache = (None, None)
+        return ''
+
+    def sweep_index(self):
+        """ number of the last completed sweep, -1 while the first one runs"""
+        if not self.sweep_time:
+            self.traces += 1
+            return self.traces
+        return int((time.monotonic() - self.sweep_start) / self.sweep_time) - 1
+
+    def freq(self):
+        start = float(self.settings.get(':VNA:FREQuency:START', 10e6))
+        stop = float(self.settings.get(':VNA:FREQuency:STOP', 3e9))
+        points = int(self.settings.get(':VNA:ACQ:POINTS', 200))
+        return np.linspace(start, stop, points)
+
+    def s21(self, index, freq):
+        """ synthetic S21 of sweep index"""
+        rng = np.random.default_rng(index)
+        delays = [(d * 1e-9, a) for d, a in self.reflections]
+        # buried point target passing under the antenna every 400 sweeps
+        offset = (index % 400 - 200) / 200.0
+        delays.append((5e-9 * np.hypot(1.0, offset), 0.05))
+        s21 = sum(a * np.exp(-2j * np.pi * freq * d) for d, a in delays)
+        return s21 + self.noise * (rng.standard_normal(len(freq)) + 1j * rng.standard_normal(len(freq)))
+
+    def trace_data(self, index):
+        """ :VNA:TRACE:DATA? response, [freq,real,imag] per point"""
+        if self.cache[0] != index:
+            freq = self.freq()
+            s21 = self.s21(index, freq)
+            self.cache = (index, ','.join('[{!r},{!r},{!r}]'.format(f, re, im) for f, re, im in
+                                          zip(freq.tolist(), s21.real.tolist(), s21.imag.tolist())))
+        return self.cache[1]
+
+    async def handle(self, reader, writer):
+        # lines are stamped as they arrive and answered in order by a
+        # separate task, so a pipelined batch waits for one latency not many
+        lines = asyncio.Queue()
+        responder = asyncio.ensure_future(self._respond_loop(lines, writer))
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await lines.put((time.monotonic(), line.decode().strip()))
+        except ConnectionError:
+            pass
+        finally:
+            await lines.put(None)
+            await responder
+            writer.close()
+            del self.connections[task]
+
+    async def _respond_loop(self, lines, writer):
+        while True:
+            item = await lines.get()
+            if item is None:
+                return
+            arrived, line = item
+            response = self.respond(line)
+            if asyncio.iscoroutine(response):
+                response = await response
+            if isinstance(response, str):
+                response = response.encode()
+            wait = arrived + self.latency - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                writer.write(response + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                return
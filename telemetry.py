@@ -0,0 +1,196 @@
+"""
+Pose telemetry from the RoboMaster SDK push and event channels
+
+the robot sends push frames like
+    chassis push position 0.512 -0.031 attitude 0.2 -0.1 12.5 ;
+to UDP 40924 once "chassis push position on pfreq 10 attitude on afreq 10"
+has been sent on the control socket, and event frames on TCP 40925. frames
+are parsed incrementally from the byte stream, the latest pose is kept along
+with a timestamped ring buffer so readers never need a control round trip
+"""
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PUSH_PORT = 40924
+
+# number of values that follow each attribute in a push frame
+PUSH_FIELDS = {
+    ('chassis', 'position'): 2,
+    ('chassis', 'attitude'): 3,
+    ('chassis', 'status'): 11,
+    ('gimbal', 'attitude'): 2,
+}
+
+
+class FrameParser(object):
+    """ splits an SDK byte stream into ';' terminated frames, keeping partial data"""
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data):
+        self.buffer += data
+        *frames, self.buffer = self.buffer.split(b';')
+        return [f.decode(errors='replace').strip() for f in frames if f.strip()]
+
+
+def parse_push(frame):
+    """ returns {(module, attr): [floats]} for a push frame, {} if it isn't one"""
+    tokens = frame.split()
+    if len(tokens) < 3 or tokens[1] != 'push':
+        return {}
+    module, values, i = tokens[0], {}, 2
+    while i < len(tokens):
+        key = (module, tokens[i])
+        n = PUSH_FIELDS.get(key)
+        if n is None or i + n >= len(tokens):
+            logger.debug("unknown push attribute in %r", frame)
+            break
+        try:
+            values[key] = [float(v) for v in tokens[i + 1:i + 1 + n]]
+        except ValueError:
+            logger.debug("bad push values in %r", frame)
+            break
+        i += 1 + n
+    return values
+
+
+class PoseHistory(object):
+    """ fixed size ring buffer of (time, x, y, yaw) rows"""
+
+    def __init__(self, capacity=4096):
+        self.data = np.zeros((capacity, 4))
+        self.count = 0
+
+    def append(self, t, x, y, yaw):
+        self.data[self.count % len(self.data)] = (t, x, y, yaw)
+        self.count += 1
+
+    def array(self, since=None):
+        """ rows in time order, optionally only those after since"""
+        n = len(self.data)
+        if self.count <= n:
+            rows = self.data[:self.count]
+        else:
+            i = self.count % n
+            rows = np.concatenate([self.data[i:], self.data[:i]])
+        if since is not None:
+            rows = rows[rows[:, 0] > since]
+        return rows
+
+
+class PoseLog(object):
+    """ every pose of one run, grows for as long as the run records
+
+    the shared PoseHistory only holds the last capacity updates (about 200 s
+    at push_freq 20), too short for a long capture. starts with the poses
+    already in the history after since, so the first traces have a pose
+    """
+
+    def __init__(self, telemetry, since=None):
+        self.telemetry = telemetry
+        self.rows = [tuple(row) for row in telemetry.history.array(since=since)]
+
+    def __call__(self, telemetry):
+        self.rows.append((telemetry.updated, telemetry.x, telemetry.y, telemetry.yaw))
+
+    def start(self):
+        self.telemetry.listeners.append(self)
+        return self
+
+    def stop(self):
+        if self in self.telemetry.listeners:
+            self.telemetry.listeners.remove(self)
+
+    def array(self):
+        return np.array(self.rows, dtype=float).reshape(-1, 4)
+
+
+class _PushProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.parser = FrameParser()
+
+    def datagram_received(self, data, addr):
+        for frame in self.parser.feed(data):
+            self.telemetry.handle_push(frame)
+
+
+class Telemetry(object):
+    """ latest robot pose and recent history from the push / event channels"""
+
+    def __init__(self, capacity=4096, push_port=PUSH_PORT):
+        self.push_port = push_port
+        self.history = PoseHistory(capacity)
+        self.x = self.y = self.yaw = 0.0
+        self.pitch = self.roll = 0.0
+        self.updated = None
+        self.frames = 0
+        self.events = []
+        self.transport = None
+        self.event_task = None
+        self.listeners = []
+
+    def to_dict(self):
+        return {"x": self.x, "y": self.y, "z": self.yaw,
+                "age": None if self.updated is None else time.time() - self.updated,
+                "frames": self.frames}
+
+    def fresh(self, max_age=0.5):
+        return self.updated is not None and time.time() - self.updated < max_age
+
+    @property
+    def position(self):
+        return self.x, self.y, self.yaw
+
+    async def start(self, event_reader=None, host='0.0.0.0'):
+        loop = asyncio.get_event_loop()
+        if self.transport is None:
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: _PushProtocol(self), local_addr=(host, self.push_port))
+        if event_reader is not None and self.event_task is None:
+            self.event_task = asyncio.ensure_future(self.read_events(event_reader))
+
+    async def stop(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.event_task is not None:
+            self.event_task.cancel()
+            self.event_task = None
+
+    async def read_events(self, reader):
+        parser = FrameParser()
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                logger.warning("event channel closed")
+                return
+            for frame in parser.feed(data):
+                # events and pushes share the frame format
+                if not self.handle_push(frame):
+                    self.events.append((time.time(), frame))
+                    del self.events[:-100]
+
+    def handle_push(self, frame, t=None):
+        """ applies one frame to the pose, returns False if it carried no pose"""
+        values = parse_push(frame)
+        if not values:
+            return False
+        t = time.time() if t is None else t
+        if ('chassis', 'position') in values:
+            self.x, self.y = values[('chassis', 'position')]
+        if ('chassis', 'attitude') in values:
+            self.pitch, self.roll, self.yaw = values[('chassis', 'attitude')]
+        self.updated = t
+        self.frames += 1
+        self.history.append(t, self.x, self.y, self.yaw)
+        for listener in self.listeners:
+            listener(self)
+        return True
@@ -3,6 +3,12 @@ import aiohttp.web
 import logging
 import asyncio
 from move import RobotMove
+from radar.session import VNASession
+from radar.live import LiveRadargram, LiveClient
+from radar.debug import trace_dump
+from radar.processing import ProcessingChain
+from radar.tdr import BatchTDR
+from radar.migration import parse_migration
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +18,13 @@ class RobotServer(object):
 
     async def setup(self):
         """ runs any on-startup initialization"""
-        self.robot = RobotMove()
+        # connect to the VNA once and keep it configured between runs
+        self.vna_session = VNASession()
+        # traces computed as sweeps are captured, for /radargram clients
+        self.live = LiveRadargram().start()
+        self.vna_session.subscribers.append(self.live.feed)
+        await self.vna_session.start()
+        self.robot = RobotMove(vna_session=self.vna_session)
         await self.robot.connect()
 
     async def rest_start(self, request):
@@ -20,9 +32,23 @@ class RobotServer(object):
         distance = request.query.get('distance')
         pattern = request.query.get('pattern', "square")
         record_gpr = request.query.get('record_gpr', False)
+        # processing stages for the run's DZT, e.g. dewow:5,background:200,
+        # and a migration of the finished profile, e.g. stolt:0.1
+        # (an empty value is the same as leaving it out)
+        processing = request.query.get('processing') or None
+        migration = request.query.get('migration') or None
+        try:
+            chain = ProcessingChain.parse(processing)
+            if chain is not None:
+                # stages check their settings against the traces' time axis
+                # here rather than on the writer thread mid-capture
+                chain.setup(BatchTDR(self.vna_session.frequencies()).time)
+            parse_migration(migration)
+        except ValueError as e:
+            raise aiohttp.web.HTTPBadRequest(text=str(e))
         if not distance:
             distance = 1
-        await self.robot.start(float(distance), pattern, record_gpr)
+        await self.robot.start(float(distance), pattern, record_gpr, processing=processing, migration=migration)
         data = self.robot.to_dict()
         return aiohttp.web.json_response(data)
 
@@ -50,8 +76,52 @@ class RobotServer(object):
     async def rest_status(self, request):
 
         data = self.robot.to_dict()
+        data['vna'] = self.vna_session.to_dict()
+        data['live'] = self.live.to_dict()
+        dump = trace_dump()
+        if dump is not None:
+            data['trace_dump'] = dump.to_dict()
         return aiohttp.web.json_response(data)
 
+    async def rest_debug_trace(self, request):
+        """ dumps the next `count` traces to the TDR debug file, see radar/debug.py"""
+        dump = trace_dump()
+        if dump is None:
+            raise aiohttp.web.HTTPNotFound(text="trace dump disabled, set TDR_DEBUG_FILE")
+        try:
+            dump.request(int(request.query.get('count', 1)))
+        except ValueError as e:
+            raise aiohttp.web.HTTPBadRequest(text=str(e))
+        return aiohttp.web.json_response(dump.to_dict())
+
+    async def ws_radargram(self, request):
+        """ streams TDR traces of the running capture, see radar/live.py for the framing
+
+        query: every (send every nth trace), samples (per trace, from the
+        start of the time axis), dtype (uint16 or float16), queue (frames
+        buffered before the oldest is dropped)
+        """
+        try:
+            client_args = dict(every=int(request.query.get('every', 1)),
+                               samples=int(request.query.get('samples', 1024)),
+                               dtype=request.query.get('dtype', 'uint16'),
+                               queue=int(request.query.get('queue', 8)))
+            client = LiveClient(None, **client_args)
+        except ValueError as e:
+            raise aiohttp.web.HTTPBadRequest(text=str(e))
+        ws = aiohttp.web.WebSocketResponse(heartbeat=10.0)
+        await ws.prepare(request)
+        client.ws = ws
+        sender = asyncio.ensure_future(self.live.serve(client))
+        try:
+            # nothing is expected from the client, reading handles pings and close
+            async for msg in ws:
+                pass
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+        return ws
+
     async def http_server(self):
         self.http_app = aiohttp.web.Application()
         self.http_app.add_routes([
@@ -60,6 +130,8 @@ class RobotServer(object):
             aiohttp.web.get('/cancel', self.rest_cancel),
             aiohttp.web.get('/sprayer', self.rest_sprayer),
             aiohttp.web.get('/video_on', self.rest_video),
+            aiohttp.web.get('/radargram', self.ws_radargram),
+            aiohttp.web.get('/debug_trace', self.rest_debug_trace),
             ])
 
         self.http_runner = aiohttp.web.AppRunner(self.http_app)
@@ -104,5 +176,6 @@ class RobotServer(object):
         return loop.run_until_complete(self.http_server())
 
 
-server = RobotServer()
-server.main()
+if __name__ == "__main__":
+    server = RobotServer()
+    server.main()